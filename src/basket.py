@@ -0,0 +1,221 @@
+import numpy as np
+import pandas as pd
+
+
+def incidence_matrix(invoice_fct_df:pd.DataFrame):
+    '''
+    The invoice x StockCode incidence matrix of the purchases in compressed
+    sparse row form: the stock codes of basket b are
+    indices[indptr[b]:indptr[b + 1]], sorted and without repeats. Baskets
+    and stock codes are factorized into integer codes, labels holds the
+    stock code of every column.
+
+    Parameters
+    ----------
+    invoice_fct_df: pd.DataFrame
+        The InvoiceFact dataframe, the cancellations are left out
+
+    Returns
+    -------
+    tuple: (indptr, indices, labels)
+    '''
+
+    if not isinstance(invoice_fct_df, pd.DataFrame):
+        raise TypeError
+
+    required_columns = ["Invoice", "IsCancellation", "StockCode"]
+
+    if any(column not in invoice_fct_df.columns for column in required_columns):
+        raise KeyError
+
+    purchases = invoice_fct_df[invoice_fct_df['IsCancellation'].to_numpy() == 0]
+    baskets, _ = pd.factorize(purchases['Invoice'])
+    items, labels = pd.factorize(purchases['StockCode'], sort=True)
+
+    # one entry per (basket, item), sorted by basket and item
+    cells = np.unique(baskets.astype(np.int64) * max(len(labels), 1) + items)
+    rows, indices = np.divmod(cells, max(len(labels), 1))
+
+    n_baskets = baskets.max() + 1 if len(baskets) else 0
+    indptr = np.r_[0, np.cumsum(np.bincount(rows, minlength=n_baskets))]
+
+    return indptr, indices, np.asarray(labels)
+
+
+def _basket_pairs(indptr:np.ndarray, indices:np.ndarray, n:int) -> np.ndarray:
+    ''' The (i, j), i < j, pairs of items of every basket as i * n + j keys '''
+
+    ends = np.repeat(indptr[1:], np.diff(indptr))
+    positions = np.arange(indptr[0], indptr[-1])
+
+    # every position is paired with the positions after it in its basket
+    partners = ends - positions - 1
+    left = np.repeat(positions, partners)
+    starts = np.cumsum(partners) - partners
+    right = left + 1 + np.arange(len(left)) - np.repeat(starts, partners)
+
+    return indices[left].astype(np.int64) * n + indices[right]
+
+
+def _merge_counts(keys:list, counts:list):
+    ''' Sums the counts of the same keys of several (keys, counts) parts, the keys come back sorted '''
+
+    keys, counts = np.concatenate(keys), np.concatenate(counts)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.empty(0, dtype=np.int64)
+    return keys[starts], np.add.reduceat(counts[order], starts) if len(keys) else counts
+
+
+def co_occurrence(indptr:np.ndarray, indices:np.ndarray, n_items:int = None, max_pairs:int = 2_000_000):
+    '''
+    The number of baskets every pair of items occurs in together, the
+    upper triangle of the sparse product A.T @ A of the incidence matrix A.
+    The pairs are enumerated per basket, baskets of b items give
+    b * (b - 1) / 2 pairs, instead of joining the baskets with themselves.
+
+    The baskets are processed in blocks of at most max_pairs pairs (a
+    larger basket is a block of its own), so the memory is bounded by
+    max_pairs plus twice the distinct pairs which occur: the counts of the
+    blocks are merged once they add up to the merged counts, every pair is
+    sorted O(log) times. When every pair of the items fits in max_pairs the
+    counts are accumulated in a dense array instead.
+
+    Parameters
+    ----------
+    indptr, indices: np.ndarray
+        The incidence matrix, see incidence_matrix
+    n_items: int
+        Number of items, by default the largest item code + 1
+    max_pairs: int
+        Pairs enumerated at a time
+
+    Returns
+    -------
+    tuple: (first, second, count) arrays, first < second, sorted by first and second
+    '''
+
+    n = n_items if n_items is not None else (int(indices.max()) + 1 if len(indices) else 0)
+    sizes = np.diff(indptr)
+    pairs_per_basket = sizes * (sizes - 1) // 2
+
+    # block boundaries, the first basket of every block
+    cumulative = np.cumsum(pairs_per_basket)
+    bounds, start = [0], 0
+    while start < len(sizes):
+        limit = (cumulative[start - 1] if start else 0) + max_pairs
+        end = max(int(np.searchsorted(cumulative, limit, side='right')), start + 1)
+        bounds.append(min(end, len(sizes)))
+        start = bounds[-1]
+
+    dense = n * n <= max_pairs
+    if dense:
+        counts = np.zeros(n * n, dtype=np.int64)
+    else:
+        keys, counts = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        pending_keys, pending_counts = [], []
+
+    for first_basket, end_basket in zip(bounds[:-1], bounds[1:]):
+        block_keys = _basket_pairs(indptr[first_basket:end_basket + 1], indices, n)
+
+        if dense:
+            counts += np.bincount(block_keys, minlength=n * n)
+            continue
+
+        block_keys, block_counts = np.unique(block_keys, return_counts=True)
+        pending_keys.append(block_keys)
+        pending_counts.append(block_counts)
+        if sum(map(len, pending_keys)) >= max(len(keys), max_pairs):
+            keys, counts = _merge_counts([keys] + pending_keys, [counts] + pending_counts)
+            pending_keys, pending_counts = [], []
+
+    if dense:
+        keys = np.flatnonzero(counts)
+        counts = counts[keys]
+    elif pending_keys:
+        keys, counts = _merge_counts([keys] + pending_keys, [counts] + pending_counts)
+
+    first, second = np.divmod(keys, max(n, 1))
+    return first, second, counts
+
+
+def association_rules(invoice_fct_df:pd.DataFrame, min_support:float = 0.005, min_confidence:float = 0.1,
+                      top_k:int = 10, max_pairs:int = 2_000_000) -> pd.DataFrame:
+    '''
+    The association rules "who buys Antecedent also buys Consequent" of the
+    purchase baskets:
+
+        Support     baskets with both / baskets
+        Confidence  baskets with both / baskets with Antecedent
+        Lift        Confidence / share of the baskets with Consequent
+
+    A pair is frequent only if both of its items are, so the items below
+    min_support are removed from the incidence matrix before the pairs are
+    counted (see co_occurrence). Of the rules above min_support and
+    min_confidence the top_k of every antecedent by lift are kept.
+
+    Parameters
+    ----------
+    invoice_fct_df: pd.DataFrame
+        The InvoiceFact dataframe
+    min_support: float
+        The smallest share of the baskets a pair must occur in
+    min_confidence: float
+        The smallest confidence of a rule
+    top_k: int
+        Rules kept per antecedent, None keeps every rule
+    max_pairs: int
+        Pairs enumerated at a time, see co_occurrence
+
+    Returns
+    -------
+    pd.DataFrame:
+        The rows of the AssociationRule table: Antecedent, Consequent,
+        Baskets, Support, Confidence and Lift, sorted by Antecedent and
+        descending Lift
+    '''
+
+    indptr, indices, labels = incidence_matrix(invoice_fct_df)
+    n_baskets = len(indptr) - 1
+    min_count = max(int(np.ceil(min_support * n_baskets)), 1)
+
+    item_counts = np.bincount(indices, minlength=len(labels))
+    frequent = item_counts >= min_count
+
+    # the incidence matrix of the frequent items, recoded to 0 .. m - 1
+    keep = frequent[indices]
+    indptr = np.r_[0, np.cumsum(keep)][indptr]
+    codes = np.cumsum(frequent) - 1
+    indices = codes[indices[keep]]
+    labels, item_counts = labels[frequent], item_counts[frequent]
+
+    first, second, counts = co_occurrence(indptr, indices, len(labels), max_pairs)
+    is_frequent = counts >= min_count
+    first, second, counts = first[is_frequent], second[is_frequent], counts[is_frequent]
+
+    # both directions of every pair
+    antecedent = np.concatenate([first, second])
+    consequent = np.concatenate([second, first])
+    baskets = np.concatenate([counts, counts])
+
+    confidence = baskets / item_counts[antecedent]
+    lift = confidence / (item_counts[consequent] / n_baskets)
+
+    is_confident = confidence >= min_confidence
+    antecedent, consequent, baskets = antecedent[is_confident], consequent[is_confident], baskets[is_confident]
+    confidence, lift = confidence[is_confident], lift[is_confident]
+
+    # by antecedent, then the best lift first
+    order = np.lexsort((consequent, -confidence, -lift, antecedent))
+    if top_k is not None:
+        sorted_antecedent = antecedent[order]
+        group_start = np.flatnonzero(np.r_[True, sorted_antecedent[1:] != sorted_antecedent[:-1]])
+        rank = np.arange(len(order)) - np.repeat(group_start, np.diff(np.r_[group_start, len(order)]))
+        order = order[rank < top_k]
+
+    return pd.DataFrame({'Antecedent': labels[antecedent[order]],
+                         'Consequent': labels[consequent[order]],
+                         'Baskets': baskets[order],
+                         'Support': baskets[order] / n_baskets,
+                         'Confidence': confidence[order],
+                         'Lift': lift[order]})
@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import platform
+import numpy as np
+import pandas as pd
+import cleaning
+import descriptions
+import basket
+from cleaning import *
+from descriptions import cluster_descriptions, canonical_descriptions
+from basket import incidence_matrix, co_occurrence, association_rules
+from config import BENCHMARK_BASELINE, BENCHMARK_SIZES
+
+SIZES = BENCHMARK_SIZES
+
+COUNTRIES = ['United Kingdom', 'France', 'Germany', 'EIRE', 'Spain', 'Netherlands', None]
+
+WORDS = ['PINK', 'WHITE', 'RED', 'BLUE', 'HEART', 'STAR', 'CHERRY', 'CHRISTMAS', 'GLASS', 'BALL',
+         'LIGHTS', 'CERAMIC', 'TRINKET', 'BOX', 'BOWL', 'CAT', 'DOG', 'VINTAGE', 'PAPER', 'BAG',
+         'MUG', 'SET', 'TIN', 'LANTERN', 'HANGING', 'WOODEN', 'FRAME', 'JUMBO', 'STRAWBERRY', 'CAKE']
+
+
+def generate_invoices(rows:int, seed:int = 0) -> pd.DataFrame:
+    '''
+    A source frame like read_data_to_pd returns, with rows of every kind
+    the cleaning rules drop or fix: invalid and cancelled invoices, zero
+    quantities, negative and null prices, guest and invalid customers,
+    short stock codes, missing descriptions and duplicates.
+    '''
+
+    rng = np.random.default_rng(seed)
+    duplicates = rows // 100
+    n = rows - duplicates
+
+    # invoices of about 20 lines, each with one date, customer and country
+    n_invoices = max(n // 20, 1)
+    invoice_no = 489434 + np.sort(rng.integers(0, n_invoices, n))
+    invoice_date = (pd.Timestamp('2009-12-01 07:45')
+                    + pd.to_timedelta(rng.integers(0, 365 * 24 * 60, n_invoices), unit='min'))
+    customer = np.where(rng.random(n_invoices) < 0.2, None,
+                        (12346 + rng.integers(0, 6000, n_invoices)).astype(str).astype(object) + '.0')
+    customer[rng.random(n_invoices) < 0.01] = 'X1234'
+    country = np.array(COUNTRIES, dtype=object)[rng.integers(0, len(COUNTRIES), n_invoices)]
+
+    kind = rng.random(n_invoices)
+    prefix = np.where(kind < 0.02, 'C', np.where(kind < 0.021, 'A', ''))
+    invoice = prefix[invoice_no - 489434].astype(object) + invoice_no.astype(str).astype(object)
+
+    # a catalogue of about rows / 50 products
+    n_products = max(n // 50, 10)
+    stock_code = (10000 + np.arange(n_products)).astype(str).astype(object)
+    stock_code[rng.random(n_products) < 0.1] += 'A'
+    stock_code[rng.random(n_products) < 0.02] = 'POST'
+    vocabulary = WORDS + [''.join(word) for word in rng.choice(list('ABCDEFGHIKLMNOPRSTUW'), (500, 6))]
+    words = rng.integers(0, len(vocabulary), (n_products, 4))
+    description = np.array([f'{vocabulary[a]} {vocabulary[b]}  {vocabulary[c]} , {vocabulary[d]}!'
+                            for a, b, c, d in words], dtype=object)
+    # near duplicates: a copy of another description with a letter missing
+    for i in np.flatnonzero(rng.random(n_products) < 0.1):
+        original = description[rng.integers(0, n_products)]
+        cut = rng.integers(1, len(original) - 1)
+        description[i] = original[:cut] + original[cut + 1:]
+    description[rng.random(n_products) < 0.01] = None
+    product = rng.integers(0, n_products, n)
+
+    quantity = rng.integers(1, 48, n)
+    quantity[rng.random(n) < 0.01] = 0
+    is_cancellation = prefix[invoice_no - 489434] == 'C'
+    quantity[is_cancellation & (rng.random(n) < 0.9)] *= -1
+    quantity[~is_cancellation & (rng.random(n) < 0.002)] *= -1
+
+    price = np.round(rng.gamma(2.0, 2.0, n), 2)
+    price[rng.random(n) < 0.005] = np.nan
+    price[rng.random(n) < 0.001] *= -1
+
+    df = pd.DataFrame({'Invoice': invoice,
+                       'StockCode': stock_code[product],
+                       'Description': description[product],
+                       'Quantity': quantity,
+                       'InvoiceDate': invoice_date[invoice_no - 489434],
+                       'Price': price,
+                       'CustomerID': customer[invoice_no - 489434],
+                       'Country': country[invoice_no - 489434]})
+
+    df = pd.concat([df, df.sample(duplicates, random_state=seed)]).sort_index(kind='stable')
+    return df.reset_index(drop=True)
+
+
+def _source(df):
+    return df
+
+
+def _valid(df):
+    ''' The rows as they reach the rules after drop_invalid_invoice '''
+
+    df = df.copy()
+    drop_invalid_invoice(df)
+    return df
+
+
+def _clean(df):
+    ''' The rows as they reach the dimension builders '''
+
+    df = _valid(df)
+    df = drop_positive_cancelations(df)
+    drop_negative_no_cancelations(df)
+    drop_null_prices(df)
+    df['CustomerID'] = df['CustomerID'].fillna('G0001')
+    drop_invalid_customers_ids(df)
+    drop_invalid_stock_cd(df)
+    drop_null_descr(df)
+    return create_date_cols(df)
+
+
+def _stock_dim(df):
+    return create_stock_dim_df(_clean(df)).copy()
+
+
+def _normalized_stock_dim(df):
+    stock_dim_df = _stock_dim(df)
+    for normalize in [to_lowercase, remove_punctuations, remove_unessecary_spaces]:
+        stock_dim_df = normalize(stock_dim_df, 'Description')
+    return stock_dim_df.dropna(subset=['Description'])
+
+
+def _invoice_fact(df):
+    return create_invoice_fct_df(_clean(df))
+
+
+def _co_occurrence(df):
+    # every pair of the catalogue, without the support pruning of association_rules
+    indptr, indices, labels = incidence_matrix(df)
+    return co_occurrence(indptr, indices, len(labels))
+
+
+def _customer_features(df):
+    return create_customer_features_df(_invoice_fact(df)).drop(columns=['Recency', 'CancellationRate'])
+
+
+# function: (input of the function, call)
+BENCHMARKS = {
+    'invoice_features': (_source, invoice_features),
+    'clear_invoice_features': (_source, clear_invoice_features),
+    'drop_invalid_invoice': (_source, drop_invalid_invoice),
+    'check_cancelations': (_valid, check_cancelations),
+    'drop_positive_cancelations': (_valid, drop_positive_cancelations),
+    'check_neg_quants': (_valid, check_neg_quants),
+    'drop_negative_no_cancelations': (_valid, drop_negative_no_cancelations),
+    'drop_dups': (_source, drop_dups),
+    'drop_zero_quants': (_source, drop_zero_quants),
+    'drop_neg_price': (_source, drop_neg_price),
+    'drop_null_prices': (_source, drop_null_prices),
+    'replace_null_customer_id': (_valid, replace_null_customer_id),
+    'drop_invalid_customers_ids': (_source, drop_invalid_customers_ids),
+    'drop_invalid_stock_cd': (_source, drop_invalid_stock_cd),
+    'drop_null_descr': (_source, drop_null_descr),
+    'outlier_scores': (_clean, outlier_scores),
+    'flag_outliers': (_clean, flag_outliers),
+    'drop_outliers': (_clean, drop_outliers),
+    'create_date_cols': (_source, create_date_cols),
+    'create_date_dim_df': (_clean, create_date_dim_df),
+    'create_stock_dim_df': (_clean, create_stock_dim_df),
+    'to_lowercase': (_stock_dim, lambda df: to_lowercase(df, 'Description')),
+    'remove_punctuations': (_stock_dim, lambda df: remove_punctuations(df, 'Description')),
+    'remove_unessecary_spaces': (_stock_dim, lambda df: remove_unessecary_spaces(df, 'Description')),
+    'create_customer_dim_df': (_clean, create_customer_dim_df),
+    'create_invoice_fct_df': (_clean, create_invoice_fct_df),
+    'create_customer_features_df': (_invoice_fact, create_customer_features_df),
+    'derive_customer_features': (_customer_features, derive_customer_features),
+    'create_customer_product_df': (_invoice_fact, create_customer_product_df),
+    'cluster_descriptions': (_normalized_stock_dim, lambda df: cluster_descriptions(df['Description'])),
+    'canonical_descriptions': (_normalized_stock_dim, lambda df: canonical_descriptions(df['Description'])),
+    'incidence_matrix': (_invoice_fact, incidence_matrix),
+    'co_occurrence': (_invoice_fact, _co_occurrence),
+    'association_rules': (_invoice_fact, association_rules),
+}
+
+
+def public_functions(modules=(cleaning, descriptions, basket)) -> list:
+    ''' The functions a benchmark should exist for '''
+
+    return sorted(name for module in modules for name, value in vars(module).items()
+                  if callable(value) and not name.startswith('_')
+                  and getattr(value, '__module__', None) == module.__name__)
+
+
+def time_function(name:str, df:pd.DataFrame, repeat:int = 5) -> float:
+    '''
+    The best of repeat runs of the benchmark of name, in seconds. Every run
+    gets its own copy of the input, the copy is not timed.
+    '''
+
+    prepare, call = BENCHMARKS[name]
+    data = prepare(df)
+
+    best = float('inf')
+    for _ in range(repeat):
+        run_data = data.copy()
+        start = time.perf_counter()
+        call(run_data)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def run_benchmarks(sizes=SIZES, names=None, repeat:int = 5, seed:int = 0) -> dict:
+    '''
+    Times every benchmark on a generated frame of every size.
+
+    Returns
+    -------
+    dict: {function: {rows: seconds}}, rows as a string like in the baseline file
+    '''
+
+    names = list(BENCHMARKS) if names is None else names
+    results = {name: {} for name in names}
+
+    for rows in sizes:
+        df = generate_invoices(rows, seed)
+        for name in names:
+            results[name][str(rows)] = time_function(name, df, repeat)
+
+    return results
+
+
+def save_baseline(results:dict, path:str = BENCHMARK_BASELINE) -> None:
+    '''
+    Writes the results with the versions they were measured with. The
+    results are merged into an existing baseline, the timings of other
+    functions and sizes are kept.
+    '''
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    merged = load_baseline(path) if os.path.exists(path) else {}
+    for name, timings in results.items():
+        merged[name] = {**merged.get(name, {}), **timings}
+
+    baseline = {'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'numpy': np.__version__,
+                'machine': platform.machine(),
+                'results': merged}
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def load_baseline(path:str = BENCHMARK_BASELINE) -> dict:
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def compare(results:dict, baseline:dict, threshold:float = 0.25, min_seconds:float = 0.001) -> list:
+    '''
+    The regressions of results against baseline: the timings which are more
+    than threshold (0.25 = 25%) slower. Timings which differ by less than
+    min_seconds are timer noise and never regress.
+
+    Returns
+    -------
+    list of (function, rows, baseline seconds, seconds), slowest first
+    '''
+
+    regressions = []
+    for name, timings in results.items():
+        for rows, seconds in timings.items():
+            before = baseline.get(name, {}).get(rows)
+            if before is None:
+                continue
+            if seconds > before * (1 + threshold) and seconds - before > min_seconds:
+                regressions.append((name, int(rows), before, seconds))
+
+    return sorted(regressions, key=lambda regression: regression[3] / regression[2], reverse=True)
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+
+def match_cancellations(invoice_fct_df:pd.DataFrame) -> pd.DataFrame:
+    '''
+    Matches every cancellation line to the purchase it reverses, the most
+    recent purchase invoice of the same customer and stock code at or
+    before the cancellation. DateID has a resolution of a minute, so a
+    purchase of the same minute counts as earlier, and of two purchases of
+    the same minute the larger invoice number is the more recent.
+
+    The purchases and the cancellations are sorted by DateID once and
+    joined with pd.merge_asof by (CustomerID, StockCode), the matching
+    takes O(n log n) instead of scanning the purchases of every
+    cancellation.
+
+    Parameters
+    ----------
+    invoice_fct_df: pd.DataFrame
+        The InvoiceFact dataframe of create_invoice_fct_df
+
+    Returns
+    -------
+    pd.DataFrame:
+        The rows of the CancellationMatch table, one per matched
+        cancellation line: CancelInvoice, PurchaseInvoice, StockCode,
+        CustomerID, CancelDateID, PurchaseDateID and the (negative)
+        Quantity of the cancellation line. Cancellations without an
+        earlier purchase, e.g. of purchases older than the source, are
+        left out.
+    '''
+
+    if not isinstance(invoice_fct_df, pd.DataFrame):
+        raise TypeError
+
+    required_columns = ["Invoice", "IsCancellation", "StockCode", "DateID", "CustomerID", "Quantity"]
+
+    if any(column not in invoice_fct_df.columns for column in required_columns):
+        raise KeyError
+
+    is_cancellation = invoice_fct_df['IsCancellation'].to_numpy() == 1
+
+    # one row per purchase invoice and stock code, sorted so the last row of a minute is the latest invoice
+    purchases = (invoice_fct_df.loc[~is_cancellation, ['Invoice', 'StockCode', 'CustomerID', 'DateID']]
+                               .drop_duplicates(['Invoice', 'StockCode'])
+                               .rename(columns={'Invoice': 'PurchaseInvoice'}))
+    purchases['PurchaseDateID'] = purchases['DateID']
+    purchases = purchases.sort_values(['DateID', 'PurchaseInvoice'], kind='stable')
+
+    cancellations = (invoice_fct_df.loc[is_cancellation, ['Invoice', 'StockCode', 'CustomerID', 'DateID', 'Quantity']]
+                                   .rename(columns={'Invoice': 'CancelInvoice'})
+                                   .sort_values('DateID', kind='stable'))
+
+    matches = pd.merge_asof(cancellations, purchases, on='DateID', by=['CustomerID', 'StockCode'],
+                            direction='backward', allow_exact_matches=True)
+    matches = matches.dropna(subset=['PurchaseInvoice'])
+
+    return pd.DataFrame({'CancelInvoice': matches['CancelInvoice'].to_numpy(dtype=np.int64),
+                         'PurchaseInvoice': matches['PurchaseInvoice'].to_numpy(dtype=np.int64),
+                         'StockCode': matches['StockCode'].to_numpy(),
+                         'CustomerID': matches['CustomerID'].to_numpy(),
+                         'CancelDateID': matches['DateID'].to_numpy(dtype=np.int64),
+                         'PurchaseDateID': matches['PurchaseDateID'].to_numpy(dtype=np.int64),
+                         'Quantity': matches['Quantity'].to_numpy()})
@@ -1,3 +1,4 @@
+import weakref
 import numpy as np
 import pandas as pd
 import regex as re
@@ -5,6 +6,82 @@ import logging
 
 logger = logging.getLogger()
 
+# derived invoice columns of each dataframe, see invoice_features
+_invoice_features_cache = {}
+
+
+def invoice_features(df:pd.DataFrame) -> pd.DataFrame:
+    '''
+    Computes the derived invoice columns once per dataframe, so the invoice
+    rules do not convert and scan the Invoice column again and again.
+    The result is cached. When rows of the dataframe are dropped the cached
+    columns are narrowed to the remaining rows instead of being recomputed.
+    A cached result is only used while the Invoice values of its rows are
+    unchanged, e.g. not after the index was relabelled.
+
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The pandas dataframe with the Invoice column
+
+    Returns
+    -------
+    pd.DataFrame
+        A DataFrame with the same index as df and the columns:
+        IsCancellation: the invoice starts with C
+        InvoiceNo: the invoice number without the C (Int64, <NA> if not numeric)
+        IsValid: the invoice is a number, optionally starting with C
+
+    '''
+
+    if not isinstance(df, pd.DataFrame):
+        raise TypeError
+
+    required_columns = ["Invoice"]
+
+    if any(column not in df.columns for column in required_columns):
+        raise KeyError
+
+    cached = _invoice_features_cache.get(id(df))
+    if cached is not None and cached[0]() is df:
+        _, features, invoices = cached
+        if features.index is df.index and invoices.equals(df['Invoice']):
+            return features
+        # rows were dropped, keep the features of the remaining rows
+        if features.index.is_unique and df.index.isin(features.index).all():
+            if invoices.reindex(df.index).equals(df['Invoice']):
+                features = features.reindex(df.index)
+                _cache_invoice_features(df, features)
+                return features
+
+    invoice = df['Invoice'].astype(str)
+    is_cancellation = invoice.str.startswith('C')
+    digits = invoice.where(~is_cancellation, invoice.str[1:])
+    invoice_no = pd.to_numeric(digits.where(digits.str.isdigit()),
+                               errors='coerce').astype('Int64')
+
+    features = pd.DataFrame({'IsCancellation': is_cancellation.to_numpy(),
+                             'InvoiceNo': invoice_no.array,
+                             'IsValid': invoice_no.notna().to_numpy()},
+                            index=df.index)
+    _cache_invoice_features(df, features)
+
+    return features
+
+
+def _cache_invoice_features(df:pd.DataFrame, features:pd.DataFrame) -> None:
+    # the Invoice values are kept to check that a later hit still describes df
+    key = id(df)
+    _invoice_features_cache[key] = (weakref.ref(df, lambda _: _invoice_features_cache.pop(key, None)),
+                                    features, df['Invoice'].copy())
+
+
+def clear_invoice_features(df:pd.DataFrame) -> None:
+    ''' Forgets the cached invoice features of the dataframe '''
+
+    _invoice_features_cache.pop(id(df), None)
+
 
 def drop_invalid_invoice(df:pd.DataFrame) -> None:
     ''' 
@@ -31,9 +108,7 @@ def drop_invalid_invoice(df:pd.DataFrame) -> None:
     if any(column not in df.columns for column in required_columns):
         raise KeyError
     
-    invalid_invoice_idx = df[~df['Invoice'].astype(str).str.isdigit()
-                             & ~df['Invoice'].astype(str).str.contains('C')] \
-                        .index
+    invalid_invoice_idx = df[~invoice_features(df)['IsValid'].to_numpy()].index
     df.drop(invalid_invoice_idx, inplace=True)
 
 
@@ -64,7 +139,7 @@ def check_cancelations(df:pd.DataFrame) -> bool:
         raise KeyError
     
     # check if all cancelation invoices have negative quantities
-    return np.all(df[df['Invoice'].astype(str).str.startswith('C')]['Quantity'].lt(0))
+    return np.all(df[invoice_features(df)['IsCancellation'].to_numpy()]['Quantity'].lt(0))
 
 
 def drop_positive_cancelations(df:pd.DataFrame) -> pd.DataFrame:
@@ -93,11 +168,16 @@ def drop_positive_cancelations(df:pd.DataFrame) -> pd.DataFrame:
     if any(column not in df.columns for column in required_columns):
         raise KeyError
     
-    df = df.drop(df[df['Invoice'].astype(str).str.contains('C') \
-                            & df['Quantity'].ge(0)
+    features = invoice_features(df)
+    df = df.drop(df[features['IsCancellation'].to_numpy() \
+                            & df['Quantity'].ge(0).to_numpy()
               ] \
               .index
             )
+
+    # the new dataframe reuses the invoice features of the remaining rows
+    if df.index.is_unique:
+        _cache_invoice_features(df, features.reindex(df.index))
     
     return df
 
@@ -128,7 +208,7 @@ def check_neg_quants(df:pd.DataFrame) -> bool:
     if any(column not in df.columns for column in required_columns):
         raise KeyError
 
-    return np.all((df['Quantity'].lt(0)) & (~df['Invoice'].astype(str).str.startswith("C")))
+    return np.all((df['Quantity'].lt(0).to_numpy()) & (~invoice_features(df)['IsCancellation'].to_numpy()))
 
 
 def drop_negative_no_cancelations(df:pd.DataFrame) -> None:
@@ -155,8 +235,8 @@ def drop_negative_no_cancelations(df:pd.DataFrame) -> None:
     if any(column not in df.columns for column in required_columns):
         raise KeyError
     
-    df.drop(df[df['Quantity'].lt(0) \
-               & (~df['Invoice'].astype(str).str.startswith("C"))] \
+    df.drop(df[df['Quantity'].lt(0).to_numpy() \
+               & (~invoice_features(df)['IsCancellation'].to_numpy())] \
                 .index,
                 inplace=True
             )
@@ -422,6 +502,129 @@ def drop_null_descr(df:pd.DataFrame) -> None:
     df.drop(df.loc[df['Description'].isnull()].index, inplace=True)
 
 
+def outlier_scores(df:pd.DataFrame, columns:tuple = ('Quantity', 'Price'), min_lines:int = 10,
+                   min_scale:float = np.log(2) / 2) -> pd.DataFrame:
+    '''
+    Robust z-scores of the lines against the other lines of their StockCode:
+    0.6745 * (x - median) / MAD, where MAD is the median absolute deviation
+    from the median. When more than half of the lines have the median value
+    the MAD is 0 and 1.2533 * the mean absolute deviation replaces MAD / 0.6745.
+    Quantities and prices are skewed, so x is log(1 + |value|) and a score
+    measures orders of magnitude. Stock codes with fewer than min_lines lines
+    are not scored (0).
+
+    A product usually has one price and mostly one pack size, then the
+    deviations are 0 or tiny and every other value would get a huge score.
+    The spread is therefore at least min_scale: with the default half a
+    doubling and the threshold 3.5 of flag_outliers, a line must be about
+    3.4 times above or below the median to be flagged.
+
+    The medians are computed by one groupby over the codes of pd.factorize
+    for all the columns together, the deviations by a second one, there
+    are no Python loops over the stock codes.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The pandas dataframe with StockCode and the columns
+    columns: tuple
+        The numeric columns to score
+    min_lines: int
+        The smallest number of lines of a scored stock code
+    min_scale: float
+        The smallest spread, in log units, a deviation is divided by
+
+    Returns
+    -------
+    pd.DataFrame
+        A DataFrame with the same index as df and a <column>Score column
+        for every column
+    '''
+
+    if not isinstance(df, pd.DataFrame):
+        raise TypeError
+
+    required_columns = ["StockCode", *columns]
+
+    if any(column not in df.columns for column in required_columns):
+        raise KeyError
+
+    codes, uniques = pd.factorize(df['StockCode'])
+    values = np.log1p(np.abs(df[list(columns)].to_numpy(dtype=np.float64)))
+
+    groups = pd.DataFrame(values).groupby(codes, sort=False)
+    median = groups.median().reindex(range(len(uniques))).to_numpy()
+    lines = np.bincount(codes[codes >= 0], minlength=len(uniques))
+
+    # codes is -1 for a null StockCode, its lines are not scored
+    is_scored = (codes >= 0) & (lines[codes] >= min_lines)
+    deviation = values - median[codes]
+
+    deviation_groups = pd.DataFrame(np.abs(deviation)).groupby(codes, sort=False)
+    mad = deviation_groups.median().reindex(range(len(uniques))).to_numpy()[codes]
+    mean_ad = deviation_groups.mean().reindex(range(len(uniques))).to_numpy()[codes]
+    scale = np.maximum(np.where(mad > 0, mad / 0.6745, 1.2533 * mean_ad), min_scale)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.where(is_scored[:, None] & (scale > 0), deviation / scale, 0.0)
+
+    return pd.DataFrame(scores, index=df.index, columns=[f'{column}Score' for column in columns])
+
+
+def flag_outliers(df:pd.DataFrame, threshold:float = 3.5, columns:tuple = ('Quantity', 'Price'),
+                  min_lines:int = 10, lower:tuple = ('Price',)) -> pd.Series:
+    '''
+    Flags the lines with an extreme quantity or price for their StockCode,
+    e.g. an entry error of a six figure quantity, see outlier_scores. A
+    line of a few units of a product usually sold by the dozen is not an
+    error, so only the columns in lower are also flagged below the median.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The pandas dataframe with StockCode and the columns
+    threshold: float
+        The largest absolute score of a normal line, 3.5 by the rule of
+        Iglewicz and Hoaglin
+    columns: tuple
+        The numeric columns to score
+    min_lines: int
+        The smallest number of lines of a scored stock code
+    lower: tuple
+        The columns flagged below the median as well
+
+    Returns
+    -------
+    pd.Series
+        True for the outliers, with the same index as df
+    '''
+
+    scores = outlier_scores(df, columns, min_lines).to_numpy()
+    two_sided = np.array([column in lower for column in columns])
+    scores = np.where(two_sided, np.abs(scores), scores)
+    return pd.Series((scores > threshold).any(axis=1), index=df.index)
+
+
+def drop_outliers(df:pd.DataFrame, threshold:float = 3.5, columns:tuple = ('Quantity', 'Price'),
+                  min_lines:int = 10, lower:tuple = ('Price',)) -> None:
+    '''
+    Drop the lines with an extreme quantity or price for their StockCode,
+    see flag_outliers.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The pandas dataframe that we want to clear from the outliers
+
+    Returns
+    -------
+    None: It drops the pd.DataFrame inplace
+    '''
+
+    is_outlier = flag_outliers(df, threshold, columns, min_lines, lower)
+    df.drop(df.index[is_outlier.to_numpy()], inplace=True)
+
+
 def create_date_cols(df:pd.DataFrame) -> pd.DataFrame:
     '''
     Creates the date columns.
@@ -457,15 +660,28 @@ def create_date_cols(df:pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def create_date_dim_df(df:pd.DataFrame) -> pd.DataFrame:
+def _unique_rows(df:pd.DataFrame, key:str, columns:list, val_to_keep:str) -> pd.DataFrame:
+    # only the kept rows are copied, the memory follows the number of keys
+    if val_to_keep not in ["first", "last"]:
+        raise KeyError
+
+    return df.loc[~df[key].duplicated(keep=val_to_keep).to_numpy(), columns]
+
+
+def create_date_dim_df(df:pd.DataFrame, val_to_keep:str = "first") -> pd.DataFrame:
     '''
-    Creates a dataframe which contain only the date related columns.
+    Creates a dataframe which contain only the date related columns,
+    one row per DateID.
     
     Parameters
     ----------
     df: pd.DataFrame
         The pandas dataframe from which we extract the date columns
 
+    val_to_keep: str
+        Which row of a DateID to keep, "first" or "last".
+        Default "first"
+
     Returns
     -------
     pd.DataFrame:
@@ -480,20 +696,25 @@ def create_date_dim_df(df:pd.DataFrame) -> pd.DataFrame:
     if any(column not in df.columns for column in required_columns):
         raise KeyError
     
-    date_dim_df = df[['DateID', 'Year', 'Month', 'Weekday', 'Hour']].copy()
+    date_dim_df = _unique_rows(df, 'DateID', ['DateID', 'Year', 'Month', 'Weekday', 'Hour'], val_to_keep)
     
     return date_dim_df
 
 
-def create_stock_dim_df(df:pd.DataFrame) -> pd.DataFrame:
+def create_stock_dim_df(df:pd.DataFrame, val_to_keep:str = "last") -> pd.DataFrame:
     '''
-    Creates a dataframe which contain only the stock related columns.
+    Creates a dataframe which contain only the stock related columns,
+    one row per StockCode.
     
     Parameters
     ----------
     df: pd.DataFrame
         The pandas dataframe from which we extract the stock related columns
 
+    val_to_keep: str
+        Which row of a StockCode to keep, "first" or "last".
+        Default "last"
+
     Returns
     -------
     pd.DataFrame:
@@ -510,7 +731,7 @@ def create_stock_dim_df(df:pd.DataFrame) -> pd.DataFrame:
         raise KeyError
     
 
-    stock_dim_df = df[['StockCode', 'Description']]
+    stock_dim_df = _unique_rows(df, 'StockCode', ['StockCode', 'Description'], val_to_keep)
 
     return stock_dim_df
 
@@ -601,15 +822,20 @@ def remove_unessecary_spaces(df: pd.DataFrame, *args):
     return df
 
 
-def create_customer_dim_df(df: pd.DataFrame) -> pd.DataFrame:
+def create_customer_dim_df(df: pd.DataFrame, val_to_keep:str = "last") -> pd.DataFrame:
     '''
-    Creates a dataframe which contain only the stock related columns.
+    Creates a dataframe which contain only the customer related columns,
+    one row per CustomerID.
     
     Parameters
     ----------
     df: pd.DataFrame
         The pandas dataframe from which we extract the customer related columns
 
+    val_to_keep: str
+        Which row of a CustomerID to keep, "first" or "last".
+        Default "last"
+
     Returns
     -------
     pd.DataFrame:
@@ -626,11 +852,126 @@ def create_customer_dim_df(df: pd.DataFrame) -> pd.DataFrame:
         raise KeyError
 
 
-    customer_dim_df = df[['CustomerID', 'Country']].copy()
+    customer_dim_df = _unique_rows(df, 'CustomerID', ['CustomerID', 'Country'], val_to_keep)
 
     return customer_dim_df
 
 
+def derive_customer_features(features_df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Adds the features which are derived from the summable ones:
+    Recency, the days from the last purchase of the customer to the last
+    purchase of any customer, and CancellationRate, the share of the
+    invoices of the customer which are cancellations.
+
+    Parameters
+    ----------
+    features_df: pd.DataFrame
+        One row per CustomerID with LastPurchaseDateID, Frequency and Cancellations
+
+    Returns
+    -------
+    pd.DataFrame:
+        The same dataframe with the Recency and CancellationRate columns
+    '''
+
+    last_purchase = features_df['LastPurchaseDateID'].dropna().astype(np.int64)
+    last_date = pd.to_datetime(last_purchase.astype(str).str.zfill(10), format='%y%m%d%H%M')
+    recency = (last_date.max() - last_date).dt.days
+
+    features_df['Recency'] = recency.reindex(features_df.index).astype('Int64')
+    features_df['CancellationRate'] = (features_df['Cancellations']
+                                       / (features_df['Frequency'] + features_df['Cancellations']))
+
+    return features_df
+
+
+def create_customer_features_df(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Creates the customer feature dataframe, one row per CustomerID, in one
+    grouped pass over the invoice lines: the first and last purchase, the
+    number of purchase invoices (Frequency) and of cancellation invoices,
+    the revenue net of the cancellations (Monetary), the distinct purchased
+    stock codes and the derived Recency and CancellationRate.
+
+    Every feature but the derived ones is a minimum, a maximum or a count
+    of the customer's invoices, so the features of new invoices can be
+    merged into stored ones, see features.merge_customer_features.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The invoice fact dataframe of create_invoice_fct_df
+
+    Returns
+    -------
+    pd.DataFrame:
+        A new DataFrame with the features of every customer, sorted by CustomerID.
+        The purchase dates and Recency are null for the customers without purchases.
+    '''
+
+    if not isinstance(df, pd.DataFrame):
+        raise TypeError
+
+    required_columns = ["Invoice", "IsCancellation", "StockCode", "DateID",
+                        "CustomerID", "Quantity", "Price"]
+
+    if any(column not in df.columns for column in required_columns):
+        raise KeyError
+
+
+    is_purchase = df['IsCancellation'].to_numpy() == 0
+    lines = pd.DataFrame({'CustomerID': df['CustomerID'].to_numpy(),
+                          'PurchaseDateID': df['DateID'].where(is_purchase).to_numpy(),
+                          'PurchaseInvoice': df['Invoice'].where(is_purchase).to_numpy(),
+                          'CancelInvoice': df['Invoice'].where(~is_purchase).to_numpy(),
+                          'PurchaseStockCode': df['StockCode'].where(is_purchase).to_numpy(),
+                          'Revenue': df['Quantity'].to_numpy() * df['Price'].to_numpy()})
+
+    features_df = lines.groupby('CustomerID', sort=True).agg(
+        FirstPurchaseDateID=('PurchaseDateID', 'min'),
+        LastPurchaseDateID=('PurchaseDateID', 'max'),
+        Frequency=('PurchaseInvoice', 'nunique'),
+        Monetary=('Revenue', 'sum'),
+        Cancellations=('CancelInvoice', 'nunique'),
+        DistinctProducts=('PurchaseStockCode', 'nunique')).reset_index()
+
+    for column in ['FirstPurchaseDateID', 'LastPurchaseDateID']:
+        features_df[column] = features_df[column].astype('Int64')
+
+    return derive_customer_features(features_df)
+
+
+def create_customer_product_df(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    The distinct (CustomerID, StockCode) pairs of the purchases, the rows
+    of the CustomerProduct table which keeps DistinctProducts exact when
+    the features are merged.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        The invoice fact dataframe of create_invoice_fct_df
+
+    Returns
+    -------
+    pd.DataFrame:
+        A new DataFrame with the CustomerID and StockCode columns
+    '''
+
+    if not isinstance(df, pd.DataFrame):
+        raise TypeError
+
+    required_columns = ["IsCancellation", "StockCode", "CustomerID"]
+
+    if any(column not in df.columns for column in required_columns):
+        raise KeyError
+
+
+    purchases = df.loc[df['IsCancellation'].to_numpy() == 0, ['CustomerID', 'StockCode']]
+    return purchases.drop_duplicates().reset_index(drop=True)
+
+
 def create_invoice_fct_df(df: pd.DataFrame) -> pd.DataFrame:
     '''
     Drop the columns that are not associated with the InvoiceFact table.
@@ -644,7 +985,9 @@ def create_invoice_fct_df(df: pd.DataFrame) -> pd.DataFrame:
     Returns
     -------
     pd.DataFrame:
-        A new DataFrame with only the associated with the InvoiceFac table columns 
+        A new DataFrame with only the associated with the InvoiceFac table columns.
+        Invoice is the int64 invoice number and IsCancellation an int8 flag
+        which is 1 for the C prefixed invoices.
     
     '''
     
@@ -661,7 +1004,18 @@ def create_invoice_fct_df(df: pd.DataFrame) -> pd.DataFrame:
 
     cols_to_drop = ["Description", "InvoiceDate", "Country",
                     "Year", "Month", "Day", "Weekday", "Hour"]
-    return df.drop(columns=cols_to_drop)
+    invoice_fct_df = df.drop(columns=cols_to_drop)
+
+    # split C489449 into the invoice number 489449 and the cancellation flag
+    features = invoice_features(df)
+    if not features['IsValid'].all():
+        raise ValueError("Invalid invoices, drop them with drop_invalid_invoice first")
+
+    invoice_fct_df['Invoice'] = features['InvoiceNo'].to_numpy(dtype=np.int64)
+    invoice_fct_df.insert(invoice_fct_df.columns.get_loc('Invoice') + 1, 'IsCancellation',
+                          features['IsCancellation'].to_numpy(dtype=np.int8))
+
+    return invoice_fct_df
 
 
 
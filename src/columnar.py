@@ -0,0 +1,142 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+MANIFEST = 'manifest.json'
+
+
+def _is_string(values:pd.Series) -> bool:
+    return values.dtype == object or isinstance(values.dtype, (pd.CategoricalDtype, pd.StringDtype))
+
+
+def write_table(table_dir:str, df:pd.DataFrame) -> dict:
+    '''
+    Writes the dataframe as one .npy file per column, the layout which
+    read_table memory maps. Strings are dictionary encoded: the sorted
+    distinct values are written once and the column holds their codes,
+    -1 for missing values. The manifest lists the columns and their
+    encoding. The table is written under a temporary name by stage_table
+    and replaces an older one by publish_table.
+
+    Returns
+    -------
+    dict: the manifest
+    '''
+
+    manifest = stage_table(table_dir, df)
+    publish_table(table_dir)
+    return manifest
+
+
+def stage_table(table_dir:str, df:pd.DataFrame) -> dict:
+    ''' Writes the table into <table_dir>.tmp, see write_table and publish_table '''
+
+    tmp_dir = f'{table_dir}.tmp'
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    for name in df.columns:
+        values = df[name]
+
+        if _is_string(values):
+            codes, dictionary = pd.factorize(values, sort=True)
+            codes = codes.astype(np.min_scalar_type(-max(len(dictionary), 1)))
+            dictionary = np.asarray(dictionary, dtype=str)
+            np.save(os.path.join(tmp_dir, f'{name}.codes.npy'), codes)
+            np.save(os.path.join(tmp_dir, f'{name}.dict.npy'), dictionary)
+            columns.append({'name': name, 'encoding': 'dictionary',
+                            'dtype': str(codes.dtype), 'distinct': len(dictionary)})
+        else:
+            array = values.to_numpy()
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), array)
+            columns.append({'name': name, 'encoding': 'plain', 'dtype': str(array.dtype)})
+
+    manifest = {'rows': len(df), 'columns': columns}
+    with open(os.path.join(tmp_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+
+def publish_table(table_dir:str) -> None:
+    '''
+    Replaces the table with the one staged in <table_dir>.tmp. A directory
+    can not be renamed over a full one, so the old table is renamed aside
+    first and removed after the new one is in place: table_dir is missing
+    only between the two renames, and readers which mapped the old files
+    keep them until they let go.
+    '''
+
+    tmp_dir, old_dir = f'{table_dir}.tmp', f'{table_dir}.old'
+    if os.path.isdir(old_dir):
+        shutil.rmtree(old_dir)
+
+    if os.path.isdir(table_dir):
+        os.replace(table_dir, old_dir)
+    os.replace(tmp_dir, table_dir)
+
+    if os.path.isdir(old_dir):
+        shutil.rmtree(old_dir)
+
+
+def read_manifest(table_dir:str) -> dict:
+    with open(os.path.join(table_dir, MANIFEST)) as f:
+        return json.load(f)
+
+
+def read_arrays(table_dir:str, columns:list = None) -> dict:
+    '''
+    The columns of the table as read-only memory mapped arrays, nothing is
+    read until it is used and the pages are shared by every process which
+    maps the same file. A dictionary encoded column is a (codes, dictionary)
+    tuple.
+    '''
+
+    manifest = {column['name']: column for column in read_manifest(table_dir)['columns']}
+    if columns is None:
+        columns = list(manifest)
+    if any(name not in manifest for name in columns):
+        raise KeyError
+
+    wanted = [manifest[name] for name in columns]
+
+    arrays = {}
+    for column in wanted:
+        name = column['name']
+        if column['encoding'] == 'dictionary':
+            arrays[name] = (np.load(os.path.join(table_dir, f'{name}.codes.npy'), mmap_mode='r'),
+                            np.load(os.path.join(table_dir, f'{name}.dict.npy')))
+        else:
+            arrays[name] = np.load(os.path.join(table_dir, f'{name}.npy'), mmap_mode='r')
+
+    return arrays
+
+
+def read_table(table_dir:str, columns:list = None) -> pd.DataFrame:
+    '''
+    The table as a dataframe over the memory mapped files, without copying
+    the columns. Dictionary encoded columns become categoricals over their
+    codes. The dataframe is read-only, copy it before modifying it.
+
+    Parameters
+    ----------
+    table_dir: str
+        The directory of the table, e.g. ./columnar/InvoiceFact
+    columns: list
+        Only these columns, by default all
+    '''
+
+    data = {}
+    for name, array in read_arrays(table_dir, columns).items():
+        if isinstance(array, tuple):
+            codes, dictionary = array
+            data[name] = pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(dictionary.astype(object)),
+                                                   validate=False)
+        else:
+            data[name] = array
+
+    return pd.DataFrame(data, copy=False)
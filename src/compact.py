@@ -0,0 +1,114 @@
+import os
+import time
+import sqlite3
+import tempfile
+import numpy as np
+import pandas as pd
+from load import create_tables, load_db
+
+INT_TYPES = [np.int8, np.int16, np.int32, np.int64]
+
+
+def narrowest_int(values:pd.Series) -> type:
+    ''' The smallest signed integer type which holds every value, int64 for no values '''
+
+    low, high = values.min(), values.max()
+    return next((int_type for int_type in INT_TYPES
+                 if np.iinfo(int_type).min <= low and high <= np.iinfo(int_type).max), np.int64)
+
+
+def compact_invoice_fct_df(invoice_fct_df:pd.DataFrame) -> pd.DataFrame:
+    '''
+    The compact form of the InvoiceFact dataframe, the rows of the
+    InvoiceFactCompact table. Price becomes PricePence, an integer number
+    of pence, the integer columns get the narrowest type which holds them
+    and the stock codes and customer ids become categoricals. LineNo
+    numbers the lines of the same stock code in an invoice, so
+    (Invoice, IsCancellation, StockCode, LineNo) identifies a line.
+
+    Every conversion is checked first, a price with a fraction of a penny
+    raises ValueError instead of being rounded.
+
+    Parameters
+    ----------
+    invoice_fct_df: pd.DataFrame
+        The InvoiceFact dataframe of create_invoice_fct_df
+
+    Returns
+    -------
+    pd.DataFrame: the compact dataframe, the original is not modified
+    '''
+
+    if not isinstance(invoice_fct_df, pd.DataFrame):
+        raise TypeError
+
+    required_columns = ["Invoice", "IsCancellation", "StockCode", "DateID",
+                        "CustomerID", "Quantity", "Price"]
+
+    if any(column not in invoice_fct_df.columns for column in required_columns):
+        raise KeyError
+
+    price = invoice_fct_df['Price'].to_numpy(dtype=np.float64)
+    pence = np.rint(price * 100)
+    if not np.array_equal(pence / 100, price):
+        raise ValueError("Prices with fractions of a penny can not be stored as pence")
+
+    compact_df = pd.DataFrame({'Invoice': invoice_fct_df['Invoice'].to_numpy(),
+                               'IsCancellation': invoice_fct_df['IsCancellation'].to_numpy(dtype=np.int8),
+                               'StockCode': pd.Categorical(invoice_fct_df['StockCode']),
+                               'DateID': invoice_fct_df['DateID'].to_numpy(),
+                               'CustomerID': pd.Categorical(invoice_fct_df['CustomerID']),
+                               'Quantity': invoice_fct_df['Quantity'].to_numpy(),
+                               'PricePence': pence})
+
+    compact_df.insert(3, 'LineNo', compact_df.groupby(['Invoice', 'IsCancellation', 'StockCode'],
+                                                      sort=False, observed=True).cumcount())
+
+    for column in ['Invoice', 'LineNo', 'DateID', 'Quantity', 'PricePence']:
+        int_type = narrowest_int(compact_df[column])
+        narrowed = compact_df[column].to_numpy().astype(int_type)
+        if not np.array_equal(narrowed, compact_df[column].to_numpy()):
+            raise ValueError(f"{column} does not fit in {np.dtype(int_type).name}")
+        compact_df[column] = narrowed
+
+    return compact_df
+
+
+def storage_report(invoice_fct_df:pd.DataFrame, repeat:int = 3) -> dict:
+    '''
+    Loads the fact table in the plain and in the compact layout into
+    temporary databases and measures the size of the dataframe, the size
+    of the database file and the best time of a full scan of InvoiceFact.
+
+    Returns
+    -------
+    dict: {'plain': {...}, 'compact': {...}} with frame_bytes, db_bytes and scan_seconds
+    '''
+
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for layout in ['plain', 'compact']:
+            db_path = os.path.join(tmp_dir, f'{layout}.db')
+            create_tables(db_path, compact=layout == 'compact')
+
+            if layout == 'compact':
+                df = compact_invoice_fct_df(invoice_fct_df)
+                load_db('InvoiceFactCompact', df, db_path)
+            else:
+                df = invoice_fct_df
+                load_db('InvoiceFact', df, db_path)
+
+            conn = sqlite3.connect(db_path)
+            conn.execute('VACUUM')
+            scan_seconds = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                conn.execute('SELECT COUNT(*), SUM(Quantity), SUM(Quantity * Price) FROM InvoiceFact').fetchone()
+                scan_seconds = min(scan_seconds, time.perf_counter() - start)
+            conn.close()
+
+            report[layout] = {'frame_bytes': int(df.memory_usage(deep=True).sum()),
+                              'db_bytes': os.path.getsize(db_path),
+                              'scan_seconds': scan_seconds}
+
+    return report
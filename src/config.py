@@ -0,0 +1,11 @@
+# default locations, relative to the src directory which the ETL runs from
+
+DATA_PATH = './data/Invoices_Year_2009-2010.zip'
+DB_PATH = './db/invoicedb'
+LOG_PATH = '../logs'
+METRICS_DIR = '../metrics'
+OUTPUT_DIR = './export'
+WATCH_DIR = './data/incoming'
+BENCHMARK_BASELINE = '../benchmarks/baseline.json'
+# rows of the generated frames of the micro benchmarks
+BENCHMARK_SIZES = [1_000, 10_000, 100_000]
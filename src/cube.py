@@ -0,0 +1,193 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+DIMENSIONS = ['Year', 'Month', 'Weekday', 'Hour', 'Country', 'StockCode']
+MEASURES = ['Quantity', 'Revenue']
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def _code_dtype(size:int):
+    return np.min_scalar_type(max(size - 1, 0))
+
+
+class Cube:
+    '''
+    Quantity and revenue (Quantity * Price, cancellations included) of the
+    invoice lines over the Year, Month, Weekday, Hour, Country and StockCode
+    dimensions.
+
+    The cube is sparse, only the non empty cells are stored: one array of
+    codes per dimension and one array per measure, all of the same length.
+    labels maps every dimension to the values its codes stand for. The
+    arrays are plain .npy files and are memory mapped by load, so opening
+    a cube costs nothing and a query reads only the arrays it needs.
+
+        cube = Cube.load('./cube')
+        cube.slice(Country='France', Year=2010).rollup('Month')
+    '''
+
+    def __init__(self, labels:dict, codes:dict, measures:dict):
+        self.labels = labels
+        self.codes = codes
+        self.measures = measures
+
+    def __len__(self):
+        return len(self.measures['Quantity'])
+
+    @property
+    def shape(self) -> tuple:
+        return tuple(len(self.labels[dim]) for dim in DIMENSIONS)
+
+    def save(self, path:str) -> None:
+        ''' Writes the cube into the directory path, replacing an older cube '''
+
+        tmp_path = f'{path}.tmp'
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        for dim in DIMENSIONS:
+            np.save(os.path.join(tmp_path, f'{dim}.npy'), self.codes[dim])
+        for measure in MEASURES:
+            np.save(os.path.join(tmp_path, f'{measure}.npy'), self.measures[measure])
+        with open(os.path.join(tmp_path, 'labels.json'), 'w') as f:
+            json.dump({dim: np.asarray(self.labels[dim]).tolist() for dim in DIMENSIONS}, f)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path:str, mmap:bool = True) -> 'Cube':
+        mmap_mode = 'r' if mmap else None
+
+        with open(os.path.join(path, 'labels.json')) as f:
+            labels = {dim: np.array(values) for dim, values in json.load(f).items()}
+        codes = {dim: np.load(os.path.join(path, f'{dim}.npy'), mmap_mode=mmap_mode) for dim in DIMENSIONS}
+        measures = {measure: np.load(os.path.join(path, f'{measure}.npy'), mmap_mode=mmap_mode)
+                    for measure in MEASURES}
+
+        return cls(labels, codes, measures)
+
+    def slice(self, **filters) -> 'Cube':
+        '''
+        The cells of the given dimension values, a value or a list of values
+        per dimension, e.g. slice(Country=['France', 'Germany'], Hour=12).
+        The result is a cube with the same labels.
+        '''
+
+        if any(dim not in DIMENSIONS for dim in filters):
+            raise KeyError
+
+        mask = np.ones(len(self), dtype=bool)
+        for dim, values in filters.items():
+            positions = pd.Index(self.labels[dim]).get_indexer(np.atleast_1d(values))
+            wanted = np.zeros(len(self.labels[dim]), dtype=bool)
+            wanted[positions[positions >= 0]] = True
+            mask &= wanted[self.codes[dim]]
+
+        return Cube(self.labels,
+                    {dim: self.codes[dim][mask] for dim in DIMENSIONS},
+                    {measure: self.measures[measure][mask] for measure in MEASURES})
+
+    def rollup(self, *dims) -> pd.DataFrame:
+        '''
+        Sums the measures over every dimension which is not in dims.
+        Returns one row per non empty combination of dims, sorted by dims.
+        '''
+
+        if any(dim not in DIMENSIONS for dim in dims):
+            raise KeyError
+
+        if not dims:
+            return pd.DataFrame({measure: [self.measures[measure].sum()] for measure in MEASURES})
+
+        shape = tuple(len(self.labels[dim]) for dim in dims)
+        keys = np.ravel_multi_index(tuple(self.codes[dim] for dim in dims), shape)
+        cells, inverse = np.unique(keys, return_inverse=True)
+
+        result = pd.DataFrame({dim: self.labels[dim][codes]
+                               for dim, codes in zip(dims, np.unravel_index(cells, shape))})
+        result['Quantity'] = np.bincount(inverse, weights=self.measures['Quantity'],
+                                         minlength=len(cells)).round().astype(np.int64)
+        result['Revenue'] = np.bincount(inverse, weights=self.measures['Revenue'], minlength=len(cells))
+
+        return result
+
+    def dense(self, *dims, measure:str = 'Quantity') -> np.ndarray:
+        ''' The measure rolled up to dims as a dense array, one axis per dimension '''
+
+        if any(dim not in DIMENSIONS for dim in dims) or measure not in MEASURES:
+            raise KeyError
+
+        shape = tuple(len(self.labels[dim]) for dim in dims)
+        keys = np.ravel_multi_index(tuple(self.codes[dim] for dim in dims), shape)
+        return np.bincount(keys, weights=self.measures[measure], minlength=int(np.prod(shape))).reshape(shape)
+
+
+def build_cube(invoice_fct_df:pd.DataFrame, date_dim_df:pd.DataFrame, customer_dim_df:pd.DataFrame) -> Cube:
+    '''
+    Builds the cube from the tables of transform_data. The dimensions of
+    every invoice line are looked up in the date and customer dimensions,
+    factorized into integer codes and the lines of every cell are summed
+    with bincount, there is no python loop over the rows.
+
+    Parameters
+    ----------
+    invoice_fct_df: pd.DataFrame
+        The InvoiceFact dataframe
+    date_dim_df: pd.DataFrame
+        The DateDim dataframe, one row per DateID
+    customer_dim_df: pd.DataFrame
+        The CustomerDim dataframe, one row per CustomerID
+
+    Returns
+    -------
+    Cube
+    '''
+
+    if not isinstance(invoice_fct_df, pd.DataFrame):
+        raise TypeError
+
+    required_columns = ['StockCode', 'DateID', 'CustomerID', 'Quantity', 'Price']
+
+    if any(column not in invoice_fct_df.columns for column in required_columns):
+        raise KeyError
+
+    date_rows = pd.Index(date_dim_df['DateID']).get_indexer(invoice_fct_df['DateID'])
+    customer_rows = pd.Index(customer_dim_df['CustomerID']).get_indexer(invoice_fct_df['CustomerID'])
+    if (date_rows < 0).any() or (customer_rows < 0).any():
+        raise ValueError("Invoice lines without a DateDim or CustomerDim row")
+
+    values = {'Year': date_dim_df['Year'].to_numpy()[date_rows],
+              'Month': date_dim_df['Month'].to_numpy()[date_rows],
+              'Weekday': pd.Categorical(date_dim_df['Weekday'].to_numpy()[date_rows], categories=WEEKDAYS),
+              'Hour': date_dim_df['Hour'].to_numpy()[date_rows],
+              'Country': customer_dim_df['Country'].fillna('Unspecified').to_numpy()[customer_rows],
+              'StockCode': invoice_fct_df['StockCode'].to_numpy()}
+
+    labels, line_codes = {}, []
+    for dim in DIMENSIONS:
+        if dim == 'Weekday':
+            codes, labels[dim] = values[dim].codes, np.array(WEEKDAYS)
+        else:
+            codes, labels[dim] = pd.factorize(values[dim], sort=True)
+            labels[dim] = np.asarray(labels[dim])
+        line_codes.append(codes)
+
+    shape = tuple(len(labels[dim]) for dim in DIMENSIONS)
+    keys = np.ravel_multi_index(tuple(line_codes), shape)
+    cells, inverse = np.unique(keys, return_inverse=True)
+
+    quantity = invoice_fct_df['Quantity'].to_numpy(dtype=np.float64)
+    revenue = quantity * invoice_fct_df['Price'].to_numpy(dtype=np.float64)
+    measures = {'Quantity': np.bincount(inverse, weights=quantity, minlength=len(cells)).round().astype(np.int64),
+                'Revenue': np.bincount(inverse, weights=revenue, minlength=len(cells))}
+
+    codes = {dim: cell_codes.astype(_code_dtype(size))
+             for dim, cell_codes, size in zip(DIMENSIONS, np.unravel_index(cells, shape), shape)}
+
+    return Cube(labels, codes, measures)
@@ -0,0 +1,186 @@
+import re
+import numpy as np
+import pandas as pd
+
+NUMBERS = re.compile(r'\d+')
+
+
+def _shingle_hashes(descriptions:np.ndarray, k:int):
+    '''
+    The 32 bit hashes of the character k-grams of every description, one
+    flat array, and the offset of the first hash of every description.
+    '''
+
+    shingles = []
+    offsets = np.empty(len(descriptions), dtype=np.int64)
+    for i, description in enumerate(descriptions):
+        padded = f' {description} '
+        grams = {padded[j:j + k] for j in range(max(len(padded) - k + 1, 1))}
+        offsets[i] = len(shingles)
+        shingles.extend(grams)
+
+    hashes = pd.util.hash_array(np.array(shingles, dtype=object)) >> np.uint64(32)
+    return hashes, offsets
+
+
+def _minhash(hashes:np.ndarray, offsets:np.ndarray, num_perm:int, seed:int, block:int = 16) -> np.ndarray:
+    '''
+    The MinHash signatures, one row per description. The permutations are
+    multiply-shift hashes of the shingle hashes, a block of them at a time
+    so the intermediate array stays small.
+    '''
+
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2**63, num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+
+    signatures = np.empty((len(offsets), num_perm), dtype=np.uint32)
+    with np.errstate(over='ignore'):
+        for start in range(0, num_perm, block):
+            permuted = (a[start:start + block, None] * hashes[None, :] + b[start:start + block, None]) >> np.uint64(32)
+            signatures[:, start:start + block] = np.minimum.reduceat(permuted, offsets, axis=1).T
+
+    return signatures
+
+
+def _candidate_pairs(signatures:np.ndarray, bands:int) -> np.ndarray:
+    '''
+    Locality sensitive hashing: the pairs (i, j), i < j, which have the
+    same signature in at least one band.
+    '''
+
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    pairs = []
+
+    for band in range(bands):
+        keys = pd.util.hash_pandas_object(pd.DataFrame(signatures[:, band * rows:(band + 1) * rows]),
+                                          index=False).to_numpy()
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+
+        # every member of a bucket with every later member of the same bucket
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+        for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+            members = np.sort(order[start:start + size])
+            i, j = np.triu_indices(size, 1)
+            pairs.append(members[i] * n + members[j])
+
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+
+    codes = np.unique(np.concatenate(pairs))
+    return np.stack([codes // n, codes % n], axis=1)
+
+
+def _connected_components(n:int, pairs:np.ndarray) -> np.ndarray:
+    ''' The smallest member of the component of every node '''
+
+    labels = np.arange(n)
+    if len(pairs) == 0:
+        return labels
+
+    i, j = pairs[:, 0], pairs[:, 1]
+    while True:
+        lowest = np.minimum(labels[i], labels[j])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, i, lowest)
+        np.minimum.at(new_labels, j, lowest)
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def cluster_descriptions(descriptions:pd.Series, threshold:float = 0.8, num_perm:int = 128,
+                         bands:int = 16, k:int = 3, seed:int = 0) -> np.ndarray:
+    '''
+    Groups the near duplicate descriptions without comparing every pair.
+    The descriptions are split in character k-grams, a MinHash signature
+    estimates the Jaccard similarity of their k-grams and locality
+    sensitive hashing on bands of the signatures finds the candidate pairs.
+    The candidates with an estimated similarity of at least threshold and
+    the same numbers (15cm and 20cm are different products) are linked.
+
+    The time grows with the number of descriptions plus the number of
+    candidate pairs. With 16 bands of 8 rows a pair of similarity 0.8
+    becomes a candidate with a probability of 0.95, a pair of 0.5 with 0.06.
+
+    Parameters
+    ----------
+    descriptions: pd.Series
+        The normalized descriptions, see to_lowercase, remove_punctuations
+        and remove_unessecary_spaces
+    threshold: float
+        The smallest Jaccard similarity of near duplicates
+    num_perm: int
+        Length of the MinHash signatures
+    bands: int
+        LSH bands, num_perm must be a multiple of bands
+    k: int
+        Characters per shingle
+
+    Returns
+    -------
+    np.ndarray: the cluster of every description, the position of its first member
+    '''
+
+    if not isinstance(descriptions, pd.Series):
+        raise TypeError
+
+    if num_perm % bands:
+        raise ValueError("num_perm must be a multiple of bands")
+
+    values = descriptions.fillna('').to_numpy(dtype=object)
+    if len(values) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    signatures = _minhash(*_shingle_hashes(values, k), num_perm, seed)
+    pairs = _candidate_pairs(signatures, bands)
+
+    similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+    numbers = pd.Series(values).str.findall(NUMBERS).str.join(' ').to_numpy(dtype=object)
+    same = (similarity >= threshold) & (numbers[pairs[:, 0]] == numbers[pairs[:, 1]])
+
+    return _connected_components(len(values), pairs[same])
+
+
+def canonical_descriptions(descriptions:pd.Series, weights:pd.Series = None, **kwargs) -> dict:
+    '''
+    Maps every near duplicate description to the canonical description of
+    its cluster, the one with the largest weight, e.g. the number of sold
+    invoice lines. Ties go to the alphabetically first description.
+
+    Parameters
+    ----------
+    descriptions: pd.Series
+        The normalized descriptions
+    weights: pd.Series
+        Weight of every description, aligned with descriptions, by default 1
+    **kwargs:
+        Passed to cluster_descriptions
+
+    Returns
+    -------
+    dict: {description: canonical description}, only the descriptions which change
+    '''
+
+    if not isinstance(descriptions, pd.Series):
+        raise TypeError
+
+    if weights is None:
+        weights = np.ones(len(descriptions))
+
+    candidates = pd.DataFrame({'Description': descriptions.to_numpy(),
+                               'Weight': np.asarray(weights, dtype=float)}).dropna(subset=['Description'])
+    candidates = candidates.groupby('Description', as_index=False)['Weight'].sum()
+    candidates['Cluster'] = cluster_descriptions(candidates['Description'], **kwargs)
+
+    canonical = (candidates.sort_values(['Cluster', 'Weight', 'Description'], ascending=[True, False, True])
+                           .drop_duplicates('Cluster')
+                           .set_index('Cluster')['Description'])
+    candidates['Canonical'] = canonical.reindex(candidates['Cluster']).to_numpy()
+
+    changed = candidates[candidates['Description'] != candidates['Canonical']]
+    return dict(zip(changed['Description'], changed['Canonical']))
@@ -0,0 +1,367 @@
+'''
+Command line entry point of the ETL.
+
+    python etl.py run [--data PATH] [--db PATH] [--partition-fact]
+    python etl.py run --sink csv --output-dir ./export
+    python etl.py extract --output staged.pkl
+    python etl.py load --input staged.pkl
+    python etl.py bench
+    python etl.py microbench [--save] [--threshold 0.25] [--fail]
+    python etl.py storage
+    python etl.py watch [--watch-dir ./data/incoming] [--workers 2]
+    python etl.py sketches
+    python etl.py stats
+
+Only the standard library is imported at startup. pandas, numpy, regex and
+SQLAlchemy are imported inside the subcommands that need them, so --help
+and stats start immediately.
+'''
+
+import os
+import sys
+import argparse
+
+from config import (DATA_PATH, DB_PATH, LOG_PATH, METRICS_DIR, OUTPUT_DIR, BENCHMARK_BASELINE, BENCHMARK_SIZES,
+                    WATCH_DIR)
+
+
+def _start_logging(args):
+    from main import setup_logging
+
+    return setup_logging(args.log)
+
+
+def _sink(args):
+    if args.sink == 'csv':
+        from sinks import PartitionedCSVSink
+
+        return PartitionedCSVSink(args.output_dir)
+
+    return None
+
+
+def cmd_run(args):
+    from main import main
+
+    listener = _start_logging(args)
+    try:
+        main(args.data, args.db, args.metrics_dir, partition_fact=args.partition_fact,
+             out_of_core=args.out_of_core, chunksize=args.chunksize, sink=_sink(args),
+             scd2=args.scd2, max_memory=args.max_memory, cluster_descriptions=args.cluster_descriptions,
+             cube_dir=args.cube_dir, compact_fact=args.compact_fact, columnar_dir=args.columnar_dir,
+             match_cancellations=args.match_cancellations, customer_features=args.customer_features,
+             incremental_features=args.incremental_features, basket_rules=args.basket_rules,
+             sketches=args.sketches, outliers=args.outliers, profile=args.profile)
+    finally:
+        listener.stop()
+
+
+def cmd_extract(args):
+    from main import extract_stage
+
+    listener = _start_logging(args)
+    try:
+        data = extract_stage(args.data)
+        data.to_pickle(args.output)
+    finally:
+        listener.stop()
+
+    print(f"Extracted {len(data)} rows to {args.output}")
+
+
+def cmd_load(args):
+    import pandas as pd
+    from main import main
+
+    listener = _start_logging(args)
+    try:
+        main(db_path=args.db, metrics_dir=args.metrics_dir, partition_fact=args.partition_fact,
+             data=pd.read_pickle(args.input), sink=_sink(args), scd2=args.scd2,
+             cluster_descriptions=args.cluster_descriptions, cube_dir=args.cube_dir,
+             compact_fact=args.compact_fact, columnar_dir=args.columnar_dir,
+             match_cancellations=args.match_cancellations, customer_features=args.customer_features,
+             incremental_features=args.incremental_features, basket_rules=args.basket_rules,
+             sketches=args.sketches, outliers=args.outliers, profile=args.profile)
+    finally:
+        listener.stop()
+
+
+def cmd_bench(args):
+    import tempfile
+    from main import extract_stage, transform_stage, load_stage
+    from metrics import metrics
+
+    listener = _start_logging(args)
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tables = transform_stage(extract_stage(args.data))
+            load_stage(tables, os.path.join(tmp_dir, 'invoicedb'), args.partition_fact)
+    finally:
+        listener.stop()
+
+    for histogram in metrics.snapshot()['histograms']:
+        if histogram['name'] == 'etl_stage_duration_seconds':
+            print(f"{histogram['labels']['stage']:<10} {histogram['sum']:10.3f} s")
+
+
+def cmd_microbench(args):
+    from benchmarks import run_benchmarks, save_baseline, load_baseline, compare
+
+    results = run_benchmarks(args.sizes, args.function, args.repeat)
+
+    print(f"{'function':<32}" + ''.join(f"{rows:>12}" for rows in args.sizes))
+    for name, timings in results.items():
+        print(f"{name:<32}" + ''.join(f"{timings[str(rows)] * 1000:>10.3f}ms" for rows in args.sizes))
+
+    if args.save:
+        save_baseline(results, args.baseline)
+        print(f"Saved the baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, save one with --save", file=sys.stderr)
+        return 0
+
+    regressions = compare(results, load_baseline(args.baseline), args.threshold)
+    for name, rows, before, seconds in regressions:
+        print(f"{'error' if args.fail else 'warning'}: {name} on {rows} rows "
+              f"{before * 1000:.3f}ms -> {seconds * 1000:.3f}ms ({seconds / before:.1f}x)", file=sys.stderr)
+
+    return 1 if regressions and args.fail else 0
+
+
+def cmd_storage(args):
+    from main import extract_stage, transform_stage
+    from compact import storage_report
+
+    listener = _start_logging(args)
+    try:
+        invoice_fact = transform_stage(extract_stage(args.data))[0]
+        report = storage_report(invoice_fact)
+    finally:
+        listener.stop()
+
+    print(f"{'InvoiceFact':<12} {'frame':>14} {'database':>14} {'scan':>10}")
+    for layout, sizes in report.items():
+        print(f"{layout:<12} {sizes['frame_bytes']:>8} bytes {sizes['db_bytes']:>8} bytes "
+              f"{sizes['scan_seconds'] * 1000:>8.1f}ms")
+
+
+def cmd_watch(args):
+    import signal
+    import threading
+    from ingest import Watcher
+    from main import write_metrics
+
+    stop = threading.Event()
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(signum, lambda *_: stop.set())
+
+    listener = _start_logging(args)
+    try:
+        watcher = Watcher(args.watch_dir, args.db, args.workers, args.max_pending, args.interval,
+                          sketches=args.sketches)
+        print(f"Watching {args.watch_dir}, stop with Ctrl+C")
+        watcher.run(stop, on_loaded=lambda: write_metrics(args.metrics_dir))
+    finally:
+        listener.stop()
+
+
+def cmd_sketches(args):
+    from sketches import StreamSketches, sketches_path
+
+    path = sketches_path(args.db)
+    if not os.path.exists(path):
+        print(f"{path} does not exist, run the ETL with --sketches", file=sys.stderr)
+        return 1
+
+    report = StreamSketches.load(path).report()
+    print(f"{'month':<24} {'customers':>10}")
+    for month, count in report['customers_per_month'].items():
+        print(f"{month:<24} {count:>10}")
+    print(f"{'country':<24} {'products':>10}")
+    for country, count in report['products_per_country'].items():
+        print(f"{country:<24} {count:>10}")
+    print(f"{'StockCode':<24} {'quantity':>10}")
+    for stock_code, quantity in report['top_products']:
+        print(f"{stock_code:<24} {quantity:>10}")
+
+
+def cmd_stats(args):
+    import sqlite3
+
+    if not os.path.exists(args.db):
+        print(f"{args.db} does not exist", file=sys.stderr)
+        return 1
+
+    conn = sqlite3.connect(f'file:{args.db}?mode=ro', uri=True)
+    try:
+        objects = conn.execute("SELECT name, type FROM sqlite_master "
+                               "WHERE type IN ('table', 'view') ORDER BY name").fetchall()
+        for name, object_type in objects:
+            rows = conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+            print(f"{name:<24} {object_type:<6} {rows:>10} rows")
+    finally:
+        conn.close()
+
+    print(f"{'size':<31} {os.path.getsize(args.db):>10} bytes")
+
+
+def parse_size(text):
+    ''' 512M, 2G, 1500000 -> bytes '''
+
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30}
+    text = text.strip().upper().rstrip('B')
+    try:
+        if text and text[-1] in units:
+            return int(float(text[:-1]) * units[text[-1]])
+        return int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {text}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='etl', description='Online retail invoices ETL')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_transform(command):
+        command.add_argument('--cluster-descriptions', action='store_true',
+                             help='map near duplicate StockDim descriptions to one canonical description')
+        command.add_argument('--cube-dir', default=None,
+                             help='also save the quantity and revenue cube into this directory')
+        command.add_argument('--match-cancellations', action='store_true',
+                             help='match the cancellations to their purchases (CancellationMatch, InvoiceFactNet)')
+        command.add_argument('--customer-features', action='store_true',
+                             help='create the CustomerFeatures table (recency, frequency, monetary, ...)')
+        command.add_argument('--incremental-features', action='store_true',
+                             help='append the source, only new invoices, to the stored tables and merge '
+                                  'their customer features into the stored ones')
+        command.add_argument('--basket-rules', action='store_true',
+                             help='mine the products bought together into the AssociationRule table')
+        command.add_argument('--sketches', action='store_true',
+                             help='save approximate distinct counts and top products next to the database')
+        command.add_argument('--outliers', choices=['flag', 'drop'], default=None,
+                             help='copy the extreme quantities and prices of every stock code into '
+                                  'OutlierLine (flag) or drop them')
+        command.add_argument('--profile', action='store_true',
+                             help='write the column profile of the source to profile.json in the metrics dir')
+
+    def add_sink(command):
+        command.add_argument('--sink', choices=['sqlite', 'csv'], default='sqlite',
+                             help='sqlite database or partitioned csv.gz files (default: %(default)s)')
+        command.add_argument('--output-dir', default=OUTPUT_DIR,
+                             help='directory of the csv sink (default: %(default)s)')
+        command.add_argument('--scd2', action='append', default=[], choices=['StockDim', 'CustomerDim'],
+                             help='keep the history of this dimension (type 2), can be repeated')
+        command.add_argument('--compact-fact', action='store_true',
+                             help='store InvoiceFact clustered on its key with integer pence')
+        command.add_argument('--columnar-dir', default=None,
+                             help='also write the tables as memory mapped numpy columns into this directory')
+
+    def add_paths(command, data=True, db=True):
+        if data:
+            command.add_argument('--data', default=DATA_PATH, help='source file (default: %(default)s)')
+        if db:
+            command.add_argument('--db', default=DB_PATH, help='SQLite database (default: %(default)s)')
+        command.add_argument('--log', default=LOG_PATH, help='log file (default: %(default)s)')
+        command.add_argument('--metrics-dir', default=METRICS_DIR,
+                             help='directory of etl.prom and etl.json (default: %(default)s)')
+
+    run = commands.add_parser('run', help='extract, transform and load')
+    add_paths(run)
+    run.add_argument('--partition-fact', action='store_true', help='one InvoiceFact table per month')
+    run.add_argument('--out-of-core', action='store_true',
+                     help='clean in SQLite staging tables, for sources bigger than memory')
+    run.add_argument('--chunksize', type=int, default=100_000,
+                     help='rows per chunk with --out-of-core (default: %(default)s)')
+    run.add_argument('--max-memory', type=parse_size, default=None,
+                     help='memory budget like 512M or 2G, picks the path, chunk and batch sizes')
+    add_transform(run)
+    add_sink(run)
+    run.set_defaults(func=cmd_run)
+
+    extract = commands.add_parser('extract', help='read the source file into a staging pickle')
+    add_paths(extract, db=False)
+    extract.add_argument('--output', default='./data/staged.pkl', help='staging file (default: %(default)s)')
+    extract.set_defaults(func=cmd_extract)
+
+    load = commands.add_parser('load', help='transform and load a staging pickle')
+    add_paths(load, data=False)
+    load.add_argument('--input', default='./data/staged.pkl', help='staging file (default: %(default)s)')
+    load.add_argument('--partition-fact', action='store_true', help='one InvoiceFact table per month')
+    add_transform(load)
+    add_sink(load)
+    load.set_defaults(func=cmd_load)
+
+    bench = commands.add_parser('bench', help='time every stage, loading into a temporary database')
+    add_paths(bench, db=False)
+    bench.add_argument('--partition-fact', action='store_true', help='one InvoiceFact table per month')
+    bench.set_defaults(func=cmd_bench)
+
+    storage = commands.add_parser('storage', help='compare the size and scan time of the fact table layouts')
+    add_paths(storage, db=False)
+    storage.set_defaults(func=cmd_storage)
+
+    microbench = commands.add_parser('microbench',
+                                     help='time every cleaning function and compare with the baseline')
+    microbench.add_argument('--sizes', type=int, nargs='+', default=BENCHMARK_SIZES,
+                            help='rows of the generated frames (default: %(default)s)')
+    microbench.add_argument('--function', action='append', default=None,
+                            help='benchmark only this function, can be repeated')
+    microbench.add_argument('--repeat', type=int, default=5, help='runs per timing, the best is kept (default: %(default)s)')
+    microbench.add_argument('--baseline', default=BENCHMARK_BASELINE, help='baseline file (default: %(default)s)')
+    microbench.add_argument('--save', action='store_true', help='save the timings as the new baseline')
+    microbench.add_argument('--threshold', type=float, default=0.25,
+                            help='slowdown reported as a regression, 0.25 is 25%% (default: %(default)s)')
+    microbench.add_argument('--fail', action='store_true', help='exit with 1 on a regression instead of warning')
+    microbench.set_defaults(func=cmd_microbench)
+
+    watch = commands.add_parser('watch', help='append every new source file of a directory to the database')
+    add_paths(watch, data=False)
+    watch.add_argument('--watch-dir', default=WATCH_DIR, help='directory of the new files (default: %(default)s)')
+    watch.add_argument('--workers', type=int, default=2,
+                       help='processes transforming the files (default: %(default)s)')
+    watch.add_argument('--max-pending', type=int, default=None,
+                       help='files being transformed at a time (default: the workers)')
+    watch.add_argument('--interval', type=float, default=2.0,
+                       help='seconds between polls of the directory (default: %(default)s)')
+    watch.add_argument('--sketches', action='store_true',
+                       help='merge the sketches of every new file into those of the database')
+    watch.set_defaults(func=cmd_watch)
+
+    sketches = commands.add_parser('sketches', help='distinct customers, products and top products, approximate')
+    sketches.add_argument('--db', default=DB_PATH, help='SQLite database (default: %(default)s)')
+    sketches.set_defaults(func=cmd_sketches)
+
+    stats = commands.add_parser('stats', help='row counts of the database')
+    stats.add_argument('--db', default=DB_PATH, help='SQLite database (default: %(default)s)')
+    stats.set_defaults(func=cmd_stats)
+
+    return parser
+
+
+def cli(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'out_of_core', False) and (args.partition_fact or args.sink != 'sqlite' or args.scd2
+                                                or args.compact_fact):
+        parser.error('--out-of-core only writes to an unpartitioned sqlite database')
+    if getattr(args, 'out_of_core', False) and (args.cluster_descriptions or args.cube_dir or args.columnar_dir
+                                                or args.match_cancellations or args.customer_features
+                                                or args.incremental_features or args.basket_rules
+                                                or args.outliers):
+        parser.error('--cluster-descriptions, --cube-dir, --columnar-dir, --match-cancellations, the '
+                     'customer features, --basket-rules and --outliers need the in-memory tables, '
+                     'not --out-of-core')
+    if getattr(args, 'scd2', None) and args.sink != 'sqlite':
+        parser.error('--scd2 needs the sqlite sink')
+    if getattr(args, 'incremental_features', False) and (args.sink != 'sqlite' or args.partition_fact
+                                                         or args.compact_fact):
+        parser.error('--incremental-features needs the sqlite sink without --partition-fact and --compact-fact')
+    if getattr(args, 'compact_fact', False) and (args.sink != 'sqlite' or args.partition_fact):
+        parser.error('--compact-fact needs the sqlite sink without --partition-fact')
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
@@ -2,28 +2,73 @@ import zipfile
 from pathlib import Path
 import pandas as pd
 import logging
+from config import DATA_PATH
 
 logger = logging.getLogger()
 
 
-def read_data_to_pd(filepath="./data/Invoices_Year_2009-2010.zip") -> pd.DataFrame:
+# the source file layout, shared by the full and the chunked reader
+CSV_OPTIONS = dict(header=0,
+                   parse_dates=['InvoiceDate'],
+                   encoding="iso-8859-1",
+                   dtype={'Invoice': str,
+                          'StockCode': str,
+                          'Description': str,
+                          'Quantity': int,
+                          'Price': float,
+                          'Customer ID': str,
+                          'Country': str
+                          }
+                   )
+
+
+def read_data_to_pd(filepath=DATA_PATH, profiler=None) -> pd.DataFrame:
+        '''
+        Reads the source file. With a profiler (see profiling.ColumnProfiler)
+        the columns are also profiled.
+        '''
         
-        df = pd.read_csv(filepath,
-                    header=0,
-                    parse_dates=['InvoiceDate'],
-                    encoding="iso-8859-1",
-                    dtype={'Invoice': str,
-                            'StockCode': str,
-                            'Description': str,
-                            'Quantity': int,
-                            'Price': float,
-                            'Customer ID': str,
-                            'Country': str
-                            }
-                    )
+        df = pd.read_csv(filepath, **CSV_OPTIONS)
     
         df.rename(columns={'Customer ID': 'CustomerID'}, inplace=True)
+
+        if profiler is not None:
+                profiler.update(df)
     
         return df
 
 
+def read_data_chunks(filepath=DATA_PATH, chunksize=100_000, profiler=None):
+        '''
+        Reads the source file in chunks of chunksize rows, so only one
+        chunk is in memory at a time.
+
+        Parameters
+        ----------
+        filepath: str
+                The source file
+        chunksize: int or callable
+                Rows per chunk, or a function which returns the size of
+                the next chunk (see governor.MemoryGovernor)
+        profiler: profiling.ColumnProfiler
+                Profiles every chunk as it is read, optional
+
+        Returns
+        -------
+        Iterator of pd.DataFrame with the same columns as read_data_to_pd
+        '''
+
+        next_size = chunksize if callable(chunksize) else lambda: chunksize
+
+        size = next_size()
+        with pd.read_csv(filepath, chunksize=size, **CSV_OPTIONS) as reader:
+                while True:
+                        try:
+                                chunk = reader.get_chunk(size)
+                        except StopIteration:
+                                return
+                        chunk.rename(columns={'Customer ID': 'CustomerID'}, inplace=True)
+                        if profiler is not None:
+                                profiler.update(chunk)
+                        yield chunk
+                        size = next_size()
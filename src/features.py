@@ -0,0 +1,125 @@
+import sqlite3
+import logging
+import pandas as pd
+from cleaning import derive_customer_features
+from sql import ddl
+from metrics import metrics
+from config import DB_PATH
+
+logger = logging.getLogger()
+
+# how the partial aggregates of the same customer are merged
+MERGE_AGGREGATES = {'FirstPurchaseDateID': 'min',
+                    'LastPurchaseDateID': 'max',
+                    'Frequency': 'sum',
+                    'Monetary': 'sum',
+                    'Cancellations': 'sum',
+                    'DistinctProducts': 'sum'}
+
+
+def merge_customer_features(stored_df:pd.DataFrame, delta_df:pd.DataFrame,
+                            distinct_products:pd.Series = None) -> pd.DataFrame:
+    '''
+    Merges the features of new invoices (delta_df) into the stored features
+    without the invoices they were computed from: the first purchase is the
+    minimum, the last one the maximum and the counts and the revenue are
+    summed, then Recency and CancellationRate are derived again. The
+    invoices of delta_df must not be in stored_df, or they are counted twice.
+
+    The distinct products can not be summed, a product bought in both is
+    counted twice. distinct_products, indexed by CustomerID, replaces the
+    sum for the customers it holds, see update_customer_features.
+
+    Returns
+    -------
+    pd.DataFrame: the merged features, one row per CustomerID, sorted by CustomerID
+    '''
+
+    columns = ['CustomerID'] + list(MERGE_AGGREGATES)
+
+    if any(column not in df.columns for df in [stored_df, delta_df] for column in columns):
+        raise KeyError
+
+    # an empty frame, e.g. the first run, would change the dtypes of the concatenation
+    frames = [df[columns] for df in [stored_df, delta_df] if len(df)] or [delta_df[columns]]
+    both = pd.concat(frames, ignore_index=True)
+    merged_df = both.groupby('CustomerID', sort=True).agg(MERGE_AGGREGATES).reset_index()
+    for column in ['FirstPurchaseDateID', 'LastPurchaseDateID']:
+        merged_df[column] = merged_df[column].astype('Int64')
+
+    if distinct_products is not None:
+        exact = merged_df['CustomerID'].map(distinct_products)
+        merged_df['DistinctProducts'] = exact.fillna(merged_df['DistinctProducts']).astype('int64')
+
+    return derive_customer_features(merged_df)
+
+
+def update_customer_features(features_df:pd.DataFrame, products_df:pd.DataFrame, db_path=DB_PATH) -> dict:
+    '''
+    Merges the features and the products of new invoices into the stored
+    CustomerFeatures and CustomerProduct tables in one transaction. The
+    products are inserted unless they are already stored. The distinct
+    products of the customers of the delta are counted from CustomerProduct
+    with its primary key. The features are rewritten, because Recency
+    changes with every new purchase. The cost grows with the number of
+    customers and of their products, not with the stored invoices.
+
+    Parameters
+    ----------
+    features_df: pd.DataFrame
+        The features of the new invoices, see cleaning.create_customer_features_df
+    products_df: pd.DataFrame
+        Their products, see cleaning.create_customer_product_df
+    db_path: str
+        The database of the tables
+
+    Returns
+    -------
+    dict: the number of new and updated customers and of new products
+    '''
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute('BEGIN')
+        try:
+            conn.execute(ddl.create_customer_features)
+            conn.execute(ddl.create_customer_product)
+
+            products_before = conn.execute('SELECT COUNT(*) FROM CustomerProduct').fetchone()[0]
+            conn.executemany('INSERT OR IGNORE INTO CustomerProduct (CustomerID, StockCode) VALUES (?, ?)',
+                             products_df[['CustomerID', 'StockCode']].itertuples(index=False))
+            new_products = conn.execute('SELECT COUNT(*) FROM CustomerProduct').fetchone()[0] - products_before
+
+            conn.execute('CREATE TEMP TABLE DeltaCustomers (CustomerID text primary key)')
+            conn.executemany('INSERT INTO temp.DeltaCustomers VALUES (?)',
+                             features_df[['CustomerID']].itertuples(index=False))
+            distinct_products = pd.read_sql('SELECT p.CustomerID, COUNT(*) AS DistinctProducts '
+                                            'FROM temp.DeltaCustomers d '
+                                            'JOIN CustomerProduct p ON p.CustomerID = d.CustomerID '
+                                            'GROUP BY p.CustomerID', conn, index_col='CustomerID')
+            conn.execute('DROP TABLE temp.DeltaCustomers')
+
+            stored_df = pd.read_sql('SELECT * FROM CustomerFeatures', conn)
+            merged_df = merge_customer_features(stored_df, features_df, distinct_products['DistinctProducts'])
+
+            columns = list(merged_df.columns)
+            conn.execute('DELETE FROM CustomerFeatures')
+            conn.executemany(f'INSERT INTO CustomerFeatures ({", ".join(columns)}) '
+                             f'VALUES ({", ".join("?" * len(columns))})',
+                             merged_df.astype(object).where(merged_df.notna(), None).itertuples(index=False))
+
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+
+    is_new = ~features_df['CustomerID'].isin(stored_df['CustomerID'])
+    counts = {'new': int(is_new.sum()), 'updated': int((~is_new).sum()), 'products': int(new_products)}
+    metrics.inc('etl_rows_loaded_total', counts['new'] + counts['updated'], table='CustomerFeatures')
+    metrics.inc('etl_rows_loaded_total', counts['products'], table='CustomerProduct')
+    logger.info(f"CustomerFeatures: {counts['new']} new, {counts['updated']} updated customers, "
+                f"{counts['products']} new products")
+
+    return counts
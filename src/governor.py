@@ -0,0 +1,141 @@
+import os
+import zipfile
+import logging
+import pandas as pd
+from extract import CSV_OPTIONS
+from metrics import metrics, current_rss, peak_rss
+
+logger = logging.getLogger()
+
+# rough peak memory of each path as a multiple of the size of the rows it holds
+IN_MEMORY_FACTOR = 4   # source frame, the copies of transform_data and the fact frame
+CHUNK_FACTOR = 3       # a chunk and its rows while to_sql converts them
+LOAD_BATCH_FACTOR = 6  # to_sql turns every value into a python object
+
+
+class MemoryGovernor:
+    '''
+    Keeps a run under a memory budget. plan measures the memory of a sample
+    of the source and picks the execution path, the chunk size and the load
+    batch size. While running, check is called between chunks and batches,
+    it follows the RSS of the process and halves the sizes when the RSS
+    gets close to the budget.
+
+    Parameters
+    ----------
+    max_bytes: int
+        The memory budget of the process
+    shrink_at: float
+        Fraction of the budget at which the sizes are halved
+    min_rows: int
+        The sizes never go below this
+    '''
+
+    def __init__(self, max_bytes, shrink_at=0.9, min_rows=1_000):
+        self.max_bytes = max_bytes
+        self.shrink_at = shrink_at
+        self.min_rows = min_rows
+
+        self.row_bytes = None
+        self.estimated_rows = None
+        self.out_of_core = False
+        self.chunk_rows = None
+        self.load_batch_rows = None
+        self.peak_rss = current_rss() or 0
+        self.shrinks = 0
+
+    def measure_row_bytes(self, filepath, sample_rows=10_000):
+        ''' In-memory bytes per row of a sample of the source, strings included '''
+
+        sample = pd.read_csv(filepath, nrows=sample_rows, **CSV_OPTIONS)
+        return max(1, int(sample.memory_usage(deep=True).sum() / max(len(sample), 1)))
+
+    def estimate_rows(self, filepath, sample_rows=10_000):
+        ''' Rows of the source, from the uncompressed size and the size of the first lines '''
+
+        if zipfile.is_zipfile(filepath):
+            with zipfile.ZipFile(filepath) as archive:
+                size = sum(info.file_size for info in archive.infolist())
+                with archive.open(archive.infolist()[0]) as f:
+                    head = [f.readline() for _ in range(sample_rows)]
+        else:
+            size = os.path.getsize(filepath)
+            with open(filepath, 'rb') as f:
+                head = [f.readline() for _ in range(sample_rows)]
+
+        head = [line for line in head if line]
+        return int(size / max(1, sum(map(len, head)) / max(len(head), 1)))
+
+    def plan(self, filepath):
+        '''
+        Chooses between the in-memory and the out-of-core path and the
+        chunk and load batch sizes that fit in the budget.
+
+        Returns
+        -------
+        bool: True if the run should use the out-of-core path
+        '''
+
+        self.row_bytes = self.measure_row_bytes(filepath)
+        self.estimated_rows = self.estimate_rows(filepath)
+
+        available = max(self.max_bytes - self.observe(), 0)
+        self.out_of_core = self.row_bytes * self.estimated_rows * IN_MEMORY_FACTOR > available
+        self.chunk_rows = max(self.min_rows, available // (self.row_bytes * CHUNK_FACTOR))
+        # the load batches are taken while the cleaned frame is in memory
+        load_available = available if self.out_of_core else available / IN_MEMORY_FACTOR
+        self.load_batch_rows = max(self.min_rows, int(load_available // (self.row_bytes * LOAD_BATCH_FACTOR)))
+
+        logger.info(f"Memory budget {self.max_bytes} bytes, {self.row_bytes} bytes per row, "
+                    f"about {self.estimated_rows} rows: "
+                    f"{'out of core' if self.out_of_core else 'in memory'}, "
+                    f"chunks of {self.chunk_rows} rows, load batches of {self.load_batch_rows} rows")
+        self._record()
+
+        return self.out_of_core
+
+    def observe(self):
+        rss = current_rss() or 0
+        self.peak_rss = max(self.peak_rss, rss)
+        return rss
+
+    def check(self):
+        ''' Called between chunks and batches, shrinks the sizes near the budget '''
+
+        if self.observe() > self.max_bytes * self.shrink_at:
+            chunk_rows = max(self.min_rows, self.chunk_rows // 2)
+            load_batch_rows = max(self.min_rows, self.load_batch_rows // 2)
+            if (chunk_rows, load_batch_rows) != (self.chunk_rows, self.load_batch_rows):
+                self.chunk_rows, self.load_batch_rows = chunk_rows, load_batch_rows
+                self.shrinks += 1
+                logger.warning(f"RSS {self.peak_rss} bytes is close to the budget, chunks of "
+                               f"{self.chunk_rows} rows and load batches of {self.load_batch_rows} rows")
+        self._record()
+
+    def next_chunk_rows(self):
+        self.check()
+        return self.chunk_rows
+
+    def next_load_batch_rows(self):
+        self.check()
+        return self.load_batch_rows
+
+    def _record(self):
+        metrics.set_gauge('etl_memory_budget_bytes', self.max_bytes)
+        metrics.set_gauge('etl_chunk_rows', self.chunk_rows or 0)
+        metrics.set_gauge('etl_load_batch_rows', self.load_batch_rows or 0)
+
+    def report(self):
+        ''' The chosen sizes and the peak memory of the run '''
+
+        self.observe()
+        self.peak_rss = max(self.peak_rss, peak_rss() or 0)
+        self._record()
+        return {'max_bytes': self.max_bytes,
+                'row_bytes': self.row_bytes,
+                'estimated_rows': self.estimated_rows,
+                'out_of_core': self.out_of_core,
+                'chunk_rows': self.chunk_rows,
+                'load_batch_rows': self.load_batch_rows,
+                'peak_rss': self.peak_rss,
+                'shrinks': self.shrinks}
@@ -0,0 +1,334 @@
+import os
+import time
+import fnmatch
+import hashlib
+import sqlite3
+import logging
+import threading
+import contextlib
+import multiprocessing
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from sql import ddl
+from load import write_lock, scd2_dims
+from metrics import metrics
+from config import DB_PATH, WATCH_DIR
+
+logger = logging.getLogger()
+
+PATTERNS = ('*.zip', '*.csv')
+
+# how the rows of every table are written: the facts are appended, a
+# dimension member of a new file replaces the stored one
+APPEND_STATEMENTS = [('InvoiceFact', 'INSERT'),
+                     ('DateDim', 'INSERT OR IGNORE'),
+                     ('StockDim', 'INSERT OR REPLACE'),
+                     ('CustomerDim', 'INSERT OR REPLACE')]
+
+
+def file_digest(path:str, block_size:int = 2**20) -> str:
+    ''' The sha256 of the file, read block_size bytes at a time '''
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _now():
+    return datetime.now().isoformat(sep=' ', timespec='seconds')
+
+
+def _prepare(path:str):
+    ''' Extracts and transforms one source file, runs in a worker process '''
+
+    from extract import read_data_to_pd
+    from transform import transform_data
+
+    data = read_data_to_pd(path)
+    return len(data), transform_data(data)
+
+
+def last_guest(conn:sqlite3.Connection) -> int:
+    ''' The largest number of the guest customer codes (Gxxxx) in CustomerDim, 0 without guests '''
+
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'CustomerDim'").fetchone():
+        return 0
+    (last,) = conn.execute("SELECT MAX(CAST(SUBSTR(CustomerID, 2) AS integer)) FROM CustomerDim "
+                           "WHERE CustomerID GLOB 'G[0-9]*'").fetchone()
+    return last or 0
+
+
+def offset_guests(df:pd.DataFrame, last:int) -> pd.DataFrame:
+    ''' df with the numbers of its guest customer codes moved after last '''
+
+    if not last or 'CustomerID' not in df.columns:
+        return df
+
+    customer_ids = df['CustomerID']
+    is_guest = customer_ids.astype(str).str.fullmatch(r'G\d+')
+    numbers = customer_ids[is_guest].str[1:].astype(np.int64) + last
+    return df.assign(CustomerID=customer_ids.mask(is_guest, 'G' + numbers.map('{:04d}'.format)))
+
+
+def renumber_guests(conn:sqlite3.Connection, tables:tuple) -> tuple:
+    '''
+    Numbers the guest customers (Gxxxx) of the tables of one file after
+    the largest guest code of the database. transform_data numbers the
+    guests of every file from G0001, the guests of different files would
+    become one customer. Called in the open transaction of conn which
+    appends the tables, so two loads never take the same codes.
+    '''
+
+    last = last_guest(conn)
+    return tuple(offset_guests(df, last) for df in tables)
+
+
+def append_table(conn:sqlite3.Connection, table_name:str, df:pd.DataFrame) -> None:
+    ''' Appends the rows of one table in the open transaction of conn, see APPEND_STATEMENTS '''
+
+    statement = dict(APPEND_STATEMENTS)[table_name]
+    columns = list(df.columns)
+    conn.executemany(f'{statement} INTO {table_name} ({", ".join(columns)}) '
+                     f'VALUES ({", ".join("?" * len(columns))})',
+                     df.astype(object).where(df.notna(), None).itertuples(index=False))
+    metrics.inc('etl_rows_loaded_total', len(df), table=table_name)
+
+
+def append_tables(conn:sqlite3.Connection, tables:tuple) -> None:
+    '''
+    Appends the tables of transform_data to the database in the open
+    transaction of conn, see APPEND_STATEMENTS.
+    '''
+
+    for (table_name, _), df in zip(APPEND_STATEMENTS, tables):
+        append_table(conn, table_name, df)
+
+
+class Watcher:
+    '''
+    Watches a directory for new source files and appends them to the
+    database, the long running alternative to rerunning the ETL by hand.
+
+    Every poll lists the directory. A file is taken once its size and
+    modification time did not change between two polls, so files which
+    are still being copied are left alone. The files are extracted and
+    transformed by a pool of worker processes, at most max_pending at a
+    time: when the pool is busy the remaining files wait on disk for a
+    later poll, so a burst of arrivals never queues more work than the
+    host was sized for. The results are loaded by the watcher itself, one
+    file at a time, as SQLite has a single writer.
+
+    The IngestionLedger table records every file by the sha256 of its
+    contents. A file is loaded in the same transaction which marks it as
+    loaded, so after a crash or a restart a loaded file is never loaded
+    again and an interrupted one is retried. A failed file is retried only
+    when its contents change. Files with the same contents under another
+    name are skipped, overlapping invoices of different files are not. The
+    guest customer codes (Gxxxx) of a file are numbered after those already
+    loaded (see renumber_guests). A full run of
+    the ETL replaces the database but keeps the ledger, the files already
+    appended are not appended again (see load.copy_ledger). The watcher
+    writes under load.write_lock, so the run swaps its database in between
+    two writes of the watcher.
+
+    With sketches the watcher sketches the lines of every loaded file, after
+    its guests were renumbered, and merges them into the sketches saved
+    next to the database (see sketches.StreamSketches).
+
+        Watcher('./data/incoming').run()
+
+    Parameters
+    ----------
+    watch_dir: str
+        The directory of the new source files
+    db_path: str
+        The database, with the plain (not partitioned, not compact) tables
+    workers: int
+        Worker processes
+    max_pending: int
+        Files being transformed or waiting for a worker, by default workers
+    interval: float
+        Seconds between polls
+    patterns: tuple
+        File name patterns of the source files
+    sketches: bool
+        Keep the sketches of the database up to date
+    '''
+
+    def __init__(self, watch_dir=WATCH_DIR, db_path=DB_PATH, workers=2, max_pending=None, interval=2.0,
+                 patterns=PATTERNS, sketches=False):
+        self.watch_dir = watch_dir
+        self.db_path = db_path
+        self.workers = workers
+        self.max_pending = max_pending or workers
+        self.interval = interval
+        self.patterns = patterns
+        self.sketches = sketches
+        self._sizes = {}
+        self._digests = {}
+        self._pending = {}
+        self._create_tables()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, isolation_level=None, timeout=60)
+
+    @contextlib.contextmanager
+    def _writing(self):
+        ''' A connection to write the database, which a full run does not swap while it is open '''
+
+        with write_lock(self.db_path):
+            conn = self._connect()
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+    def _create_tables(self):
+        with self._writing() as conn:
+            row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'InvoiceFact'").fetchone()
+            if row is not None and row[0] != 'table':
+                raise ValueError("The watcher appends to a plain InvoiceFact table, not to a view")
+            # INSERT OR REPLACE would break the versions of a type 2 dimension
+            if scd2_dims(conn):
+                raise ValueError(f"The watcher appends to plain dimensions, not to the type 2 "
+                                 f"{', '.join(scd2_dims(conn))}")
+            for statement in [ddl.create_invoice_fact, ddl.create_date_dim, ddl.create_stock_dim,
+                              ddl.create_customer_dim, ddl.create_ingestion_ledger]:
+                conn.execute(statement)
+
+    def _ledger_status(self, digest):
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT Status FROM IngestionLedger WHERE Digest = ?', (digest,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row is not None else None
+
+    def _record(self, conn, digest, path, status, **columns):
+        columns = {'Path': path, 'Status': status, **columns}
+        conn.execute(f'INSERT INTO IngestionLedger (Digest, {", ".join(columns)}) '
+                     f'VALUES (?, {", ".join("?" * len(columns))}) '
+                     f'ON CONFLICT(Digest) DO UPDATE SET '
+                     f'{", ".join(f"{name} = excluded.{name}" for name in columns)}',
+                     (digest, *columns.values()))
+
+    def new_files(self) -> list:
+        '''
+        The files of the directory which stopped growing and are not in the
+        ledger as loaded or failed, oldest first.
+        '''
+
+        files = []
+        for entry in os.scandir(self.watch_dir):
+            if not entry.is_file() or not any(fnmatch.fnmatch(entry.name, p) for p in self.patterns):
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.path, (stat.st_size, stat.st_mtime_ns)))
+
+        ready = []
+        for _, path, signature in sorted(files):
+            previous = self._sizes.get(path)
+            self._sizes[path] = signature
+            if previous != signature or path in self._pending.values():
+                continue
+
+            # the digest of an unchanged file is computed once
+            known = self._digests.get(path)
+            if known is None or known[0] != signature:
+                self._digests[path] = (signature, file_digest(path))
+            digest = self._digests[path][1]
+
+            if digest in self._pending or self._ledger_status(digest) in ('loaded', 'failed'):
+                continue
+            ready.append((digest, path))
+
+        return ready
+
+    def _load(self, digest, path, future, started):
+        with self._writing() as conn:
+            try:
+                rows, tables = future.result()
+                conn.execute('BEGIN IMMEDIATE')
+                tables = renumber_guests(conn, tables)
+                append_tables(conn, tables)
+                self._record(conn, digest, path, 'loaded', Rows=rows, FinishedAt=_now())
+                conn.execute('COMMIT')
+            except Exception as error:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                logger.exception(f"Ingesting {path} failed")
+                self._record(conn, digest, path, 'failed', FinishedAt=_now(), Error=repr(error))
+                metrics.inc('etl_ingested_files_total', status='failed')
+                return
+
+        if self.sketches:
+            self._merge_sketches(tables)
+
+        metrics.inc('etl_ingested_files_total', status='loaded')
+        metrics.inc('etl_rows_read_total', rows)
+        metrics.observe('etl_ingest_latency_seconds', time.time() - started)
+        logger.info(f"Ingested {path}: {rows} rows")
+
+    def _merge_sketches(self, tables):
+        from sketches import StreamSketches, sketches_path, sketch_tables
+
+        file_sketches = sketch_tables(tables[0], tables[3])
+        path = sketches_path(self.db_path)
+        if os.path.exists(path):
+            file_sketches = StreamSketches.load(path).merge(file_sketches)
+        file_sketches.save(path)
+
+    def run(self, stop=None, on_loaded=None) -> None:
+        '''
+        Polls and ingests until stop (a threading.Event) is set, forever by
+        default. on_loaded is called after every loaded or failed file, e.g.
+        to write the metrics.
+        '''
+
+        if stop is None:
+            stop = threading.Event()
+
+        # spawned workers do not inherit the threads (e.g. the log listener) of the watcher
+        context = multiprocessing.get_context('spawn')
+        pool = ProcessPoolExecutor(self.workers, mp_context=context)
+        in_flight = {}
+
+        try:
+            while not stop.is_set():
+                for digest, path in self.new_files():
+                    if len(in_flight) >= self.max_pending:
+                        break
+
+                    with self._writing() as conn:
+                        self._record(conn, digest, path, 'processing', StartedAt=_now(),
+                                     FinishedAt=None, Error=None)
+                    logger.info(f"Ingesting {path}")
+                    in_flight[pool.submit(_prepare, path)] = (digest, path, time.time())
+                    self._pending[digest] = path
+
+                metrics.set_gauge('etl_ingest_pending_files', len(in_flight))
+                if not in_flight:
+                    stop.wait(self.interval)
+                    continue
+
+                done, _ = wait(in_flight, timeout=self.interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    digest, path, started = in_flight.pop(future)
+                    self._load(digest, path, future, started)
+                    del self._pending[digest]
+                    metrics.set_gauge('etl_ingest_pending_files', len(in_flight))
+                    if on_loaded is not None:
+                        on_loaded()
+
+                    # a killed worker (e.g. out of memory) breaks the pool, its files fail
+                    if isinstance(future.exception(), BrokenProcessPool) and not in_flight:
+                        logger.warning("A worker process died, restarting the pool")
+                        pool.shutdown(wait=False)
+                        pool = ProcessPoolExecutor(self.workers, mp_context=context)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -1,35 +1,489 @@
+import os
+import re
+import fcntl
 import sqlite3
+import tempfile
+import logging
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from sql import ddl
+from metrics import metrics
+from config import DB_PATH
 from sqlalchemy import create_engine
 
+logger = logging.getLogger()
 
-def create_tables():
-   conn = sqlite3.connect('./db/invoicedb')
+# InvoiceFact_YYYY_MM, one table per month when the fact table is partitioned
+PARTITION_NAME = re.compile(r'^InvoiceFact_(\d{4})_(\d{2})$')
+
+# the dimensions which can be kept as type 2 dimensions (see scd.apply_scd2)
+SCD2_DIMS = ('StockDim', 'CustomerDim')
+
+
+def without_foreign_keys(statement, tables):
+   '''
+   The create statement of a fact table without its foreign keys to the
+   given tables. A type 2 dimension has a row per version of a key, a
+   foreign key to it fails with a foreign key mismatch.
+   '''
+
+   for table in tables:
+      statement = re.sub(rf',\s*FOREIGN KEY\(\w+\) REFERENCES {table}\(\w+\)', '', statement)
+   return statement
+
+
+def scd2_dims(conn):
+   ''' The type 2 dimensions of a database '''
+
+   return [table for table in SCD2_DIMS
+           if 'IsCurrent' in [row[1] for row in conn.execute(f'PRAGMA main.table_info({table})')]]
+
+
+def create_tables(db_path=DB_PATH, partitioned=False, keep_tables=(), compact=False, append=False):
+   conn = sqlite3.connect(db_path)
    cursor = conn.cursor()
 
    # dropping tables if exists
-   cursor.execute(ddl.drop_invoice_fact)
-   cursor.execute(ddl.drop_stock_dim)
-   cursor.execute(ddl.drop_customer_dim)
-   cursor.execute(ddl.drop_date_dim)
+   # the tables in keep_tables (type 2 dimensions) keep their history
+   # with append the plain InvoiceFact and the dimensions are kept, the run appends to them
+   if not append:
+      drop_fact_partitions(cursor)
+      cursor.execute(ddl.drop_invoice_fact_compact)
+      cursor.execute(ddl.drop_invoice_fact)
+   if 'StockDim' not in keep_tables and not append:
+      cursor.execute(ddl.drop_scd2_current_view.format(table='StockDim'))
+      cursor.execute(ddl.drop_stock_dim)
+   if 'CustomerDim' not in keep_tables and not append:
+      cursor.execute(ddl.drop_scd2_current_view.format(table='CustomerDim'))
+      cursor.execute(ddl.drop_customer_dim)
+   if not append:
+      cursor.execute(ddl.drop_date_dim)
+   cursor.execute(ddl.drop_invoice_fact_net_view)
+   cursor.execute(ddl.drop_cancellation_match)
+   cursor.execute(ddl.drop_association_rule)
+   cursor.execute(ddl.drop_outlier_line)
+   if 'CustomerFeatures' not in keep_tables:
+      cursor.execute(ddl.drop_customer_features)
+      cursor.execute(ddl.drop_customer_product)
    conn.execute('PRAGMA foreign_keys = ON;') # enable foreign keys
 
    #recreating the tables
-   cursor.execute(ddl.create_invoice_fact)
-   cursor.execute(ddl.create_stock_dim)
-   cursor.execute(ddl.create_customer_dim)
+   # a partitioned fact table is a view which is created by load_fact_partitions
+   # a compact fact table is a view of InvoiceFactCompact
+   # the type 2 dimensions in keep_tables are not referenced by the fact table
+   if compact:
+      cursor.execute(without_foreign_keys(ddl.create_invoice_fact_compact, keep_tables))
+      cursor.execute(ddl.create_invoice_fact_compact_view)
+   elif not partitioned:
+      cursor.execute(without_foreign_keys(ddl.create_invoice_fact, keep_tables))
+   if 'StockDim' not in keep_tables:
+      cursor.execute(ddl.create_stock_dim)
+   if 'CustomerDim' not in keep_tables:
+      cursor.execute(ddl.create_customer_dim)
    cursor.execute(ddl.create_date_dim)
-   
+   cursor.execute(ddl.create_association_rule)
+   cursor.execute(ddl.create_outlier_line)
+   cursor.execute(ddl.create_customer_features)
+   cursor.execute(ddl.create_customer_product)
+
    # commiting
    conn.commit()
 
    conn.close()
-        
 
-def load_db(table_name, df):
 
-   engine = create_engine('sqlite:///db/invoicedb')
-   connection = engine.connect()
-   
-   # load dataframe to db
-   df.to_sql(name=table_name, con=connection, if_exists="append", index=False)
+def create_cancellation_match(db_path=DB_PATH):
+   ''' Creates the CancellationMatch table and the InvoiceFactNet view, for a run which matches the cancellations '''
+
+   conn = sqlite3.connect(db_path)
+   try:
+      conn.execute(ddl.create_cancellation_match)
+      conn.execute(ddl.create_invoice_fact_net_view)
+      conn.commit()
+   finally:
+      conn.close()
+
+
+@contextlib.contextmanager
+def write_lock(db_path=DB_PATH):
+   '''
+   Holds the exclusive lock of db_path, a lock file next to it. Every
+   writer of the live database takes it around its connection
+   (replace_fact_partition, ingest.Watcher) and swap_shadow holds it while
+   it renames the shadow, so no write connection lives across a swap.
+   The SQLite locks can not do this, they belong to the inode which the
+   rename replaces.
+   '''
+
+   with open(f'{db_path}.lock', 'a') as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      try:
+         yield
+      finally:
+         fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def shadow_path(db_path=DB_PATH):
+   return f'{db_path}.shadow'
+
+
+def create_shadow(db_path=DB_PATH, keep_tables=()):
+   '''
+   Starts a new shadow database next to db_path, the run loads into the
+   shadow while readers keep using db_path (see swap_shadow). A shadow
+   left over by a failed run is removed. With keep_tables (type 2
+   dimensions) the shadow starts as a copy of db_path, so their history
+   is carried over, otherwise only the IngestionLedger is (see copy_ledger).
+
+   Returns
+   -------
+   str: the path of the shadow database
+   '''
+
+   shadow = shadow_path(db_path)
+   for path in [shadow, f'{shadow}-journal', f'{shadow}-wal', f'{shadow}-shm']:
+      if os.path.exists(path):
+         logger.warning(f"Removing {path} of an unfinished run")
+         os.remove(path)
+
+   if keep_tables and os.path.exists(db_path):
+      live = sqlite3.connect(db_path)
+      target = sqlite3.connect(shadow)
+      try:
+         live.backup(target)
+      finally:
+         target.close()
+         live.close()
+   elif os.path.exists(db_path):
+      copy_ledger(db_path, shadow)
+
+   return shadow
+
+
+def copy_ledger(db_path, shadow):
+   '''
+   Copies the IngestionLedger of db_path into the shadow. The ledger of the
+   files appended by ingest.Watcher outlives a full run, otherwise the
+   watcher would append the files in its directory again.
+   '''
+
+   conn = sqlite3.connect(shadow)
+   try:
+      conn.execute('ATTACH DATABASE ? AS live', (db_path,))
+      if conn.execute("SELECT 1 FROM live.sqlite_master WHERE name = 'IngestionLedger'").fetchone():
+         conn.execute(ddl.create_ingestion_ledger)
+         conn.execute('INSERT INTO main.IngestionLedger SELECT * FROM live.IngestionLedger')
+         conn.commit()
+      conn.execute('DETACH DATABASE live')
+   finally:
+      conn.close()
+
+
+def swap_shadow(db_path=DB_PATH):
+   '''
+   Moves the complete shadow database over db_path with a rename, which
+   is atomic: a reader opens either the old or the new database, never a
+   partial one. The shadow is checkpointed and switched to a rollback
+   journal first (a copy of a WAL database is in WAL mode too), so all of
+   its pages are in the one file which is renamed. The WAL of the old
+   database is checkpointed and emptied as well, the new database must
+   not see frames of the old one. Only the renamed database is switched to
+   WAL mode, so readers are never blocked by a writer. Connections opened
+   before the swap keep reading the old database until they reconnect
+   (see readers.ReadPool).
+
+   A write connection to db_path which is open during the swap would
+   write its frames into the WAL of the new database and corrupt it. The
+   swap holds write_lock, which the writers of this package take as well,
+   any other writer must not run during a swap.
+   '''
+
+   shadow = shadow_path(db_path)
+
+   conn = sqlite3.connect(shadow)
+   try:
+      conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+      mode = conn.execute('PRAGMA journal_mode = DELETE').fetchone()[0]
+   finally:
+      conn.close()
+   if mode != 'delete' or os.path.exists(f'{shadow}-wal'):
+      raise sqlite3.OperationalError(f"{shadow} still has a WAL, it is not swapped")
+
+   with write_lock(db_path):
+      if os.path.exists(db_path):
+         conn = sqlite3.connect(db_path, timeout=60)
+         try:
+            busy, _, _ = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+            if busy:
+               raise sqlite3.OperationalError(f"{db_path} has readers in the middle of its WAL, "
+                                              f"the shadow is kept")
+         finally:
+            conn.close()
+
+      os.replace(shadow, db_path)
+
+      conn = sqlite3.connect(db_path, timeout=60)
+      try:
+         conn.execute('PRAGMA journal_mode = WAL')
+      finally:
+         conn.close()
+   logger.info(f"Swapped {shadow} into {db_path}")
+
+
+def load_db(table_name, df, db_path=DB_PATH, batch_rows=None):
+   '''
+   Appends the dataframe to the table. With batch_rows the rows are
+   inserted in batches, batch_rows is a number of rows or a function
+   which returns the size of the next batch (see governor.MemoryGovernor).
+   '''
+
+   if batch_rows is None:
+      next_size = lambda: max(len(df), 1)
+   elif callable(batch_rows):
+      next_size = batch_rows
+   else:
+      next_size = lambda: batch_rows
+
+   # the engine is disposed, so no pooled connection keeps the database open
+   engine = create_engine(f'sqlite:///{db_path}')
+   try:
+      with engine.connect() as connection:
+         # load dataframe to db
+         start = 0
+         while start < len(df) or start == 0:
+            batch = df.iloc[start:start + next_size()]
+            with metrics.timer('etl_batch_duration_seconds', table=table_name):
+               batch.to_sql(name=table_name, con=connection, if_exists="append", index=False)
+            start += max(len(batch), 1)
+         connection.commit()
+   finally:
+      engine.dispose()
+   metrics.inc('etl_rows_loaded_total', len(df), table=table_name)
+
+
+def create_indexes(db_path=DB_PATH):
+   '''
+   Builds the star join indexes of the fact table, or of every fact
+   partition, and of the dimensions, then runs ANALYZE so the query
+   planner uses them. Called once after the bulk load.
+   '''
+
+   conn = sqlite3.connect(db_path)
+   try:
+      partitions = list_fact_partitions(conn)
+      compact = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'InvoiceFactCompact'").fetchone()
+
+      if compact:
+         fact_tables = ['InvoiceFactCompact']
+         for statement in ddl.create_invoice_fact_compact_indexes:
+            conn.execute(statement)
+      else:
+         # an empty partitioned InvoiceFact is a view without partitions, there is nothing to index
+         is_view = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'InvoiceFact' "
+                                "AND type = 'view'").fetchone()
+         fact_tables = [name for _, _, name in partitions] if partitions or is_view else ['InvoiceFact']
+         for name in fact_tables:
+            for statement in ddl.create_invoice_fact_indexes:
+               conn.execute(statement.format(schema='main', name=name))
+      for statement in ddl.create_dim_indexes:
+         conn.execute(statement)
+
+      conn.execute(ddl.analyze)
+      conn.commit()
+   finally:
+      conn.close()
+
+   logger.info(f"Indexed {len(fact_tables)} fact tables and the dimensions")
+
+
+def partition_name(year, month):
+   return f'InvoiceFact_{year:04d}_{month:02d}'
+
+
+def list_fact_partitions(conn, start=None, end=None):
+   '''
+   Lists the InvoiceFact partitions of a database.
+
+   Parameters
+   ----------
+   conn: sqlite3.Connection
+      Connection to the database
+   start, end: tuple
+      Optional (year, month) bounds, both inclusive
+
+   Returns
+   -------
+   list: (year, month, table name) tuples sorted by month
+   '''
+
+   partitions = []
+   for (name,) in conn.execute("SELECT name FROM main.sqlite_master WHERE type = 'table'"):
+      match = PARTITION_NAME.match(name)
+      if match is None:
+         continue
+      key = (int(match.group(1)), int(match.group(2)))
+      if (start is None or key >= tuple(start)) and (end is None or key <= tuple(end)):
+         partitions.append(key + (name,))
+
+   return sorted(partitions)
+
+
+def drop_fact_partitions(cursor):
+   ''' Drops the InvoiceFact view and all of its partitions '''
+
+   row = cursor.execute("SELECT type FROM sqlite_master WHERE name = 'InvoiceFact'").fetchone()
+   if row is not None and row[0] == 'view':
+      cursor.execute(ddl.drop_invoice_fact_view)
+
+   for _, _, name in list_fact_partitions(cursor.connection):
+      cursor.execute(f'DROP TABLE IF EXISTS {name}')
+
+
+def _union_partitions(partitions):
+   return '\nUNION ALL\n'.join(f'SELECT * FROM main.{name}' for _, _, name in partitions)
+
+
+def _stage_partition(df, staging_path):
+   # every month is converted and written into its own file, so this runs in parallel
+   conn = sqlite3.connect(staging_path)
+   try:
+      conn.execute(ddl.create_invoice_fact)
+      with metrics.timer('etl_batch_duration_seconds', table='InvoiceFact'):
+         df.to_sql(name='InvoiceFact', con=conn, if_exists='append', index=False)
+      conn.commit()
+   finally:
+      conn.close()
+
+
+def _swap_partition(conn, year, month, staging_path, indexed=False, scd2=()):
+   name = partition_name(year, month)
+   create_partition = without_foreign_keys(ddl.create_invoice_fact_partition, set(scd2) | set(scd2_dims(conn)))
+   conn.execute('ATTACH DATABASE ? AS staging', (staging_path,))
+   try:
+      # a single transaction, readers see either the old month or the new one
+      conn.execute('BEGIN')
+      try:
+         conn.execute(f'DROP TABLE IF EXISTS main.{name}')
+         conn.execute(create_partition.format(name=f'main.{name}'))
+         conn.execute(f'INSERT INTO main.{name} SELECT * FROM staging.InvoiceFact')
+         if indexed:
+            for statement in ddl.create_invoice_fact_indexes:
+               conn.execute(statement.format(schema='main', name=name))
+         conn.execute('DROP VIEW IF EXISTS main.InvoiceFact')
+         conn.execute(f'CREATE VIEW main.InvoiceFact AS {_union_partitions(list_fact_partitions(conn))}')
+         conn.execute('COMMIT')
+      except Exception:
+         conn.execute('ROLLBACK')
+         raise
+   finally:
+      conn.execute('DETACH DATABASE staging')
+
+
+def load_fact_partitions(df, db_path=DB_PATH, max_workers=None, scd2=()):
+   '''
+   Loads the InvoiceFact dataframe into one table per month (InvoiceFact_YYYY_MM)
+   behind an InvoiceFact UNION ALL view. The months are written in parallel to
+   staging files and then swapped into the database one by one, so a month that
+   already exists is replaced atomically.
+
+   Parameters
+   ----------
+   df: pd.DataFrame
+      The InvoiceFact dataframe, the partition is taken from DateID (yymmddHHMM)
+   db_path: str
+      The database that holds the partitions
+   max_workers: int
+      Number of months that are written at the same time
+   scd2: tuple
+      The dimensions kept as type 2 dimensions, the partitions have no
+      foreign keys to them (nor to the type 2 dimensions already stored)
+
+   Returns
+   -------
+   list: the (year, month) tuples that were loaded
+   '''
+
+   if 'DateID' not in df.columns:
+      raise KeyError
+
+   date_id = df['DateID'].astype('int64')
+   years = 2000 + date_id // 10**8
+   months = date_id // 10**6 % 100
+   groups = [(year, month, part) for (year, month), part in df.groupby([years, months], sort=True)]
+
+   with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(db_path))) as staging_dir:
+      staging_paths = [os.path.join(staging_dir, f'{partition_name(year, month)}.db')
+                       for year, month, _ in groups]
+
+      with ThreadPoolExecutor(max_workers=max_workers) as executor:
+         list(executor.map(_stage_partition, [part for _, _, part in groups], staging_paths))
+
+      conn = sqlite3.connect(db_path, isolation_level=None)
+      try:
+         for (year, month, part), staging_path in zip(groups, staging_paths):
+            _swap_partition(conn, year, month, staging_path, scd2=scd2)
+            metrics.inc('etl_rows_loaded_total', len(part), table='InvoiceFact')
+            logger.info(f'Loaded {len(part)} rows into {partition_name(year, month)}')
+         # without any month the queries still find an (empty) InvoiceFact
+         if not list_fact_partitions(conn):
+            conn.execute(ddl.create_empty_invoice_fact_view)
+      finally:
+         conn.close()
+
+   return [(int(year), int(month)) for year, month, _ in groups]
+
+
+def replace_fact_partition(df, year, month, db_path=DB_PATH):
+   '''
+   Atomically replaces a single month of the partitioned InvoiceFact table.
+   Every row of df must belong to that month.
+   '''
+
+   date_id = df['DateID'].astype('int64')
+   if not ((2000 + date_id // 10**8 == year) & (date_id // 10**6 % 100 == month)).all():
+      raise ValueError(f'Rows outside of {year:04d}-{month:02d}')
+
+   with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(db_path))) as staging_dir:
+      staging_path = os.path.join(staging_dir, f'{partition_name(year, month)}.db')
+      _stage_partition(df, staging_path)
+
+      # db_path is the live database, it must not be swapped while it is written
+      with write_lock(db_path):
+         conn = sqlite3.connect(db_path, isolation_level=None)
+         try:
+            # the month replaces an indexed one, its indexes are built before the swap commits
+            _swap_partition(conn, year, month, staging_path, indexed=True)
+            metrics.inc('etl_rows_loaded_total', len(df), table='InvoiceFact')
+         finally:
+            conn.close()
+
+
+def connect_fact_partitions(start=None, end=None, db_path=DB_PATH):
+   '''
+   Opens a connection where InvoiceFact only covers the months between
+   start and end, so queries never scan the other partitions.
+   The pruned InvoiceFact is a temporary view which shadows the full one,
+   the existing queries run unchanged. For SQLAlchemy use
+   create_engine('sqlite://', creator=lambda: connect_fact_partitions(...)).
+
+   Parameters
+   ----------
+   start, end: tuple
+      Optional (year, month) bounds, both inclusive
+   db_path: str
+      The database that holds the partitions
+
+   Returns
+   -------
+   sqlite3.Connection
+   '''
+
+   conn = sqlite3.connect(db_path)
+   partitions = list_fact_partitions(conn, start, end)
+
+   if partitions:
+      conn.execute(f'CREATE TEMP VIEW InvoiceFact AS {_union_partitions(partitions)}')
+   else:
+      conn.execute(ddl.create_invoice_fact_partition.format(name='temp.InvoiceFact'))
+
+   return conn
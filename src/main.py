@@ -1,56 +1,379 @@
-from extract import *
+from extract import read_data_to_pd
 from transform import transform_data
 
-from load import create_tables, load_db
+from load import create_tables, create_indexes, create_shadow, swap_shadow
+from sinks import (TABLE_NAMES, MATCH_TABLE_NAME, FEATURE_TABLE_NAMES, RULE_TABLE_NAME, OUTLIER_TABLE_NAME,
+                   SQLiteSink, ColumnarSink)
+from metrics import metrics
+from config import DATA_PATH, DB_PATH, LOG_PATH, METRICS_DIR
 
+import os
+import time
+import queue
 import logging
-
-logging.basicConfig(filename = '../logs',
-                    level = logging.DEBUG,
-                    format = " %(levelname)s %(asctime)s - %(message)s "
-                    )
+import logging.handlers
 
 logger = logging.getLogger()
 
 
-def main():
+def setup_logging(filename=LOG_PATH):
+    '''
+    Sends the log records through a queue to a background thread which
+    writes them to the log file, so logging never waits on file I/O.
+
+    Returns
+    -------
+    logging.handlers.QueueListener: stop it at the end of the run to flush the queue
+    '''
+
+    file_handler = logging.FileHandler(filename)
+    file_handler.setFormatter(logging.Formatter(" %(levelname)s %(asctime)s - %(message)s "))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+
+    return listener
+
+
+def write_metrics(metrics_dir=METRICS_DIR):
+    # etl.prom is picked up by the node exporter textfile collector
+    metrics.write_prometheus(os.path.join(metrics_dir, 'etl.prom'))
+    metrics.write_json(os.path.join(metrics_dir, 'etl.json'))
+
+
+def extract_stage(data_path=DATA_PATH, profiler=None):
 
-    print("ETL started ...")
-    
-    # extracting data
     logger.info("Extracting data")
-    data = read_data_to_pd()
+    with metrics.timer('etl_stage_duration_seconds', stage='extract'):
+        data = read_data_to_pd(data_path, profiler)
+    metrics.inc('etl_rows_read_total', len(data))
+    metrics.record_memory()
     logger.info("Data extraction copleted")
 
-    # transforming data
+    return data
+
+
+def transform_stage(data, cluster_descriptions=False, cube_dir=None, remove_outliers=False, sketches=None):
+    '''
+    Transforms the source dataframe into the star schema tables. With
+    cube_dir the OLAP cube of the tables is saved there (see cube.Cube).
+    sketches (see sketches.StreamSketches) are updated with the invoice
+    lines of the finished fact table batch by batch (see
+    sketches.sketch_tables). transform_data works on the whole source,
+    there are no batches to sketch before it returns.
+    '''
+
     logger.info("Tranforming data")
-    invoice_fact,  date_dim_df, stock_dim_df, customer_dim_df = transform_data(data)
+    with metrics.timer('etl_stage_duration_seconds', stage='transform'):
+        tables = transform_data(data, cluster_descriptions, remove_outliers)
+    metrics.record_memory()
+
+    if sketches is not None:
+        from sketches import sketch_tables
+
+        logger.info("Sketching the invoice lines")
+        with metrics.timer('etl_stage_duration_seconds', stage='sketches'):
+            sketch_tables(tables[0], tables[3], sketches=sketches)
+
+    if cube_dir is not None:
+        from cube import build_cube
+
+        logger.info(f"Building the cube into {cube_dir}")
+        invoice_fact, date_dim_df, _, customer_dim_df = tables
+        with metrics.timer('etl_stage_duration_seconds', stage='cube'):
+            build_cube(invoice_fact, date_dim_df, customer_dim_df).save(cube_dir)
     logger.info("Data transformation completed")
 
+    return tables
+
+
+def cancellation_stage(invoice_fact):
+    '''
+    Matches the cancellation lines of the fact table to the purchases they
+    reverse, the rows of the CancellationMatch table.
+    '''
+
+    from cancellations import match_cancellations
+
+    logger.info("Matching the cancellations to their purchases")
+    with metrics.timer('etl_stage_duration_seconds', stage='cancellations'):
+        matches = match_cancellations(invoice_fact)
+
+    cancellations = int((invoice_fact['IsCancellation'] == 1).sum())
+    metrics.set_gauge('etl_cancellation_lines', len(matches), status='matched')
+    metrics.set_gauge('etl_cancellation_lines', cancellations - len(matches), status='unmatched')
+    logger.info(f"{len(matches)} of {cancellations} cancellation lines were matched to a purchase")
+
+    return matches
+
+
+def features_stage(invoice_fact):
+    '''
+    The customer features and the products of every customer, the rows of
+    the CustomerFeatures and CustomerProduct tables.
+    '''
+
+    from cleaning import create_customer_features_df, create_customer_product_df
+
+    logger.info("Creating the customer features")
+    with metrics.timer('etl_stage_duration_seconds', stage='features'):
+        features = create_customer_product_df(invoice_fact), create_customer_features_df(invoice_fact)
+    logger.info(f"Features of {len(features[1])} customers were created")
+
+    return features
+
+
+def basket_stage(invoice_fact):
+    '''
+    The association rules of the purchase baskets, the rows of the
+    AssociationRule table.
+    '''
+
+    from basket import association_rules
+
+    logger.info("Mining the association rules of the baskets")
+    with metrics.timer('etl_stage_duration_seconds', stage='basket'):
+        rules = association_rules(invoice_fact)
+    logger.info(f"{len(rules)} association rules were found")
+
+    return rules
+
+
+def outlier_stage(invoice_fact):
+    '''
+    The lines of the fact table with an extreme quantity or price for their
+    stock code and their scores, the rows of the OutlierLine table. The
+    lines stay in InvoiceFact.
+    '''
 
-    # creating tables
-    logger.info("Creating the tables")
-    create_tables()
+    from cleaning import outlier_scores, flag_outliers
 
-    # loading data
-    logger.info("Loading data into InvoiceFact Table")
-    load_db('InvoiceFact', invoice_fact)
+    logger.info("Flagging the outlier quantities and prices")
+    with metrics.timer('etl_stage_duration_seconds', stage='outliers'):
+        is_outlier = flag_outliers(invoice_fact).to_numpy()
+        outliers = invoice_fact[is_outlier].join(outlier_scores(invoice_fact)[is_outlier])
+    logger.info(f"{len(outliers)} outlier lines were flagged")
 
-    logger.info("Loading data into DateDim Table")
-    load_db('DateDim', date_dim_df)
+    return outliers
 
-    logger.info("Loading data into StockDim Table")
-    load_db('StockDim', stock_dim_df)
 
-    logger.info("Loading data into CustomerDim Table")
-    load_db('CustomerDim', customer_dim_df)
+def save_sketches(sketches, db_path=DB_PATH):
+    '''
+    Saves the sketches of the run next to db_path, the database or the
+    output directory of the sink, see sketches.py. Called once the tables
+    are published, a failed load keeps the sketches of the tables which
+    are still there.
+    '''
+
+    from sketches import sketches_path
+
+    sketches.save(sketches_path(db_path))
+    logger.info(f"The sketches were saved to {sketches_path(db_path)}")
+
+
+def load_stage(tables, db_path=DB_PATH, partition_fact=False, sink=None, scd2=(), compact_fact=False,
+               columnar_dir=None, matches=None, features=None, incremental_features=False, rules=None,
+               outliers=None):
+    '''
+    Loads the star schema tables into the sink, by default the SQLite
+    database db_path with the dimensions in scd2 kept as type 2 slowly
+    changing dimensions and with compact_fact the compact InvoiceFact layout.
+    With columnar_dir the tables are also written as memory mapped columns.
+    matches, the result of cancellation_stage, is loaded as CancellationMatch
+    and features, the result of features_stage, as CustomerProduct and
+    CustomerFeatures, merged into the stored ones with incremental_features.
+    rules, the result of basket_stage, is loaded as AssociationRule and
+    outliers, the result of outlier_stage, as OutlierLine.
+    '''
+
+    if sink is None:
+        sink = SQLiteSink(db_path, partition_fact, scd2, compact=compact_fact,
+                          incremental_features=incremental_features)
+
+    sinks = [sink] if columnar_dir is None else [sink, ColumnarSink(columnar_dir)]
+
+    with metrics.timer('etl_stage_duration_seconds', stage='load'):
+        # creating tables
+        logger.info("Creating the tables")
+        for target in sinks:
+            target.create_tables()
+
+        # loading data
+        for table_name, df in zip(TABLE_NAMES, tables):
+            logger.info(f"Loading data into {table_name} Table")
+            for target in sinks:
+                target.load(table_name, df)
+
+        if matches is not None:
+            logger.info(f"Loading data into {MATCH_TABLE_NAME} Table")
+            for target in sinks:
+                target.load(MATCH_TABLE_NAME, matches)
+
+        if features is not None:
+            for table_name, df in zip(FEATURE_TABLE_NAMES, features):
+                logger.info(f"Loading data into {table_name} Table")
+                for target in sinks:
+                    target.load(table_name, df)
+
+        if rules is not None:
+            logger.info(f"Loading data into {RULE_TABLE_NAME} Table")
+            for target in sinks:
+                target.load(RULE_TABLE_NAME, rules)
+
+        if outliers is not None:
+            logger.info(f"Loading data into {OUTLIER_TABLE_NAME} Table")
+            for target in sinks:
+                target.load(OUTLIER_TABLE_NAME, outliers)
+
+    # the indexes are built once the tables are full, timed as a stage of their own
+    logger.info("Creating the indexes")
+    with metrics.timer('etl_stage_duration_seconds', stage='index'):
+        for target in sinks:
+            target.create_indexes()
+
+    for target in sinks:
+        target.publish()
 
     logger.info("Loading of data completed")
 
 
-    print("ETL finished")
+def print_memory_report(report):
+    logger.info(f"Memory report: {report}")
+    print(f"Memory budget {report['max_bytes']} bytes, "
+          f"{'out of core' if report['out_of_core'] else 'in memory'}, "
+          f"chunks of {report['chunk_rows']} rows, load batches of {report['load_batch_rows']} rows, "
+          f"peak RSS {report['peak_rss']} bytes, {report['shrinks']} shrinks")
+
+
+def main(data_path=DATA_PATH, db_path=DB_PATH, metrics_dir=METRICS_DIR,
+         partition_fact=False, data=None, out_of_core=False, chunksize=100_000, sink=None,
+         scd2=(), max_memory=None, cluster_descriptions=False, cube_dir=None, compact_fact=False,
+         columnar_dir=None, match_cancellations=False, customer_features=False, incremental_features=False,
+         basket_rules=False, sketches=False, outliers=None, profile=False):
+    '''
+    Runs the whole ETL. When data is given the extract stage is skipped
+    and the dataframe is transformed and loaded as it is.
+    With out_of_core the source is cleaned in SQLite staging tables
+    chunksize rows at a time instead of in one dataframe.
+    sink replaces the SQLite database as the destination of the tables.
+    The dimensions in scd2 keep their history (see scd.apply_scd2).
+    With max_memory (bytes) the path, the chunk size and the load batch
+    size are chosen by a governor.MemoryGovernor to fit in the budget.
+    cluster_descriptions maps the near duplicate descriptions of StockDim
+    to one canonical description (see descriptions.canonical_descriptions).
+    With cube_dir the OLAP cube of the tables is saved (see cube.Cube).
+    compact_fact stores InvoiceFact in the compact layout (see compact.py).
+    With columnar_dir the tables are also written as memory mapped columns
+    (see columnar.read_table).
+    match_cancellations matches the cancellations to the purchases they
+    reverse, see cancellations.match_cancellations and the InvoiceFactNet view.
+    customer_features creates the CustomerFeatures table, with
+    incremental_features the source holds only new invoices, they are
+    appended to the stored tables and their features are merged into the
+    stored ones (see sinks.SQLiteSink).
+    basket_rules mines the association rules of the baskets, see basket.py.
+    sketches saves the approximate distinct counts and top products next
+    to the database, or the output of sink, see sketches.py.
+    outliers is 'flag' to copy the lines with an extreme quantity or price
+    for their stock code into OutlierLine or 'drop' to drop them, see
+    cleaning.flag_outliers.
+    profile writes the column profile of the source, computed while it is
+    read, to profile.json in metrics_dir (see profiling.ColumnProfiler).
+    '''
+
+    customer_features = customer_features or incremental_features
 
+    print("ETL started ...")
+
+    governor = None
+    if max_memory is not None:
+        from governor import MemoryGovernor
+
+        governor = MemoryGovernor(max_memory)
+        if governor.plan(data_path) and data is None:
+            if sink is None and not (partition_fact or scd2 or cluster_descriptions or cube_dir or compact_fact
+                                     or columnar_dir or match_cancellations or customer_features
+                                     or basket_rules or outliers):
+                out_of_core = True
+            else:
+                logger.warning("The source does not fit in the memory budget, but the out of core "
+                               "path supports only the plain SQLite sink without transform options")
+        chunksize = governor.next_chunk_rows
+        if sink is None and not out_of_core:
+            sink = SQLiteSink(db_path, partition_fact, scd2, batch_rows=governor.next_load_batch_rows,
+                              compact=compact_fact, incremental_features=incremental_features)
+
+    profiler = None
+    if profile:
+        from profiling import ColumnProfiler
+
+        profiler = ColumnProfiler(data_path if data is None else None)
+
+    # updated while the lines stream through the transform, saved after the load
+    stream_sketches = None
+    if sketches:
+        from sketches import StreamSketches
+
+        stream_sketches = StreamSketches()
+
+    metrics.set_gauge('etl_last_run_success', 0)
+    try:
+        if out_of_core:
+            from out_of_core import transform_out_of_core
+
+            logger.info("Transforming data out of core")
+            shadow = create_shadow(db_path)
+            create_tables(shadow)
+            transform_out_of_core(data_path, shadow, chunksize, staging_path=f'{db_path}.staging',
+                                  profiler=profiler, sketches=stream_sketches)
+            with metrics.timer('etl_stage_duration_seconds', stage='index'):
+                create_indexes(shadow)
+            swap_shadow(db_path)
+
+        else:
+            if data is None:
+                data = extract_stage(data_path, profiler)
+            elif profiler is not None:
+                profiler.update(data)
+
+            tables = transform_stage(data, cluster_descriptions, cube_dir, remove_outliers=outliers == 'drop',
+                                     sketches=stream_sketches)
+            matches = cancellation_stage(tables[0]) if match_cancellations else None
+            features = features_stage(tables[0]) if customer_features else None
+            rules = basket_stage(tables[0]) if basket_rules else None
+            flagged = outlier_stage(tables[0]) if outliers == 'flag' else None
+
+            load_stage(tables, db_path, partition_fact, sink, scd2, compact_fact, columnar_dir, matches,
+                       features, incremental_features, rules, flagged)
+
+        if stream_sketches is not None:
+            save_sketches(stream_sketches, sink.path if sink is not None and sink.path else db_path)
+
+        metrics.set_gauge('etl_last_run_success', 1)
+    finally:
+        metrics.record_memory()
+        if governor is not None:
+            print_memory_report(governor.report())
+        metrics.set_gauge('etl_last_run_timestamp_seconds', time.time())
+        write_metrics(metrics_dir)
+        # also after a failed run, the profile may show why it failed
+        if profiler is not None and profiler.rows:
+            profiler.write(os.path.join(metrics_dir, 'profile.json'))
+            logger.info(f"The profile of {profiler.rows} rows was written to {metrics_dir}")
+
+
+    print("ETL finished")
 
 
-main()
 
+if __name__ == '__main__':
+    log_listener = setup_logging()
+    try:
+        main()
+    finally:
+        log_listener.stop()
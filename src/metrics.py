@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import time
+import threading
+import logging
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = logging.getLogger()
+
+# seconds, from a fast cleaning rule up to a full load
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Metrics:
+    '''
+    In-process counters, gauges and histograms of an ETL run.
+    Updating a metric is a dict update under a lock, nothing is written
+    until write_prometheus / write_json are called at the end of the run.
+    '''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def record_memory(self):
+        ''' Updates the memory gauges of the current process '''
+
+        rss = current_rss()
+        if rss is not None:
+            self.set_gauge('etl_memory_rss_bytes', rss)
+        peak = peak_rss()
+        if peak is not None:
+            self.set_gauge('etl_memory_peak_rss_bytes', peak)
+
+    def snapshot(self):
+        ''' A JSON serializable copy of all the metrics '''
+
+        def labelled(key):
+            return {'name': key[0], 'labels': dict(key[1])}
+
+        with self._lock:
+            return {
+                'timestamp': time.time(),
+                'counters': [dict(labelled(k), value=v) for k, v in sorted(self._counters.items())],
+                'gauges': [dict(labelled(k), value=v) for k, v in sorted(self._gauges.items())],
+                'histograms': [dict(labelled(k), buckets=dict(zip(map(str, self.buckets), h['buckets'])),
+                                    sum=h['sum'], count=h['count'])
+                               for k, h in sorted(self._histograms.items())],
+            }
+
+    def to_prometheus(self):
+        ''' The metrics in the Prometheus text exposition format '''
+
+        lines = []
+        typed = set()
+
+        def header(name, metric_type):
+            if name in typed:
+                return
+            typed.add(name)
+            if name in self._help:
+                lines.append(f'# HELP {name} {self._help[name]}')
+            lines.append(f'# TYPE {name} {metric_type}')
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                header(name, 'counter')
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+
+            for (name, labels), value in sorted(self._gauges.items()):
+                header(name, 'gauge')
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                header(name, 'histogram')
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", str(bound)),))} {count}')
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {histogram["count"]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {histogram["sum"]}')
+                lines.append(f'{name}_count{_format_labels(labels)} {histogram["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        ''' Writes a node exporter textfile, replaced atomically '''
+
+        _atomic_write(path, self.to_prometheus())
+
+    def write_json(self, path):
+        _atomic_write(path, json.dumps(self.snapshot(), indent=2))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+def _atomic_write(path, text):
+    # the textfile collector may read at any time, it must never see half a file
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def current_rss():
+    ''' Resident set size of the process in bytes, None if unknown '''
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return peak_rss()
+
+
+def peak_rss():
+    ''' Peak resident set size of the process in bytes, None if unknown '''
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# metrics of the current run, shared by the extract, transform and load stages
+metrics = Metrics()
+
+metrics.describe('etl_rows_read_total', 'Rows read from the source file')
+metrics.describe('etl_rows_dropped_total', 'Rows dropped by each cleaning rule')
+metrics.describe('etl_rows_loaded_total', 'Rows loaded into each table')
+metrics.describe('etl_stage_duration_seconds', 'Duration of each stage of the ETL')
+metrics.describe('etl_batch_duration_seconds', 'Duration of a single load batch')
+metrics.describe('etl_memory_rss_bytes', 'Resident set size of the ETL process')
+metrics.describe('etl_memory_peak_rss_bytes', 'Peak resident set size of the ETL process')
+metrics.describe('etl_memory_budget_bytes', 'Memory budget of the run (--max-memory)')
+metrics.describe('etl_chunk_rows', 'Rows per chunk chosen by the memory governor')
+metrics.describe('etl_load_batch_rows', 'Rows per load batch chosen by the memory governor')
+metrics.describe('etl_cancellation_lines', 'Cancellation lines matched and not matched to a purchase')
+metrics.describe('etl_ingested_files_total', 'Source files of the watcher, loaded or failed')
+metrics.describe('etl_ingest_pending_files', 'Source files being transformed by the watcher')
+metrics.describe('etl_ingest_latency_seconds', 'Seconds from taking a source file to its load')
+metrics.describe('etl_last_run_success', '1 if the last run finished, 0 if it failed')
+metrics.describe('etl_last_run_timestamp_seconds', 'Unix time of the end of the last run')
@@ -0,0 +1,168 @@
+import os
+import re
+import sqlite3
+import logging
+import pandas as pd
+from extract import read_data_chunks
+from metrics import metrics
+from config import DATA_PATH, DB_PATH
+from sql import staging
+
+logger = logging.getLogger()
+
+# the cleaning rules in the same order as transform_data
+CLEANING_RULES = ['drop_invalid_invoice',
+                  'drop_positive_cancelations',
+                  'drop_negative_no_cancelations',
+                  'drop_dups',
+                  'drop_zero_quants',
+                  'drop_neg_price',
+                  'drop_null_prices',
+                  'replace_null_customer_id',
+                  'drop_invalid_customers_ids',
+                  'drop_invalid_stock_cd',
+                  'drop_null_descr']
+
+
+def normalize_description(description):
+    '''
+    to_lowercase, remove_punctuations and remove_unessecary_spaces for a
+    single description. pandas runs the regex replacements with the re
+    module, so does this.
+    '''
+
+    if description is None:
+        return None
+
+    description = re.sub(r'[^\w\s]', '', description.lower())
+    return re.sub(r'\s+', ' ', description).strip()
+
+
+def stage_source(conn, filepath=DATA_PATH, chunksize=100_000, profiler=None):
+    '''
+    Bulk loads the source file into the Staging table one chunk at a time,
+    profiling the chunks with profiler (see profiling.ColumnProfiler).
+
+    Returns
+    -------
+    int: the number of rows read
+    '''
+
+    conn.execute(staging.drop_staging)
+    conn.execute(staging.create_staging)
+
+    rows = 0
+    for chunk in read_data_chunks(filepath, chunksize, profiler):
+        with metrics.timer('etl_batch_duration_seconds', table='Staging'):
+            chunk.to_sql(name='Staging', con=conn, if_exists='append', index=False)
+        conn.commit()
+        rows += len(chunk)
+
+    metrics.inc('etl_rows_read_total', rows)
+    logger.info(f"Staged {rows} rows")
+
+    return rows
+
+
+def clean_staging(conn):
+    ''' Applies the cleaning rules to the Staging table '''
+
+    for rule in CLEANING_RULES:
+        logger.info(f"Staging: {rule}")
+
+        if rule == 'replace_null_customer_id':
+            conn.execute(staging.drop_guest_ids)
+            conn.execute(staging.create_guest_ids)
+            conn.execute(staging.index_guest_ids)
+            conn.execute(staging.replace_null_customer_id)
+            conn.execute(staging.drop_guest_ids)
+        else:
+            dropped = conn.execute(getattr(staging, rule)).rowcount
+            metrics.inc('etl_rows_dropped_total', dropped, rule=rule)
+
+        conn.commit()
+
+
+def insert_star_schema(conn, db_path=DB_PATH):
+    '''
+    Builds the star schema tables of db_path from the cleaned Staging table
+    with INSERT ... SELECT. The tables must already exist (create_tables).
+    '''
+
+    conn.create_function('normalize_description', 1, normalize_description, deterministic=True)
+    conn.execute('ATTACH DATABASE ? AS dw', (db_path,))
+    try:
+        for table, statement in [('DateDim', staging.insert_date_dim),
+                                 ('StockDim', staging.insert_stock_dim),
+                                 ('CustomerDim', staging.insert_customer_dim),
+                                 ('InvoiceFact', staging.insert_invoice_fact)]:
+            logger.info(f"Staging: inserting into {table}")
+            with metrics.timer('etl_batch_duration_seconds', table=table):
+                rows = conn.execute(statement).rowcount
+            conn.commit()
+            metrics.inc('etl_rows_loaded_total', rows, table=table)
+    finally:
+        conn.execute('DETACH DATABASE dw')
+
+
+def sketch_staging(conn, sketches, batch_rows=100_000):
+    '''
+    Updates the sketches (see sketches.StreamSketches) with the cleaned
+    lines of the Staging table, batch_rows lines at a time, so the loaded
+    database is not read again.
+    '''
+
+    for batch in pd.read_sql(staging.select_sketch_lines, conn, chunksize=batch_rows):
+        sketches.update(batch)
+
+
+def transform_out_of_core(filepath=DATA_PATH, db_path=DB_PATH, chunksize=100_000, staging_path=None,
+                          profiler=None, sketches=None):
+    '''
+    Runs the cleaning rules and builds the star schema inside SQLite, so
+    memory does not grow with the size of the source file. Only one chunk
+    of the source is in pandas at a time.
+
+    Parameters
+    ----------
+    filepath: str
+        The source file
+    db_path: str
+        The target database, its tables must exist
+    chunksize: int or callable
+        Rows per chunk when staging the source file, see read_data_chunks
+    staging_path: str
+        The scratch database, by default next to db_path. It is removed at the end.
+    profiler: profiling.ColumnProfiler
+        Profiles the source while it is staged, optional
+    sketches: sketches.StreamSketches
+        Updated with the cleaned lines before they leave the staging
+        database, optional. The caller saves them once db_path is published.
+    '''
+
+    if staging_path is None:
+        staging_path = f'{db_path}.staging'
+
+    conn = sqlite3.connect(staging_path)
+    try:
+        # scratch data, nothing to recover after a crash
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('PRAGMA temp_store = FILE')
+
+        with metrics.timer('etl_stage_duration_seconds', stage='extract'):
+            stage_source(conn, filepath, chunksize, profiler)
+
+        with metrics.timer('etl_stage_duration_seconds', stage='transform'):
+            clean_staging(conn)
+
+        if sketches is not None:
+            with metrics.timer('etl_stage_duration_seconds', stage='sketches'):
+                sketch_staging(conn, sketches, chunksize() if callable(chunksize) else chunksize)
+
+        with metrics.timer('etl_stage_duration_seconds', stage='load'):
+            insert_star_schema(conn, db_path)
+    finally:
+        conn.close()
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
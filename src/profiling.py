@@ -0,0 +1,192 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from sketches import HyperLogLog, CountMinTopK
+
+# the values the cleaning rules keep, a value of a string column which does
+# not match its pattern is counted as invalid
+PATTERNS = {'Invoice': r'C?\d+',
+            'StockCode': r'.{5,8}',
+            'CustomerID': r'(\d+(\.\d+)?|G\d+)'}
+
+
+class ColumnProfile:
+    '''
+    The profile of one column, updated chunk by chunk: nulls, distinct
+    values and the most common ones, the range, mean and standard deviation
+    of numbers and dates and the length distribution and the invalid values
+    of strings.
+
+    The distinct values are counted exactly until there are more than
+    max_exact of them, then by a HyperLogLog sketch (about 1% error) and
+    the most common values by a Count-Min sketch, see sketches.py.
+    '''
+
+    def __init__(self, name:str, max_exact:int = 10_000, top:int = 10):
+        self.name = name
+        self.max_exact = max_exact
+        self.top = top
+        self.dtype = None
+        self.rows = 0
+        self.nulls = 0
+        self.counts = pd.Series(dtype=np.int64)
+        self.distinct = None
+        self.frequent = None
+        self.minimum = None
+        self.maximum = None
+        # count, mean and sum of squared deviations of the numbers (Chan et al.)
+        self.moments = (0, 0.0, 0.0)
+        self.zeros = 0
+        self.negatives = 0
+        self.lengths = {}
+        self.invalid = 0
+
+    def update(self, column:pd.Series) -> None:
+        self.dtype = self.dtype or str(column.dtype)
+        self.rows += len(column)
+        values = column.dropna()
+        self.nulls += len(column) - len(values)
+        if not len(values):
+            return
+
+        is_datetime = pd.api.types.is_datetime64_any_dtype(values)
+        is_numeric = pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+        if is_datetime:
+            values = values.astype('int64')
+
+        # the string measures are computed once per distinct value of the chunk
+        counts = values.value_counts(sort=False)
+        self._count(counts)
+
+        if is_datetime or is_numeric:
+            self.minimum = values.min() if self.minimum is None else min(self.minimum, values.min())
+            self.maximum = values.max() if self.maximum is None else max(self.maximum, values.max())
+        if is_numeric:
+            self._add_moments(values.to_numpy(dtype=np.float64))
+            self.zeros += int((values == 0).sum())
+            self.negatives += int((values < 0).sum())
+        elif not is_datetime:
+            strings = counts.index.astype(str).to_series(index=counts.index)
+            for length, count in counts.groupby(strings.str.len().to_numpy()).sum().items():
+                self.lengths[int(length)] = self.lengths.get(int(length), 0) + int(count)
+            if self.name in PATTERNS:
+                self.invalid += int(counts[~strings.str.fullmatch(PATTERNS[self.name]).to_numpy()].sum())
+
+    def _count(self, counts:pd.Series) -> None:
+        ''' Adds the value counts of a chunk '''
+
+        if self.counts is not None:
+            self.counts = self.counts.add(counts, fill_value=0).astype(np.int64)
+            if len(self.counts) <= self.max_exact:
+                return
+            # too many distinct values, the counts so far go into the sketches
+            counts = self.counts
+            self.counts = None
+            self.distinct = HyperLogLog()
+            self.frequent = CountMinTopK(self.top, width=2**12, depth=4)
+
+        values = counts.index.to_numpy()
+        self.distinct.update(np.zeros(len(values), dtype=np.int8), values)
+        self.frequent.update(values, counts.to_numpy())
+
+    def _add_moments(self, values:np.ndarray) -> None:
+        count, mean, m2 = self.moments
+        n, chunk_mean = len(values), values.mean()
+        chunk_m2 = ((values - chunk_mean)**2).sum()
+        delta = chunk_mean - mean
+        total = count + n
+        self.moments = (total, mean + delta * n / total, m2 + chunk_m2 + delta**2 * count * n / total)
+
+    def _value(self, value):
+        ''' A JSON value, the dates as ISO text '''
+
+        if self.dtype.startswith('datetime64'):
+            return pd.Timestamp(int(value)).isoformat()
+        return value.item() if isinstance(value, np.generic) else value
+
+    def to_dict(self) -> dict:
+        profile = {'dtype': self.dtype,
+                   'rows': self.rows,
+                   'nulls': self.nulls,
+                   'null_rate': self.nulls / self.rows if self.rows else 0.0}
+
+        if self.counts is not None:
+            top = self.counts.sort_values(ascending=False, kind='stable').head(self.top)
+            profile.update({'distinct': len(self.counts), 'distinct_exact': True,
+                            'top': [[self._value(value), int(count)] for value, count in top.items()]})
+        else:
+            profile.update({'distinct': int(self.distinct.estimate().iloc[0]), 'distinct_exact': False,
+                            'top': [[self._value(value), int(count)]
+                                    for value, count in self.frequent.most_common()]})
+
+        if self.minimum is not None:
+            profile.update({'min': self._value(self.minimum), 'max': self._value(self.maximum)})
+        if self.moments[0]:
+            count, mean, m2 = self.moments
+            profile.update({'mean': mean, 'std': (m2 / (count - 1))**0.5 if count > 1 else 0.0,
+                            'zeros': self.zeros, 'negatives': self.negatives})
+        if self.lengths:
+            lengths = dict(sorted(self.lengths.items()))
+            total = sum(lengths.values())
+            profile['length'] = {'min': min(lengths), 'max': max(lengths),
+                                 'mean': sum(length * count for length, count in lengths.items()) / total,
+                                 'histogram': {str(length): count for length, count in lengths.items()}}
+        if self.name in PATTERNS:
+            profile['invalid'] = self.invalid
+
+        return profile
+
+
+class ColumnProfiler:
+    '''
+    Profiles a source while it is read, one chunk at a time, so the profile
+    costs no extra pass over the data (see extract.read_data_to_pd and
+    extract.read_data_chunks):
+
+        profiler = ColumnProfiler(path)
+        for chunk in read_data_chunks(path, profiler=profiler):
+            ...
+        profiler.write('./metrics/profile.json')
+
+    A column missing from a chunk or a new one is reported under 'schema'.
+    '''
+
+    def __init__(self, source:str = None, max_exact:int = 10_000, top:int = 10):
+        self.source = source
+        self.max_exact = max_exact
+        self.top = top
+        self.rows = 0
+        self.chunks = 0
+        self.columns = {}
+        self.schema_changes = []
+
+    def update(self, df:pd.DataFrame) -> None:
+        if not isinstance(df, pd.DataFrame):
+            raise TypeError
+
+        if self.chunks and list(df.columns) != list(self.columns):
+            self.schema_changes.append({'chunk': self.chunks, 'columns': list(df.columns)})
+
+        for name in df.columns:
+            if name not in self.columns:
+                self.columns[name] = ColumnProfile(name, self.max_exact, self.top)
+            self.columns[name].update(df[name])
+
+        self.rows += len(df)
+        self.chunks += 1
+
+    def to_dict(self) -> dict:
+        return {'source': self.source,
+                'rows': self.rows,
+                'chunks': self.chunks,
+                'schema': {'columns': list(self.columns), 'changes': self.schema_changes},
+                'columns': {name: column.to_dict() for name, column in self.columns.items()}}
+
+    def write(self, path:str) -> None:
+        ''' Writes the profile as JSON, replacing an older file '''
+
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        os.replace(tmp_path, path)
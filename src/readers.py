@@ -0,0 +1,65 @@
+import os
+import queue
+import sqlite3
+import contextlib
+from config import DB_PATH
+
+
+class ReadPool:
+    '''
+    A small pool of read-only connections to the database. The loader
+    publishes a run by renaming a new database over db_path (see
+    load.swap_shadow), a connection which was opened on the old file is
+    reopened when it is taken from the pool, so readers move to the new
+    data between queries and are never blocked by the loader.
+
+        pool = ReadPool()
+        with pool.connection() as conn:
+            pd.read_sql_query(sql_query, conn)
+
+    Parameters
+    ----------
+    db_path: str
+        The database
+    size: int
+        Connections in the pool, queries beyond this wait for a free one
+    timeout: float
+        Seconds to wait for a free connection, None waits forever
+    '''
+
+    def __init__(self, db_path=DB_PATH, size=4, timeout=None):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            self._pool.put((None, None))
+
+    def _open(self):
+        conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, check_same_thread=False)
+        conn.execute('PRAGMA query_only = ON')
+        return conn, os.stat(self.db_path).st_ino
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn, inode = self._pool.get(timeout=self.timeout)
+        try:
+            if conn is None or inode != os.stat(self.db_path).st_ino:
+                if conn is not None:
+                    conn.close()
+                # a failed open puts an empty slot back
+                conn, inode = None, None
+                conn, inode = self._open()
+            yield conn
+        finally:
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+            self._pool.put((conn, inode))
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._pool.get_nowait()
+            except queue.Empty:
+                return
+            if conn is not None:
+                conn.close()
@@ -0,0 +1,129 @@
+import sqlite3
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sql import ddl
+from metrics import metrics
+from config import DB_PATH
+
+logger = logging.getLogger()
+
+# table: (create statement, key, attributes)
+SCD2_TABLES = {
+    'StockDim': (ddl.create_stock_dim_scd2, 'StockCode', ['Description']),
+    'CustomerDim': (ddl.create_customer_dim_scd2, 'CustomerID', ['Country']),
+}
+
+
+def row_hashes(df:pd.DataFrame, columns:list) -> np.ndarray:
+    '''
+    Hashes the given columns of every row in one vectorized pass.
+    The hashes are stable between runs and are returned as int64,
+    the integer type of SQLite.
+    '''
+
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy().view(np.int64)
+
+
+def _create_scd2_table(conn, table_name):
+    create_table, key, _ = SCD2_TABLES[table_name]
+
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table_name})')]
+    if columns and 'RowHash' not in columns:
+        # a plain dimension is rewritten on every run, it has no history to keep
+        logger.info(f"Replacing the plain {table_name} with a type 2 dimension")
+        conn.execute(f'DROP TABLE {table_name}')
+
+    conn.execute(create_table)
+    conn.execute(ddl.create_scd2_current_index.format(table=table_name, key=key))
+    conn.execute(ddl.create_scd2_current_view.format(table=table_name,
+                                                     columns=', '.join([key] + SCD2_TABLES[table_name][2])))
+
+
+def apply_scd2(table_name:str, dim_df:pd.DataFrame, db_path=DB_PATH, valid_from=None) -> dict:
+    '''
+    Maintains a type 2 slowly changing dimension. The incoming members are
+    compared with the current stored versions by the hash of their
+    attributes in one join. New members get a version, changed members get
+    a new version and their current one is expired, unchanged members are
+    not written at all.
+
+    Queries that join the dimension should use the Current<table> view
+    (e.g. CurrentStockDim), its rows with IsCurrent = 1, or compare the date
+    of the fact with ValidFrom/ValidTo.
+
+    Parameters
+    ----------
+    table_name: str
+        StockDim or CustomerDim
+    dim_df: pd.DataFrame
+        The dimension of this run, one row per key
+    db_path: str
+        The database of the dimension
+    valid_from: str
+        Start of the new versions, by default now
+
+    Returns
+    -------
+    dict: the number of new, changed and unchanged members
+    '''
+
+    if table_name not in SCD2_TABLES:
+        raise KeyError
+
+    _, key, attributes = SCD2_TABLES[table_name]
+
+    if any(column not in dim_df.columns for column in [key] + attributes):
+        raise KeyError
+
+    if valid_from is None:
+        valid_from = datetime.now().isoformat(sep=' ', timespec='seconds')
+
+    incoming = dim_df[[key] + attributes].copy()
+    incoming['RowHash'] = row_hashes(incoming, attributes)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute('BEGIN')
+        try:
+            _create_scd2_table(conn, table_name)
+
+            stored = pd.read_sql(f'SELECT {key}, RowHash AS StoredHash FROM {table_name} WHERE IsCurrent = 1', conn)
+            merged = incoming.merge(stored, on=key, how='left')
+
+            is_new = merged['StoredHash'].isna().to_numpy()
+            is_changed = ~is_new & (merged['RowHash'].to_numpy() != merged['StoredHash'].to_numpy())
+
+            # expire the current versions of the changed members
+            changed_keys = merged.loc[is_changed, [key]]
+            if len(changed_keys):
+                conn.execute(f'CREATE TEMP TABLE ChangedKeys ({key} text primary key)')
+                conn.executemany('INSERT INTO temp.ChangedKeys VALUES (?)', changed_keys.itertuples(index=False))
+                conn.execute(f'UPDATE {table_name} SET ValidTo = ?, IsCurrent = 0 '
+                             f'WHERE IsCurrent = 1 AND {key} IN (SELECT {key} FROM temp.ChangedKeys)',
+                             (valid_from,))
+                conn.execute('DROP TABLE temp.ChangedKeys')
+
+            versions = merged.loc[is_new | is_changed, [key] + attributes + ['RowHash']]
+            columns = [key] + attributes + ['RowHash', 'ValidFrom', 'ValidTo', 'IsCurrent']
+            conn.executemany(f'INSERT INTO {table_name} ({", ".join(columns)}) '
+                             f'VALUES ({", ".join("?" * len(columns))})',
+                             ((*row[:-1], int(row[-1]), valid_from, None, 1)
+                              for row in versions.astype(object).where(versions.notna(), None)
+                                                 .itertuples(index=False)))
+
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+
+    counts = {'new': int(is_new.sum()), 'changed': int(is_changed.sum()),
+              'unchanged': int(len(merged) - is_new.sum() - is_changed.sum())}
+    metrics.inc('etl_rows_loaded_total', counts['new'] + counts['changed'], table=table_name)
+    logger.info(f"{table_name}: {counts['new']} new, {counts['changed']} changed, "
+                f"{counts['unchanged']} unchanged members")
+
+    return counts
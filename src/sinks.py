@@ -0,0 +1,278 @@
+import os
+import abc
+import gzip
+import shutil
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from load import (create_tables, create_indexes, load_db, load_fact_partitions, create_shadow, swap_shadow,
+                  create_cancellation_match)
+from scd import apply_scd2
+from ingest import append_table, last_guest, offset_guests
+from features import update_customer_features
+from compact import compact_invoice_fct_df
+from columnar import stage_table, publish_table
+from metrics import metrics
+from config import DB_PATH
+
+logger = logging.getLogger()
+
+TABLE_NAMES = ['InvoiceFact', 'DateDim', 'StockDim', 'CustomerDim']
+# the optional tables of main.cancellation_stage, main.features_stage, main.basket_stage and main.outlier_stage
+MATCH_TABLE_NAME = 'CancellationMatch'
+FEATURE_TABLE_NAMES = ['CustomerProduct', 'CustomerFeatures']
+RULE_TABLE_NAME = 'AssociationRule'
+OUTLIER_TABLE_NAME = 'OutlierLine'
+
+
+class Sink(abc.ABC):
+    '''
+    Where the star schema tables are written.
+    create_tables is called once before the tables are loaded with load.
+    A subclass without them can not be instantiated.
+    '''
+
+    @abc.abstractmethod
+    def create_tables(self):
+        ''' Called once before the tables are loaded '''
+
+    @abc.abstractmethod
+    def load(self, table_name, df):
+        ''' Writes the rows of one table '''
+
+    def create_indexes(self):
+        ''' Called once after every table is loaded '''
+
+    def publish(self):
+        ''' Called at the end of a successful load, makes the new tables visible '''
+
+    @property
+    def path(self):
+        ''' The database or directory of the tables, the sketches of a run are saved next to it '''
+
+        return None
+
+
+class SQLiteSink(Sink):
+    '''
+    The SQLite database, optionally with a monthly partitioned InvoiceFact.
+    The dimensions in scd2 (StockDim, CustomerDim) are kept as type 2
+    slowly changing dimensions instead of being rewritten.
+    batch_rows is passed on to load_db.
+
+    With shadow the tables are built in a shadow database which replaces
+    db_path in publish, readers of db_path never see a partial load.
+    With compact the fact rows are stored in the compact layout (see
+    compact.compact_invoice_fct_df) behind the InvoiceFact view.
+    With incremental_features the source holds only new invoices: they are
+    appended to the stored InvoiceFact and dimensions (see
+    ingest.APPEND_STATEMENTS) and their customer features are merged into
+    the stored ones (see features.update_customer_features). The guests of
+    the run are numbered after the stored ones (see ingest.offset_guests),
+    as every run numbers its guests from G0001. The other tables, e.g.
+    CancellationMatch, describe the invoices of the run. An appended fact
+    table can be neither partitioned nor compact.
+    '''
+
+    def __init__(self, db_path=DB_PATH, partition_fact=False, scd2=(), batch_rows=None, shadow=True,
+                 compact=False, incremental_features=False):
+        self.db_path = db_path
+        self.partition_fact = partition_fact
+        self.scd2 = tuple(scd2)
+        self.batch_rows = batch_rows
+        self.shadow = shadow
+        self.compact = compact
+        self.incremental_features = incremental_features
+        self.target_path = db_path
+        self._products = None
+        self._last_guest = 0
+
+        if incremental_features and (partition_fact or compact):
+            raise ValueError("The incremental features append to a plain InvoiceFact, "
+                             "not to a partitioned or compact one")
+
+    @property
+    def path(self):
+        return self.db_path
+
+    @property
+    def keep_tables(self):
+        return self.scd2 + (('CustomerFeatures',) if self.incremental_features else ())
+
+    def create_tables(self):
+        if self.shadow:
+            self.target_path = create_shadow(self.db_path, keep_tables=self.keep_tables)
+        create_tables(self.target_path, partitioned=self.partition_fact, keep_tables=self.keep_tables,
+                      compact=self.compact, append=self.incremental_features)
+
+        if self.incremental_features:
+            conn = sqlite3.connect(self.target_path)
+            try:
+                self._last_guest = last_guest(conn)
+            finally:
+                conn.close()
+
+    def _append(self, table_name, df):
+        conn = sqlite3.connect(self.target_path, isolation_level=None)
+        try:
+            conn.execute('BEGIN')
+            try:
+                append_table(conn, table_name, df)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def load(self, table_name, df):
+        if self.incremental_features:
+            df = offset_guests(df, self._last_guest)
+
+        if table_name == 'InvoiceFact' and self.compact:
+            load_db('InvoiceFactCompact', compact_invoice_fct_df(df), self.target_path, self.batch_rows)
+        elif table_name == 'InvoiceFact' and self.partition_fact:
+            load_fact_partitions(df, self.target_path, scd2=self.scd2)
+        elif table_name in self.scd2:
+            apply_scd2(table_name, df, self.target_path)
+        elif table_name in TABLE_NAMES and self.incremental_features:
+            self._append(table_name, df)
+        elif table_name == MATCH_TABLE_NAME:
+            create_cancellation_match(self.target_path)
+            load_db(table_name, df, self.target_path, self.batch_rows)
+        elif table_name == 'CustomerProduct' and self.incremental_features:
+            # merged together with the features, CustomerProduct is loaded first
+            self._products = df
+        elif table_name == 'CustomerFeatures' and self.incremental_features:
+            update_customer_features(df, self._products, self.target_path)
+            self._products = None
+        else:
+            load_db(table_name, df, self.target_path, self.batch_rows)
+
+    def create_indexes(self):
+        create_indexes(self.target_path)
+
+    def publish(self):
+        if self.shadow:
+            swap_shadow(self.db_path)
+            self.target_path = self.db_path
+
+
+class PartitionedCSVSink(Sink):
+    '''
+    Gzip compressed CSV files, one directory per table:
+
+        output_dir/InvoiceFact/Year=2009/Month=12/part-00000.csv.gz
+        output_dir/DateDim/part-00000.csv.gz
+
+    InvoiceFact is partitioned by the month of DateID. The partitions are
+    written in parallel and every file is written chunk_rows rows at a time,
+    so a table is never serialized into memory as a whole.
+
+    Parameters
+    ----------
+    output_dir: str
+        The root directory of the tables
+    chunk_rows: int
+        Rows serialized at a time
+    rows_per_file: int
+        A partition is split in files of at most this many rows
+    max_workers: int
+        Partitions written at the same time
+    '''
+
+    def __init__(self, output_dir, chunk_rows=50_000, rows_per_file=1_000_000, max_workers=None):
+        self.output_dir = output_dir
+        self.chunk_rows = chunk_rows
+        self.rows_per_file = rows_per_file
+        self.max_workers = max_workers
+
+    @property
+    def path(self):
+        return self.output_dir
+
+    def create_tables(self):
+        for table_name in TABLE_NAMES + [MATCH_TABLE_NAME] + FEATURE_TABLE_NAMES + [RULE_TABLE_NAME,
+                                                                                   OUTLIER_TABLE_NAME]:
+            table_dir = os.path.join(self.output_dir, table_name)
+            if os.path.isdir(table_dir):
+                shutil.rmtree(table_dir)
+            if table_name in TABLE_NAMES:
+                os.makedirs(table_dir)
+
+    def partitions(self, table_name, df):
+        ''' (directory, rows) of every partition of the table '''
+
+        table_dir = os.path.join(self.output_dir, table_name)
+        if table_name != 'InvoiceFact':
+            return [(table_dir, df)]
+
+        date_id = df['DateID'].astype('int64')
+        return [(os.path.join(table_dir, f'Year={year}', f'Month={month:02d}'), part)
+                for (year, month), part in df.groupby([2000 + date_id // 10**8, date_id // 10**6 % 100])]
+
+    def _write_partition(self, partition_dir, df):
+        os.makedirs(partition_dir, exist_ok=True)
+
+        for file_no, file_start in enumerate(range(0, max(len(df), 1), self.rows_per_file)):
+            file_rows = df.iloc[file_start:file_start + self.rows_per_file]
+            path = os.path.join(partition_dir, f'part-{file_no:05d}.csv.gz')
+
+            # written under a temporary name, readers never see a partial file
+            with gzip.open(f'{path}.tmp', 'wt', encoding='utf-8', newline='') as f:
+                file_rows.iloc[:0].to_csv(f, index=False)
+                for start in range(0, len(file_rows), self.chunk_rows):
+                    file_rows.iloc[start:start + self.chunk_rows].to_csv(f, index=False, header=False)
+            os.replace(f'{path}.tmp', path)
+
+    def load(self, table_name, df):
+        partitions = self.partitions(table_name, df)
+
+        with metrics.timer('etl_batch_duration_seconds', table=table_name):
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                list(executor.map(lambda partition: self._write_partition(*partition), partitions))
+
+        metrics.inc('etl_rows_loaded_total', len(df), table=table_name)
+        logger.info(f"Wrote {len(df)} rows of {table_name} in {len(partitions)} partitions")
+
+
+class ColumnarSink(Sink):
+    '''
+    Memory mapped NumPy columns, one directory per table:
+
+        output_dir/InvoiceFact/manifest.json
+        output_dir/InvoiceFact/Quantity.npy
+        output_dir/InvoiceFact/StockCode.codes.npy
+        output_dir/InvoiceFact/StockCode.dict.npy
+
+    See columnar.write_table for the layout and columnar.read_table for
+    the reader. The tables are written under temporary names and replace
+    their older versions together in publish, a failed load leaves the
+    published tables as they were.
+    '''
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self._staged = []
+
+    @property
+    def path(self):
+        return self.output_dir
+
+    def create_tables(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._staged = []
+
+    def load(self, table_name, df):
+        table_dir = os.path.join(self.output_dir, table_name)
+        with metrics.timer('etl_batch_duration_seconds', table=table_name):
+            stage_table(table_dir, df)
+        self._staged.append(table_dir)
+
+        metrics.inc('etl_rows_loaded_total', len(df), table=table_name)
+        logger.info(f"Wrote {len(df)} rows of {table_name} in columns")
+
+    def publish(self):
+        for table_dir in self._staged:
+            publish_table(table_dir)
+        self._staged = []
@@ -2,6 +2,7 @@ create_invoice_fact = '''
 
     CREATE TABLE IF NOT EXISTS InvoiceFact (
        Invoice          integer,
+       IsCancellation   integer,
        StockCode        varchar(10),
        DateID           integer,
        CustomerID       char(10),
@@ -73,4 +74,361 @@ drop_customer_dim = '''
 
     DROP TABLE IF EXISTS CustomerDim;
 
-'''
\ No newline at end of file
+'''
+
+# one month of InvoiceFact, {name} is InvoiceFact_YYYY_MM
+create_invoice_fact_partition = '''
+
+    CREATE TABLE IF NOT EXISTS {name} (
+       Invoice          integer,
+       IsCancellation   integer,
+       StockCode        varchar(10),
+       DateID           integer,
+       CustomerID       char(10),
+       Quantity         integer,
+       Price            float,
+       FOREIGN KEY(StockCode) REFERENCES StockDim(StockCode),
+       FOREIGN KEY(DateID) REFERENCES DateDim(DateID),
+       FOREIGN KEY(CustomerID) REFERENCES CustomerDim(CustomerID)
+	);
+
+    '''
+
+
+# the partitioned InvoiceFact before its first month is loaded, no rows
+create_empty_invoice_fact_view = '''
+
+    CREATE VIEW IF NOT EXISTS InvoiceFact AS
+    SELECT CAST(NULL AS integer) AS Invoice, CAST(NULL AS integer) AS IsCancellation,
+           CAST(NULL AS varchar(10)) AS StockCode, CAST(NULL AS integer) AS DateID,
+           CAST(NULL AS char(10)) AS CustomerID, CAST(NULL AS integer) AS Quantity,
+           CAST(NULL AS float) AS Price
+    WHERE 0;
+
+'''
+
+
+drop_invoice_fact_view = '''
+
+    DROP VIEW IF EXISTS InvoiceFact;
+
+'''
+
+
+# compact InvoiceFact: the lines are clustered on their natural key
+# (invoice, stock code and the number of the line within them), there is no
+# rowid, and the price is stored as integer pence. The InvoiceFact view gives
+# the queries the usual columns.
+
+create_invoice_fact_compact = '''
+
+    CREATE TABLE IF NOT EXISTS InvoiceFactCompact (
+       Invoice          integer,
+       IsCancellation   integer,
+       StockCode        varchar(10),
+       LineNo           integer,
+       DateID           integer,
+       CustomerID       char(10),
+       Quantity         integer,
+       PricePence       integer,
+       PRIMARY KEY (Invoice, IsCancellation, StockCode, LineNo),
+       FOREIGN KEY(StockCode) REFERENCES StockDim(StockCode),
+       FOREIGN KEY(DateID) REFERENCES DateDim(DateID),
+       FOREIGN KEY(CustomerID) REFERENCES CustomerDim(CustomerID)
+	) WITHOUT ROWID;
+
+    '''
+
+
+create_invoice_fact_compact_view = '''
+
+    CREATE VIEW IF NOT EXISTS InvoiceFact AS
+    SELECT Invoice, IsCancellation, StockCode, DateID, CustomerID, Quantity,
+           PricePence / 100.0 AS Price
+    FROM InvoiceFactCompact;
+
+'''
+
+
+drop_invoice_fact_compact = '''
+
+    DROP TABLE IF EXISTS InvoiceFactCompact;
+
+'''
+
+
+# the cancellation lines matched to the purchases they reverse (see
+# cancellations.match_cancellations) and the purchases net of them, one row
+# per purchase invoice and stock code. Quantity is negative as in InvoiceFact.
+# Every cancellation is matched on its own, so the cancellations of one
+# purchase can add up to more than it: CancelledQuantity is capped at the
+# purchased quantity and NetQuantity is never negative, CancellationMatch
+# keeps the full quantities. Created by load.create_cancellation_match only
+# when the cancellations are matched.
+
+create_cancellation_match = '''
+
+    CREATE TABLE IF NOT EXISTS CancellationMatch (
+       CancelInvoice    integer,
+       PurchaseInvoice  integer,
+       StockCode        varchar(10),
+       CustomerID       char(10),
+       CancelDateID     integer,
+       PurchaseDateID   integer,
+       Quantity         integer
+	);
+
+    '''
+
+
+create_invoice_fact_net_view = '''
+
+    CREATE VIEW IF NOT EXISTS InvoiceFactNet AS
+    SELECT p.Invoice, p.StockCode, p.DateID, p.CustomerID, p.Quantity,
+           MIN(COALESCE(-c.Quantity, 0), p.Quantity) AS CancelledQuantity,
+           MAX(p.Quantity + COALESCE(c.Quantity, 0), 0) AS NetQuantity,
+           p.Revenue
+    FROM (SELECT Invoice, StockCode, MIN(DateID) AS DateID, MIN(CustomerID) AS CustomerID,
+                 SUM(Quantity) AS Quantity, SUM(Quantity * Price) AS Revenue
+          FROM InvoiceFact
+          WHERE IsCancellation = 0
+          GROUP BY Invoice, StockCode) p
+    LEFT JOIN (SELECT PurchaseInvoice, StockCode, SUM(Quantity) AS Quantity
+               FROM CancellationMatch
+               GROUP BY PurchaseInvoice, StockCode) c
+    ON c.PurchaseInvoice = p.Invoice AND c.StockCode = p.StockCode;
+
+'''
+
+
+drop_cancellation_match = '''
+
+    DROP TABLE IF EXISTS CancellationMatch;
+
+'''
+
+
+drop_invoice_fact_net_view = '''
+
+    DROP VIEW IF EXISTS InvoiceFactNet;
+
+'''
+
+
+# per customer features (see cleaning.create_customer_features_df) and the
+# products every customer has bought, which keep DistinctProducts exact when
+# the features of new invoices are merged into the stored ones
+
+create_customer_features = '''
+
+    CREATE TABLE IF NOT EXISTS CustomerFeatures (
+        CustomerID          VARCHAR(10) primary key,
+        FirstPurchaseDateID integer,
+        LastPurchaseDateID  integer,
+        Frequency           integer,
+        Monetary            float,
+        Cancellations       integer,
+        DistinctProducts    integer,
+        Recency             integer,
+        CancellationRate    float
+    );
+
+'''
+
+
+create_customer_product = '''
+
+    CREATE TABLE IF NOT EXISTS CustomerProduct (
+        CustomerID      VARCHAR(10),
+        StockCode       VARCHAR(10),
+        PRIMARY KEY (CustomerID, StockCode)
+    ) WITHOUT ROWID;
+
+'''
+
+
+drop_customer_features = '''
+
+    DROP TABLE IF EXISTS CustomerFeatures;
+
+'''
+
+
+drop_customer_product = '''
+
+    DROP TABLE IF EXISTS CustomerProduct;
+
+'''
+
+
+# the association rules of the purchase baskets, see basket.association_rules
+
+create_association_rule = '''
+
+    CREATE TABLE IF NOT EXISTS AssociationRule (
+        Antecedent      VARCHAR(10),
+        Consequent      VARCHAR(10),
+        Baskets         integer,
+        Support         float,
+        Confidence      float,
+        Lift            float,
+        PRIMARY KEY (Antecedent, Consequent)
+    );
+
+'''
+
+
+drop_association_rule = '''
+
+    DROP TABLE IF EXISTS AssociationRule;
+
+'''
+
+
+# the invoice lines with an extreme quantity or price for their stock code
+# and their robust z-scores, see cleaning.flag_outliers
+
+create_outlier_line = '''
+
+    CREATE TABLE IF NOT EXISTS OutlierLine (
+       Invoice          integer,
+       IsCancellation   integer,
+       StockCode        varchar(10),
+       DateID           integer,
+       CustomerID       char(10),
+       Quantity         integer,
+       Price            float,
+       QuantityScore    float,
+       PriceScore       float
+	);
+
+    '''
+
+
+drop_outlier_line = '''
+
+    DROP TABLE IF EXISTS OutlierLine;
+
+'''
+
+
+# the source files of the watcher (see ingest.Watcher), by the sha256 of
+# their contents. Status is processing, loaded or failed.
+
+create_ingestion_ledger = '''
+
+    CREATE TABLE IF NOT EXISTS IngestionLedger (
+        Digest          char(64) primary key,
+        Path            varchar(500),
+        Status          varchar(10),
+        Rows            integer,
+        StartedAt       timestamp,
+        FinishedAt      timestamp,
+        Error           text
+    );
+
+'''
+
+
+# type 2 slowly changing versions of the dimensions, one row per version.
+# RowHash is the hash of the attributes, IsCurrent marks the latest version.
+# A key has several rows, so the fact tables of a run with type 2 dimensions
+# have no foreign keys to them (see load.without_foreign_keys) and the queries
+# join the fact to Current{table}, one row per key, or compare the date of
+# the line with ValidFrom/ValidTo. A join to the table itself counts a line
+# once per version.
+
+create_stock_dim_scd2 = '''
+
+    CREATE TABLE IF NOT EXISTS StockDim (
+        StockKey        integer primary key,
+        StockCode       VARCHAR(10),
+        Description     varchar(100),
+        RowHash         integer,
+        ValidFrom       timestamp,
+        ValidTo         timestamp,
+        IsCurrent       integer
+    );
+
+'''
+
+
+create_customer_dim_scd2 = '''
+
+    CREATE TABLE IF NOT EXISTS CustomerDim (
+        CustomerKey     integer primary key,
+        CustomerID      VARCHAR(10),
+        Country         varchar(50),
+        RowHash         integer,
+        ValidFrom       timestamp,
+        ValidTo         timestamp,
+        IsCurrent       integer
+    );
+
+'''
+
+
+create_scd2_current_index = '''
+
+    CREATE UNIQUE INDEX IF NOT EXISTS {table}Current ON {table} ({key}) WHERE IsCurrent = 1;
+
+'''
+
+
+create_scd2_current_view = '''
+
+    CREATE VIEW IF NOT EXISTS Current{table} AS
+    SELECT {columns} FROM {table} WHERE IsCurrent = 1;
+
+'''
+
+
+drop_scd2_current_view = '''
+
+    DROP VIEW IF EXISTS Current{table};
+
+'''
+
+
+# secondary indexes for the star joins and group bys of the aggregation queries.
+# They are built after the bulk load (load.create_indexes), inserts into a table
+# without indexes stay fast. The fact indexes cover the measures, so the joins
+# and sums are answered from the index without reading the table.
+# {name} is InvoiceFact or a partition, {schema} is main or another attached database
+
+create_invoice_fact_indexes = [
+
+    'CREATE INDEX IF NOT EXISTS {schema}.{name}Stock ON {name} (StockCode, IsCancellation, Quantity, Price);',
+
+    'CREATE INDEX IF NOT EXISTS {schema}.{name}Customer ON {name} (CustomerID, Quantity, Price);',
+
+    'CREATE INDEX IF NOT EXISTS {schema}.{name}Date ON {name} (DateID, Quantity, Price);',
+
+]
+
+
+create_invoice_fact_compact_indexes = [
+
+    'CREATE INDEX IF NOT EXISTS InvoiceFactCompactStock ON InvoiceFactCompact (StockCode, IsCancellation, Quantity, PricePence);',
+
+    'CREATE INDEX IF NOT EXISTS InvoiceFactCompactCustomer ON InvoiceFactCompact (CustomerID, Quantity, PricePence);',
+
+    'CREATE INDEX IF NOT EXISTS InvoiceFactCompactDate ON InvoiceFactCompact (DateID, Quantity, PricePence);',
+
+]
+
+
+create_dim_indexes = [
+
+    'CREATE INDEX IF NOT EXISTS StockDimDescription ON StockDim (StockCode, Description);',
+
+    'CREATE INDEX IF NOT EXISTS CustomerDimCountry ON CustomerDim (CustomerID, Country);',
+
+]
+
+
+analyze = '''
+
+    ANALYZE;
+
+'''
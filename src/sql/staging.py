@@ -0,0 +1,250 @@
+
+# set-based versions of the cleaning.py rules, run against the Staging table.
+# rowid is the position of the row in the source file.
+
+create_staging = '''
+
+    CREATE TABLE Staging (
+        Invoice         text,
+        StockCode       text,
+        Description     text,
+        Quantity        integer,
+        InvoiceDate     text,
+        Price           float,
+        CustomerID      text,
+        Country         text
+    );
+
+'''
+
+
+drop_staging = '''
+
+    DROP TABLE IF EXISTS Staging;
+
+'''
+
+
+# drop_invalid_invoice: keep the numbers, optionally starting with C
+drop_invalid_invoice = '''
+
+    DELETE FROM Staging
+    WHERE Invoice IS NULL
+       OR NOT (
+            (Invoice GLOB '[0-9]*' AND Invoice NOT GLOB '*[^0-9]*')
+         OR (Invoice GLOB 'C[0-9]*' AND substr(Invoice, 2) NOT GLOB '*[^0-9]*')
+       );
+
+'''
+
+
+drop_positive_cancelations = '''
+
+    DELETE FROM Staging
+    WHERE Invoice GLOB 'C*' AND Quantity >= 0;
+
+'''
+
+
+drop_negative_no_cancelations = '''
+
+    DELETE FROM Staging
+    WHERE Quantity < 0 AND Invoice NOT GLOB 'C*';
+
+'''
+
+
+# keep the last of the identical rows
+drop_dups = '''
+
+    DELETE FROM Staging
+    WHERE rowid NOT IN (
+        SELECT max(rowid)
+        FROM Staging
+        GROUP BY Invoice, StockCode, Description, Quantity,
+                 InvoiceDate, Price, CustomerID, Country
+    );
+
+'''
+
+
+drop_zero_quants = '''
+
+    DELETE FROM Staging
+    WHERE Quantity = 0;
+
+'''
+
+
+drop_neg_price = '''
+
+    DELETE FROM Staging
+    WHERE Price < 0;
+
+'''
+
+
+drop_null_prices = '''
+
+    DELETE FROM Staging
+    WHERE Price IS NULL;
+
+'''
+
+
+# replace_null_customer_id: G0001, G0002, ... per invoice in order of appearance
+create_guest_ids = '''
+
+    CREATE TEMP TABLE GuestIDs AS
+    SELECT
+        Invoice,
+        'G' || printf('%04d', ROW_NUMBER() OVER (ORDER BY min(rowid))) AS CustomerID
+    FROM Staging
+    WHERE CustomerID IS NULL
+    GROUP BY Invoice;
+
+'''
+
+
+index_guest_ids = '''
+
+    CREATE UNIQUE INDEX temp.GuestIDsInvoice ON GuestIDs (Invoice);
+
+'''
+
+
+replace_null_customer_id = '''
+
+    UPDATE Staging
+    SET CustomerID = (SELECT g.CustomerID FROM GuestIDs g WHERE g.Invoice = Staging.Invoice)
+    WHERE CustomerID IS NULL;
+
+'''
+
+
+drop_guest_ids = '''
+
+    DROP TABLE IF EXISTS temp.GuestIDs;
+
+'''
+
+
+drop_invalid_customers_ids = '''
+
+    DELETE FROM Staging
+    WHERE CustomerID GLOB '*[A-Za-z]*' AND CustomerID NOT GLOB 'G*';
+
+'''
+
+
+drop_invalid_stock_cd = '''
+
+    DELETE FROM Staging
+    WHERE length(StockCode) < 5 OR length(StockCode) > 8;
+
+'''
+
+
+drop_null_descr = '''
+
+    DELETE FROM Staging
+    WHERE Description IS NULL;
+
+'''
+
+
+# the star schema, written into the attached target database dw
+
+insert_date_dim = '''
+
+    INSERT INTO dw.DateDim (DateID, Year, Month, Weekday, Hour)
+    SELECT DateID, Year, Month, Weekday, Hour
+    FROM (
+        SELECT
+            CAST(substr(strftime('%Y%m%d%H%M', InvoiceDate), 3) AS integer) AS DateID,
+            CAST(strftime('%Y', InvoiceDate) AS integer) AS Year,
+            CAST(strftime('%m', InvoiceDate) AS integer) AS Month,
+            CASE strftime('%w', InvoiceDate)
+                WHEN '0' THEN 'Sunday'
+                WHEN '1' THEN 'Monday'
+                WHEN '2' THEN 'Tuesday'
+                WHEN '3' THEN 'Wednesday'
+                WHEN '4' THEN 'Thursday'
+                WHEN '5' THEN 'Friday'
+                ELSE 'Saturday'
+            END AS Weekday,
+            CAST(strftime('%H', InvoiceDate) AS integer) AS Hour,
+            min(rowid) AS FirstRow
+        FROM Staging
+        GROUP BY 1
+    )
+    ORDER BY FirstRow;
+
+'''
+
+
+insert_stock_dim = '''
+
+    INSERT INTO dw.StockDim (StockCode, Description)
+    SELECT StockCode, normalize_description(Description)
+    FROM (
+        SELECT StockCode, Description, max(rowid) AS LastRow
+        FROM Staging
+        GROUP BY StockCode
+    )
+    ORDER BY LastRow;
+
+'''
+
+
+insert_customer_dim = '''
+
+    INSERT INTO dw.CustomerDim (CustomerID, Country)
+    SELECT CustomerID, coalesce(Country, 'Unspecified')
+    FROM (
+        SELECT CustomerID, Country, max(rowid) AS LastRow
+        FROM Staging
+        GROUP BY CustomerID
+    )
+    ORDER BY LastRow;
+
+'''
+
+
+insert_invoice_fact = '''
+
+    INSERT INTO dw.InvoiceFact (Invoice, IsCancellation, StockCode, DateID, CustomerID, Quantity, Price)
+    SELECT
+        CAST(CASE WHEN Invoice GLOB 'C*' THEN substr(Invoice, 2) ELSE Invoice END AS integer),
+        Invoice GLOB 'C*',
+        StockCode,
+        CAST(substr(strftime('%Y%m%d%H%M', InvoiceDate), 3) AS integer),
+        CustomerID,
+        Quantity,
+        Price
+    FROM Staging
+    ORDER BY rowid;
+
+'''
+
+
+# the lines of insert_invoice_fact with the country of their customer in
+# CustomerDim, the batches of sketches.StreamSketches.update
+select_sketch_lines = '''
+
+    SELECT
+        s.StockCode,
+        CAST(substr(strftime('%Y%m%d%H%M', s.InvoiceDate), 3) AS integer) AS DateID,
+        s.CustomerID,
+        s.Quantity,
+        s.Invoice GLOB 'C*' AS IsCancellation,
+        coalesce(c.Country, 'Unspecified') AS Country
+    FROM Staging s
+    JOIN (
+        SELECT CustomerID, Country, max(rowid) AS LastRow
+        FROM Staging
+        GROUP BY CustomerID
+    ) c ON c.CustomerID = s.CustomerID
+    ORDER BY s.rowid;
+
+'''
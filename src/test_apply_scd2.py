@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import pandas as pd
+
+from load import create_tables, load_fact_partitions
+from scd import apply_scd2
+
+class TestApplySCD2(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'invoicedb')
+        create_tables(self.db_path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def versions(self):
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute('SELECT StockCode, Description, ValidFrom, ValidTo, IsCurrent '
+                            'FROM StockDim ORDER BY StockKey').fetchall()
+        conn.close()
+        return rows
+
+    def test_first_run_inserts_all_members(self):
+        stock_dim_df = pd.DataFrame({'StockCode': ['85048', '79323P'],
+                                     'Description': ['glass ball', 'pink cherry lights']})
+        counts = apply_scd2('StockDim', stock_dim_df, self.db_path, valid_from='2010-01-01')
+
+        self.assertEqual(counts, {'new': 2, 'changed': 0, 'unchanged': 0})
+        self.assertEqual(self.versions(), [('85048', 'glass ball', '2010-01-01', None, 1),
+                                           ('79323P', 'pink cherry lights', '2010-01-01', None, 1)])
+
+    def test_only_changes_are_written(self):
+        apply_scd2('StockDim', pd.DataFrame({'StockCode': ['85048', '79323P'],
+                                             'Description': ['glass ball', 'pink cherry lights']}),
+                   self.db_path, valid_from='2010-01-01')
+
+        counts = apply_scd2('StockDim', pd.DataFrame({'StockCode': ['85048', '79323P', '22041'],
+                                                      'Description': ['christmas glass ball',
+                                                                      'pink cherry lights',
+                                                                      'record frame']}),
+                            self.db_path, valid_from='2010-02-01')
+
+        self.assertEqual(counts, {'new': 1, 'changed': 1, 'unchanged': 1})
+        self.assertEqual(self.versions(), [('85048', 'glass ball', '2010-01-01', '2010-02-01', 0),
+                                           ('79323P', 'pink cherry lights', '2010-01-01', None, 1),
+                                           ('85048', 'christmas glass ball', '2010-02-01', None, 1),
+                                           ('22041', 'record frame', '2010-02-01', None, 1)])
+
+    def test_history_survives_create_tables(self):
+        apply_scd2('CustomerDim', pd.DataFrame({'CustomerID': ['13085'], 'Country': ['France']}),
+                   self.db_path, valid_from='2010-01-01')
+        create_tables(self.db_path, keep_tables=('CustomerDim',))
+        counts = apply_scd2('CustomerDim', pd.DataFrame({'CustomerID': ['13085'], 'Country': ['Germany']}),
+                            self.db_path, valid_from='2010-02-01')
+
+        self.assertEqual(counts, {'new': 0, 'changed': 1, 'unchanged': 0})
+
+    def test_fact_does_not_reference_versions(self):
+        create_tables(self.db_path, partitioned=True, keep_tables=('StockDim',))
+        apply_scd2('StockDim', pd.DataFrame({'StockCode': ['85048'], 'Description': ['glass ball']}),
+                   self.db_path, valid_from='2010-01-01')
+        apply_scd2('StockDim', pd.DataFrame({'StockCode': ['85048'], 'Description': ['christmas glass ball']}),
+                   self.db_path, valid_from='2010-02-01')
+        load_fact_partitions(pd.DataFrame({'Invoice': [489434], 'IsCancellation': [0], 'StockCode': ['85048'],
+                                           'DateID': [912010735], 'CustomerID': ['13085'], 'Quantity': [12],
+                                           'Price': [6.95]}), self.db_path)
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA foreign_keys = ON')
+        conn.execute("INSERT INTO DateDim VALUES (912010735, 2009, 12, 'Tuesday', 7)")
+        conn.execute("INSERT INTO CustomerDim VALUES ('13085', 'United Kingdom')")
+        conn.execute("INSERT INTO InvoiceFact_2009_12 VALUES (489435, 0, '85048', 912010735, '13085', 6, 6.95)")
+        joined = conn.execute('SELECT f.Invoice, s.Description FROM InvoiceFact f '
+                              'JOIN CurrentStockDim s ON s.StockCode = f.StockCode').fetchall()
+        partition = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'InvoiceFact_2009_12'").fetchone()[0]
+        conn.close()
+
+        self.assertEqual(joined, [(489434, 'christmas glass ball'), (489435, 'christmas glass ball')])
+        self.assertNotIn('StockDim', partition)
+        self.assertIn('CustomerDim', partition)
+
+    def test_unknown_table(self):
+        self.assertRaises(KeyError, apply_scd2, 'DateDim', pd.DataFrame({'DateID': [1]}), self.db_path)
+
+    def test_missing_columns(self):
+        self.assertRaises(KeyError, apply_scd2, 'StockDim', pd.DataFrame({'StockCode': ['85048']}), self.db_path)
@@ -0,0 +1,61 @@
+import itertools
+import unittest
+import numpy as np
+import pandas as pd
+
+from basket import incidence_matrix, co_occurrence, association_rules
+
+class TestAssociationRules(unittest.TestCase):
+
+    def setUp(self):
+        # 85048 and 79323P are bought together in three of the four baskets
+        self.fact = pd.DataFrame({'Invoice': [1, 1, 1, 2, 2, 3, 3, 3, 4, 5],
+                                  'IsCancellation': [0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
+                                  'StockCode': ['85048', '79323P', '85048', '85048', '79323P',
+                                                '85048', '79323P', '22041', '22041', '85048']})
+
+    def test_incidence_matrix(self):
+        indptr, indices, labels = incidence_matrix(self.fact)
+
+        self.assertEqual(labels.tolist(), ['22041', '79323P', '85048'])
+        self.assertEqual(indptr.tolist(), [0, 2, 4, 7, 8])
+        self.assertEqual(indices.tolist(), [1, 2, 1, 2, 0, 1, 2, 0])
+
+    def test_co_occurrence_in_blocks(self):
+        rng = np.random.default_rng(0)
+        fact = pd.DataFrame({'Invoice': rng.integers(0, 200, 2000), 'IsCancellation': 0,
+                             'StockCode': rng.integers(0, 50, 2000).astype(str)})
+        indptr, indices, labels = incidence_matrix(fact)
+
+        expected = {}
+        for basket in range(len(indptr) - 1):
+            for pair in itertools.combinations(indices[indptr[basket]:indptr[basket + 1]], 2):
+                expected[pair] = expected.get(pair, 0) + 1
+
+        # dense, one block, and sparse counts merged over many blocks
+        for max_pairs in [10_000, 100]:
+            first, second, counts = co_occurrence(indptr, indices, len(labels), max_pairs)
+            self.assertEqual(dict(zip(zip(first, second), counts)), expected)
+
+    def test_rules(self):
+        rules = association_rules(self.fact, min_support=0.5, min_confidence=0.0)
+
+        self.assertEqual(list(rules.columns), ['Antecedent', 'Consequent', 'Baskets', 'Support',
+                                               'Confidence', 'Lift'])
+        self.assertEqual(sorted(zip(rules['Antecedent'], rules['Consequent'])),
+                         [('79323P', '85048'), ('85048', '79323P')])
+        self.assertTrue((rules['Support'] == 0.75).all())
+        self.assertTrue((rules['Confidence'] == 1).all())
+        self.assertTrue((rules['Lift'] == 4 / 3).all())
+
+    def test_top_k(self):
+        rules = association_rules(self.fact, min_support=0, min_confidence=0, top_k=1)
+
+        self.assertEqual(rules['Antecedent'].tolist(), ['22041', '79323P', '85048'])
+        self.assertEqual(rules['Consequent'].tolist(), ['79323P', '85048', '79323P'])
+
+    def test_invalid_dataframe_type(self):
+        self.assertRaises(TypeError, association_rules, 3)
+
+    def test_missing_columns(self):
+        self.assertRaises(KeyError, association_rules, pd.DataFrame({'Invoice': [1]}))
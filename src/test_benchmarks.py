@@ -0,0 +1,60 @@
+import os
+import json
+import tempfile
+import unittest
+import contextlib
+import io
+
+import benchmarks
+from etl import cli
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_every_public_function_has_a_benchmark(self):
+        self.assertEqual(sorted(benchmarks.BENCHMARKS), benchmarks.public_functions())
+
+    def test_generate_invoices(self):
+        df = benchmarks.generate_invoices(2_000, seed=1)
+        self.assertEqual(len(df), 2_000)
+        self.assertEqual(list(df.columns), ['Invoice', 'StockCode', 'Description', 'Quantity',
+                                            'InvoiceDate', 'Price', 'CustomerID', 'Country'])
+        self.assertTrue(df.equals(benchmarks.generate_invoices(2_000, seed=1)))
+        self.assertTrue(df['Invoice'].str.startswith('C').any())
+        self.assertTrue(df.duplicated().any())
+
+    def test_compare(self):
+        baseline = {'drop_dups': {'1000': 0.010, '10000': 0.100}, 'drop_zero_quants': {'1000': 0.0001}}
+        results = {'drop_dups': {'1000': 0.012, '10000': 0.200},
+                   'drop_zero_quants': {'1000': 0.0005},
+                   'drop_neg_price': {'1000': 1.0}}
+        self.assertEqual(benchmarks.compare(results, baseline, threshold=0.25),
+                         [('drop_dups', 10000, 0.100, 0.200)])
+        self.assertEqual(len(benchmarks.compare(results, baseline, threshold=0.05)), 2)
+
+    def test_save_merges_the_baseline(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'baseline.json')
+            benchmarks.save_baseline({'drop_dups': {'1000': 0.010, '10000': 0.100}}, path)
+            benchmarks.save_baseline({'drop_dups': {'1000': 0.020}, 'drop_zero_quants': {'1000': 0.001}}, path)
+
+            self.assertEqual(benchmarks.load_baseline(path),
+                             {'drop_dups': {'1000': 0.020, '10000': 0.100}, 'drop_zero_quants': {'1000': 0.001}})
+
+    def test_microbench_fails_on_regression(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'baseline.json')
+            args = ['microbench', '--sizes', '200', '--repeat', '1', '--baseline', path,
+                    '--function', 'drop_dups', '--function', 'create_stock_dim_df']
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(cli(args + ['--save']), 0)
+                with open(path) as f:
+                    baseline = json.load(f)
+                self.assertEqual(sorted(baseline['results']), ['create_stock_dim_df', 'drop_dups'])
+
+                baseline['results']['drop_dups']['200'] = 1e-9
+                with open(path, 'w') as f:
+                    json.dump(baseline, f)
+                with contextlib.redirect_stderr(io.StringIO()) as stderr:
+                    self.assertEqual(cli(args + ['--threshold', '0', '--fail']), 1)
+                self.assertIn('drop_dups', stderr.getvalue())
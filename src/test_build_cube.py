@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+from cube import build_cube, Cube
+
+class TestBuildCube(unittest.TestCase):
+
+    def setUp(self):
+        self.invoice_fct_df = pd.DataFrame({'Invoice': [489434, 489434, 489435, 489436, 489437],
+                                            'IsCancellation': [0, 0, 0, 0, 1],
+                                            'StockCode': ['85048', '79323P', '85048', '85048', '79323P'],
+                                            'DateID': [912010745, 912010745, 912010745, 1001040830, 1001040830],
+                                            'CustomerID': ['13085', '13085', '13078', 'G0001', '13078'],
+                                            'Quantity': [12, 6, 2, 1, -3],
+                                            'Price': [6.95, 1.25, 6.95, 7.0, 1.25]})
+        self.date_dim_df = pd.DataFrame({'DateID': [912010745, 1001040830],
+                                         'Year': [2009, 2010],
+                                         'Month': [12, 1],
+                                         'Weekday': ['Tuesday', 'Monday'],
+                                         'Hour': [7, 8]})
+        self.customer_dim_df = pd.DataFrame({'CustomerID': ['13085', '13078', 'G0001'],
+                                             'Country': ['United Kingdom', 'France', None]})
+        self.cube = build_cube(self.invoice_fct_df, self.date_dim_df, self.customer_dim_df)
+
+    def test_cells(self):
+        # no two lines share all six dimensions
+        self.assertEqual(len(self.cube), 5)
+        self.assertEqual(self.cube.shape, (2, 2, 7, 2, 3, 2))
+
+    def test_rollup(self):
+        by_country = self.cube.rollup('Country')
+        self.assertEqual(by_country['Country'].tolist(), ['France', 'United Kingdom', 'Unspecified'])
+        self.assertEqual(by_country['Quantity'].tolist(), [-1, 18, 1])
+        np.testing.assert_allclose(by_country['Revenue'], [2 * 6.95 - 3 * 1.25, 12 * 6.95 + 6 * 1.25, 7.0])
+
+        total = self.cube.rollup()
+        self.assertEqual(total['Quantity'].tolist(), [18])
+
+    def test_slice(self):
+        monday = self.cube.slice(Weekday='Monday', StockCode=['85048', '79323P', 'unknown'])
+        self.assertEqual(monday.rollup('StockCode')['Quantity'].tolist(), [-3, 1])
+        self.assertEqual(len(self.cube.slice(Year=2011)), 0)
+        self.assertRaises(KeyError, self.cube.slice, Customer='13085')
+
+    def test_dense(self):
+        dense = self.cube.dense('Weekday', 'Hour')
+        self.assertEqual(dense.shape, (7, 2))
+        self.assertEqual(dense[1, 0], 20)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'cube')
+            self.cube.save(path)
+            self.cube.save(path)
+            cube = Cube.load(path)
+
+            self.assertIsInstance(cube.measures['Quantity'], np.memmap)
+            pd.testing.assert_frame_equal(cube.slice(Country='France').rollup('Month', 'StockCode'),
+                                          self.cube.slice(Country='France').rollup('Month', 'StockCode'),
+                                          check_dtype=False)
+            del cube
+
+    def test_missing_dimension_rows(self):
+        self.assertRaises(ValueError, build_cube, self.invoice_fct_df, self.date_dim_df.iloc[:1],
+                          self.customer_dim_df)
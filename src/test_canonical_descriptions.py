@@ -0,0 +1,44 @@
+import unittest
+import pandas as pd
+
+from descriptions import cluster_descriptions, canonical_descriptions
+from benchmarks import generate_invoices
+from transform import transform_data
+
+class TestCanonicalDescriptions(unittest.TestCase):
+
+    def setUp(self):
+        self.descriptions = pd.Series(['pink cherry lights', 'pink cherry light', 'white cherry lights',
+                                       '15cm christmas glass ball 20 lights',
+                                       '15cm christmas glass ball 10 lights',
+                                       'strawberry ceramic trinket box', 'strawberry ceramic trinket boxes',
+                                       'cat bowl'])
+
+    def test_clusters(self):
+        clusters = cluster_descriptions(self.descriptions)
+        self.assertEqual(clusters.tolist(), [0, 0, 2, 3, 4, 5, 5, 7])
+
+    def test_different_numbers_are_not_merged(self):
+        clusters = cluster_descriptions(self.descriptions, threshold=0.5)
+        self.assertNotEqual(clusters[3], clusters[4])
+
+    def test_most_weighted_description_is_canonical(self):
+        weights = pd.Series([1, 5, 1, 1, 1, 3, 1, 1])
+        self.assertEqual(canonical_descriptions(self.descriptions, weights),
+                         {'pink cherry lights': 'pink cherry light',
+                          'strawberry ceramic trinket boxes': 'strawberry ceramic trinket box'})
+
+    def test_invalid_arguments(self):
+        self.assertRaises(TypeError, cluster_descriptions, self.descriptions.tolist())
+        self.assertRaises(ValueError, cluster_descriptions, self.descriptions, num_perm=100)
+        self.assertEqual(len(cluster_descriptions(pd.Series([], dtype=object))), 0)
+
+    def test_transform_maps_stock_dim(self):
+        data = generate_invoices(20_000)
+        _, _, stock_dim_df, _ = transform_data(data.copy())
+        _, _, clustered_stock_dim_df, _ = transform_data(data.copy(), cluster_descriptions=True)
+
+        self.assertEqual(stock_dim_df['StockCode'].tolist(), clustered_stock_dim_df['StockCode'].tolist())
+        changed = stock_dim_df['Description'] != clustered_stock_dim_df['Description']
+        self.assertTrue(changed.any())
+        self.assertLess(clustered_stock_dim_df['Description'].nunique(), stock_dim_df['Description'].nunique())
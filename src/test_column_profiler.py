@@ -0,0 +1,71 @@
+import os
+import json
+import tempfile
+import unittest
+import pandas as pd
+
+from extract import read_data_to_pd, read_data_chunks
+from profiling import ColumnProfiler
+
+class TestColumnProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp_dir.name, 'source.csv')
+        n = 3000
+        pd.DataFrame({'Invoice': [str(489434 + i // 3) for i in range(n - 1)] + ['A506401'],
+                      'StockCode': [str(10000 + i) for i in range(n - 1)] + ['POST'],
+                      'Description': ['glass ball'] * (n - 1) + [None],
+                      'Quantity': [12] * (n - 2) + [0, -2],
+                      'InvoiceDate': ['2009-12-01 07:45:00'] * (n - 1) + ['2010-12-09 20:01:00'],
+                      'Price': [6.95] * (n - 1) + [None],
+                      'Customer ID': ['13085.0'] * (n - 1) + [None],
+                      'Country': ['United Kingdom'] * n}).to_csv(self.source, index=False)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_profile(self):
+        profiler = ColumnProfiler(self.source, max_exact=1000)
+        read_data_to_pd(self.source, profiler)
+        profile = profiler.to_dict()
+        columns = profile['columns']
+
+        self.assertEqual(profile['rows'], 3000)
+        self.assertEqual(columns['Description']['nulls'], 1)
+        self.assertEqual(columns['Invoice']['invalid'], 1)
+        self.assertEqual(columns['StockCode']['invalid'], 1)
+        self.assertEqual(columns['StockCode']['length']['histogram'], {'4': 1, '5': 2999})
+        self.assertEqual((columns['Quantity']['zeros'], columns['Quantity']['negatives']), (1, 1))
+        self.assertEqual(columns['InvoiceDate']['max'], '2010-12-09T20:01:00')
+        self.assertEqual(columns['Country']['top'], [['United Kingdom', 3000]])
+
+        # more distinct values than max_exact are counted approximately
+        self.assertFalse(columns['StockCode']['distinct_exact'])
+        self.assertLess(abs(columns['StockCode']['distinct'] - 3000), 60)
+        self.assertTrue(columns['Quantity']['distinct_exact'])
+
+    def test_chunks_give_the_same_profile(self):
+        whole = ColumnProfiler(self.source)
+        read_data_to_pd(self.source, whole)
+
+        chunked = ColumnProfiler(self.source)
+        for _ in read_data_chunks(self.source, 700, chunked):
+            pass
+
+        whole, chunked = whole.to_dict(), chunked.to_dict()
+        self.assertEqual(chunked['chunks'], 5)
+        self.assertEqual(chunked['columns']['Invoice'], whole['columns']['Invoice'])
+        self.assertAlmostEqual(chunked['columns']['Quantity']['std'], whole['columns']['Quantity']['std'])
+
+    def test_write(self):
+        profiler = ColumnProfiler(self.source)
+        read_data_to_pd(self.source, profiler)
+        path = os.path.join(self.tmp_dir.name, 'profile.json')
+        profiler.write(path)
+
+        with open(path) as f:
+            self.assertEqual(json.load(f)['columns']['Price']['nulls'], 1)
+
+    def test_invalid_argument_type(self):
+        self.assertRaises(TypeError, ColumnProfiler().update, 3)
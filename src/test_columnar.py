@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+from columnar import write_table, read_table, read_arrays, read_manifest
+from sinks import ColumnarSink
+
+class TestColumnar(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.table_dir = os.path.join(self.tmp_dir.name, 'InvoiceFact')
+
+        self.df = pd.DataFrame({'Invoice': [489434, 489435, 489436],
+                                'StockCode': ['85048', '79323P', '85048'],
+                                'CustomerID': ['13085', np.nan, 'G0001'],
+                                'Quantity': [12, 6, -2],
+                                'Price': [6.95, 1.25, 2.1],
+                                'InvoiceDate': pd.to_datetime(['2009-12-01 07:45', '2009-12-01 07:45',
+                                                               '2010-01-04 08:30'])})
+        write_table(self.table_dir, self.df)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        df = read_table(self.table_dir)
+        self.assertEqual(df['StockCode'].dtype, 'category')
+        pd.testing.assert_frame_equal(df.astype({'StockCode': object, 'CustomerID': object}), self.df)
+
+    def test_strings_are_dictionary_encoded(self):
+        manifest = read_manifest(self.table_dir)
+        self.assertEqual(manifest['rows'], 3)
+        self.assertEqual([column['encoding'] for column in manifest['columns']],
+                         ['plain', 'dictionary', 'dictionary', 'plain', 'plain', 'plain'])
+
+        codes, dictionary = read_arrays(self.table_dir, ['StockCode'])['StockCode']
+        self.assertEqual(dictionary.tolist(), ['79323P', '85048'])
+        self.assertEqual(codes.tolist(), [1, 0, 1])
+        self.assertEqual(codes.dtype, np.int8)
+
+    def test_columns_are_not_copied(self):
+        df = read_table(self.table_dir, ['Quantity', 'StockCode'])
+        self.assertEqual(list(df.columns), ['Quantity', 'StockCode'])
+        self.assertIsInstance(df['Quantity'].to_numpy().base, np.memmap)
+        self.assertIsInstance(df['StockCode'].cat.codes.to_numpy().base, np.memmap)
+        self.assertFalse(df['Quantity'].to_numpy().flags.writeable)
+
+    def test_unknown_column(self):
+        self.assertRaises(KeyError, read_table, self.table_dir, ['Country'])
+
+    def test_rewrite_replaces_the_table(self):
+        write_table(self.table_dir, self.df.iloc[:1])
+        self.assertEqual(len(read_table(self.table_dir)), 1)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)), ['InvoiceFact'])
+
+    def test_sink_publishes_all_tables_together(self):
+        sink = ColumnarSink(self.tmp_dir.name)
+        sink.create_tables()
+        sink.load('InvoiceFact', self.df.iloc[:1])
+        sink.load('CustomerDim', pd.DataFrame({'CustomerID': ['13085'], 'Country': ['France']}))
+
+        # a load which fails here leaves the published tables as they were
+        self.assertEqual(len(read_table(self.table_dir)), 3)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, 'CustomerDim')))
+
+        sink.publish()
+        self.assertEqual(len(read_table(self.table_dir)), 1)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)), ['CustomerDim', 'InvoiceFact'])
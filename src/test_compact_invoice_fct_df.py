@@ -0,0 +1,69 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+from compact import compact_invoice_fct_df
+from sinks import SQLiteSink
+
+class TestCompactInvoiceFctDf(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({'Invoice': [489434, 489434, 489434, 489437],
+                                'IsCancellation': [0, 0, 0, 1],
+                                'StockCode': ['85048', '79323P', '85048', '85048'],
+                                'DateID': [912010745, 912010745, 912010745, 1001040830],
+                                'CustomerID': ['13085', '13085', '13085', 'G0001'],
+                                'Quantity': [12, 6, 1, -2],
+                                'Price': [6.95, 1.25, 0.29, 6.95]})
+
+    def test_narrow_types(self):
+        compact_df = compact_invoice_fct_df(self.df)
+
+        self.assertEqual(compact_df['PricePence'].tolist(), [695, 125, 29, 695])
+        self.assertEqual(compact_df['PricePence'].dtype, np.int16)
+        self.assertEqual(compact_df['Quantity'].dtype, np.int8)
+        self.assertEqual(compact_df['DateID'].dtype, np.int32)
+        self.assertEqual(compact_df['Invoice'].dtype, np.int32)
+        self.assertEqual(compact_df['StockCode'].dtype, 'category')
+        self.assertEqual(self.df['Price'].dtype, np.float64)
+
+    def test_line_numbers_make_the_key_unique(self):
+        compact_df = compact_invoice_fct_df(self.df)
+        self.assertEqual(compact_df['LineNo'].tolist(), [0, 0, 1, 0])
+        self.assertFalse(compact_df.duplicated(['Invoice', 'IsCancellation', 'StockCode', 'LineNo']).any())
+
+    def test_no_lines(self):
+        compact_df = compact_invoice_fct_df(self.df.iloc[:0])
+
+        self.assertEqual(len(compact_df), 0)
+        self.assertEqual(compact_df['Quantity'].dtype, np.int64)
+        self.assertEqual(compact_df['PricePence'].dtype, np.int64)
+
+    def test_fractions_of_a_penny(self):
+        self.df.loc[1, 'Price'] = 0.001
+        self.assertRaises(ValueError, compact_invoice_fct_df, self.df)
+
+    def test_missing_columns(self):
+        self.assertRaises(KeyError, compact_invoice_fct_df, self.df.drop(columns='Price'))
+        self.assertRaises(TypeError, compact_invoice_fct_df, self.df.to_dict())
+
+    def test_view_returns_the_original_rows(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'invoicedb')
+            sink = SQLiteSink(db_path, compact=True)
+            sink.create_tables()
+            sink.load('InvoiceFact', self.df)
+            sink.create_indexes()
+            sink.publish()
+
+            conn = sqlite3.connect(db_path)
+            stored = pd.read_sql('SELECT * FROM InvoiceFact ORDER BY Invoice, StockCode, Quantity', conn)
+            layout = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'InvoiceFactCompact'").fetchone()[0]
+            conn.close()
+
+        expected = self.df.sort_values(['Invoice', 'StockCode', 'Quantity']).reset_index(drop=True)
+        pd.testing.assert_frame_equal(stored, expected, check_dtype=False)
+        self.assertIn('WITHOUT ROWID', layout)
@@ -0,0 +1,21 @@
+import unittest
+import pandas as pd
+
+from cleaning import create_customer_dim_df
+
+class TestCreateCustomerDimDf(unittest.TestCase):
+
+    def test_keep_last_country(self):
+        df = pd.DataFrame({'CustomerID': ['13085', 'G0001', '13085'],
+                           'Country': ['France', None, 'Germany']})
+        customer_dim_df = create_customer_dim_df(df)
+
+        expected_df = pd.DataFrame({'CustomerID': ['G0001', '13085'],
+                                    'Country': [None, 'Germany']})
+        pd.testing.assert_frame_equal(customer_dim_df.reset_index(drop=True), expected_df)
+
+    def test_invalid_dataframe_type(self):
+        self.assertRaises(TypeError, create_customer_dim_df, 3)
+
+    def test_missing_columns(self):
+        self.assertRaises(KeyError, create_customer_dim_df, pd.DataFrame({'CustomerID': ['13085']}))
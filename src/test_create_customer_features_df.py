@@ -0,0 +1,57 @@
+import unittest
+import pandas as pd
+
+from cleaning import create_customer_features_df, create_customer_product_df
+
+class TestCreateCustomerFeaturesDf(unittest.TestCase):
+
+    def setUp(self):
+        self.fact = pd.DataFrame({'Invoice': [489434, 489434, 489500, 489501, 489600, 489601],
+                                  'IsCancellation': [0, 0, 0, 1, 0, 1],
+                                  'StockCode': ['85048', '22041', '85048', '85048', '22041', '22041'],
+                                  'DateID': [912010745, 912010745, 912111200, 912121000, 912110900, 912111000],
+                                  'CustomerID': ['13085', '13085', '13085', '13085', '12000', 'G0001'],
+                                  'Quantity': [12, 10, 24, -6, 3, -1],
+                                  'Price': [2.0, 1.0, 2.0, 2.0, 1.0, 1.0]})
+
+    def test_features(self):
+        features = create_customer_features_df(self.fact).set_index('CustomerID')
+
+        self.assertEqual(features.index.tolist(), ['12000', '13085', 'G0001'])
+        self.assertEqual(features.loc['13085', 'FirstPurchaseDateID'], 912010745)
+        self.assertEqual(features.loc['13085', 'LastPurchaseDateID'], 912111200)
+        self.assertEqual(features.loc['13085', 'Frequency'], 2)
+        self.assertEqual(features.loc['13085', 'Cancellations'], 1)
+        self.assertEqual(features.loc['13085', 'DistinctProducts'], 2)
+        self.assertAlmostEqual(features.loc['13085', 'Monetary'], 24 + 10 + 48 - 12)
+        self.assertAlmostEqual(features.loc['13085', 'CancellationRate'], 1 / 3)
+
+    def test_recency(self):
+        features = create_customer_features_df(self.fact).set_index('CustomerID')
+
+        # days to the last purchase of any customer, 2009-12-11 12:00
+        self.assertEqual(features.loc['13085', 'Recency'], 0)
+        self.assertEqual(features.loc['12000', 'Recency'], 0)
+
+        self.fact.loc[4, 'DateID'] = 912010900
+        features = create_customer_features_df(self.fact).set_index('CustomerID')
+        self.assertEqual(features.loc['12000', 'Recency'], 10)
+
+    def test_customer_without_purchases(self):
+        features = create_customer_features_df(self.fact).set_index('CustomerID')
+
+        self.assertTrue(pd.isna(features.loc['G0001', 'LastPurchaseDateID']))
+        self.assertTrue(pd.isna(features.loc['G0001', 'Recency']))
+        self.assertEqual(features.loc['G0001', 'CancellationRate'], 1)
+
+    def test_products(self):
+        products = create_customer_product_df(self.fact)
+
+        self.assertEqual(sorted(map(tuple, products.to_numpy())),
+                         [('12000', '22041'), ('13085', '22041'), ('13085', '85048')])
+
+    def test_invalid_dataframe_type(self):
+        self.assertRaises(TypeError, create_customer_features_df, 3)
+
+    def test_missing_columns(self):
+        self.assertRaises(KeyError, create_customer_features_df, pd.DataFrame({'Invoice': [489434]}))
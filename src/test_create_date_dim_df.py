@@ -0,0 +1,24 @@
+import unittest
+import pandas as pd
+
+from cleaning import create_date_cols, create_date_dim_df
+
+class TestCreateDateDimDf(unittest.TestCase):
+
+    def test_one_row_per_date_id(self):
+        df = pd.DataFrame({'InvoiceDate': pd.to_datetime(['2009-12-01 07:45', '2009-12-01 07:45',
+                                                          '2010-01-04 08:00'])})
+        date_dim_df = create_date_dim_df(create_date_cols(df))
+
+        expected_df = pd.DataFrame({'DateID': [912010745, 1001040800],
+                                    'Year': [2009, 2010],
+                                    'Month': [12, 1],
+                                    'Weekday': ['Tuesday', 'Monday'],
+                                    'Hour': [7, 8]})
+        pd.testing.assert_frame_equal(date_dim_df.reset_index(drop=True), expected_df, check_dtype=False)
+
+    def test_invalid_dataframe_type(self):
+        self.assertRaises(TypeError, create_date_dim_df, 3)
+
+    def test_missing_columns(self):
+        self.assertRaises(KeyError, create_date_dim_df, pd.DataFrame({'DateID': [912010745]}))
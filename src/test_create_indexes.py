@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import pandas as pd
+
+from load import create_tables, create_indexes, load_db, load_fact_partitions, replace_fact_partition
+
+class TestCreateIndexes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'invoicedb')
+
+        self.df = pd.DataFrame({'Invoice': [489434, 489435, 489436],
+                                'IsCancellation': [0, 0, 1],
+                                'StockCode': ['85048', '79323P', '22041'],
+                                'DateID': [912010745, 912011012, 1001040830],
+                                'CustomerID': ['13085', '13085', 'G0001'],
+                                'Quantity': [12, 6, -2],
+                                'Price': [6.95, 1.25, 2.1]})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def indexes(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return {name: table for name, table in
+                    conn.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")}
+        finally:
+            conn.close()
+
+    def test_tables_are_loaded_without_indexes(self):
+        create_tables(self.db_path)
+        load_db('InvoiceFact', self.df, self.db_path)
+        self.assertEqual(self.indexes(), {})
+
+    def test_covering_star_join_indexes(self):
+        create_tables(self.db_path)
+        load_db('InvoiceFact', self.df, self.db_path)
+        create_indexes(self.db_path)
+
+        self.assertEqual(self.indexes(), {'InvoiceFactStock': 'InvoiceFact',
+                                          'InvoiceFactCustomer': 'InvoiceFact',
+                                          'InvoiceFactDate': 'InvoiceFact',
+                                          'StockDimDescription': 'StockDim',
+                                          'CustomerDimCountry': 'CustomerDim'})
+
+        conn = sqlite3.connect(self.db_path)
+        plan = ' '.join(row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT CustomerID, SUM(Quantity * Price) FROM InvoiceFact GROUP BY CustomerID'))
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()[0], 1)
+        conn.close()
+        self.assertIn('COVERING INDEX InvoiceFactCustomer', plan)
+
+    def test_partitions_keep_their_indexes(self):
+        create_tables(self.db_path, partitioned=True)
+        load_fact_partitions(self.df, self.db_path)
+        create_indexes(self.db_path)
+        self.assertEqual(sorted(set(self.indexes().values())),
+                         ['CustomerDim', 'InvoiceFact_2009_12', 'InvoiceFact_2010_01', 'StockDim'])
+
+        replace_fact_partition(self.df.iloc[2:], 2010, 1, self.db_path)
+        self.assertEqual(sorted(name for name, table in self.indexes().items() if table == 'InvoiceFact_2010_01'),
+                         ['InvoiceFact_2010_01Customer', 'InvoiceFact_2010_01Date', 'InvoiceFact_2010_01Stock'])
@@ -0,0 +1,38 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+from cleaning import create_invoice_fct_df, create_date_cols
+
+class TestCreateInvoiceFctDf(unittest.TestCase):
+
+    def setUp(self):
+        self.data = {'Invoice': ['489434', 'C489435'],
+                     'StockCode': ['85048', '79323P'],
+                     'Description': ['a', 'b'],
+                     'Quantity': [12, -6],
+                     'InvoiceDate': pd.to_datetime(['2009-12-01 07:45', '2009-12-01 10:12']),
+                     'Price': [6.95, 1.25],
+                     'CustomerID': ['13085', 'G0001'],
+                     'Country': ['France', 'Unspecified']}
+
+    def test_typed_invoice(self):
+        fact = create_invoice_fct_df(create_date_cols(pd.DataFrame(self.data)))
+
+        self.assertEqual(list(fact.columns), ['Invoice', 'IsCancellation', 'StockCode', 'Quantity',
+                                              'Price', 'CustomerID', 'DateID'])
+        self.assertEqual(fact['Invoice'].dtype, np.int64)
+        self.assertEqual(fact['IsCancellation'].dtype, np.int8)
+        self.assertEqual(fact['Invoice'].tolist(), [489434, 489435])
+        self.assertEqual(fact['IsCancellation'].tolist(), [0, 1])
+
+    def test_invalid_invoices(self):
+        self.data['Invoice'] = ['489434', 'A506401']
+        self.assertRaises(ValueError, create_invoice_fct_df,
+                          create_date_cols(pd.DataFrame(self.data)))
+
+    def test_invalid_dataframe_type(self):
+        self.assertRaises(TypeError, create_invoice_fct_df, 3)
+
+    def test_missing_columns(self):
+        self.assertRaises(KeyError, create_invoice_fct_df, pd.DataFrame({'Invoice': ['489434']}))
@@ -0,0 +1,36 @@
+import unittest
+import pandas as pd
+
+from cleaning import create_stock_dim_df
+
+class TestCreateStockDimDf(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({'StockCode': ['85048', '79323P', '85048'],
+                                'Description': ['glass ball', 'pink cherry lights', 'christmas glass ball'],
+                                'Quantity': [12, 6, 1]})
+
+    def test_keep_last_description(self):
+        stock_dim_df = create_stock_dim_df(self.df)
+
+        expected_df = pd.DataFrame({'StockCode': ['79323P', '85048'],
+                                    'Description': ['pink cherry lights', 'christmas glass ball']})
+        pd.testing.assert_frame_equal(stock_dim_df.reset_index(drop=True), expected_df)
+
+    def test_keep_first_description(self):
+        stock_dim_df = create_stock_dim_df(self.df, val_to_keep="first")
+        self.assertEqual(stock_dim_df['Description'].tolist(), ['glass ball', 'pink cherry lights'])
+
+    def test_result_is_not_a_view(self):
+        stock_dim_df = create_stock_dim_df(self.df)
+        stock_dim_df['Description'] = stock_dim_df['Description'].str.upper()
+        self.assertEqual(self.df['Description'].iloc[0], 'glass ball')
+
+    def test_invalid_val_to_keep(self):
+        self.assertRaises(KeyError, create_stock_dim_df, self.df, "all")
+
+    def test_invalid_dataframe_type(self):
+        self.assertRaises(TypeError, create_stock_dim_df, 3)
+
+    def test_missing_columns(self):
+        self.assertRaises(KeyError, create_stock_dim_df, pd.DataFrame({'StockCode': ['85048']}))
@@ -0,0 +1,26 @@
+import sys
+import subprocess
+import unittest
+
+from etl import build_parser
+
+class TestEtlCli(unittest.TestCase):
+
+    def test_subcommands(self):
+        parser = build_parser()
+        for command in ['run', 'extract', 'load', 'bench', 'stats']:
+            self.assertEqual(parser.parse_args([command]).command, command)
+
+    def test_configurable_paths(self):
+        args = build_parser().parse_args(['run', '--data', 'a.zip', '--db', 'b.db', '--log', 'c.log'])
+        self.assertEqual((args.data, args.db, args.log), ('a.zip', 'b.db', 'c.log'))
+
+    def test_help_does_not_import_heavy_modules(self):
+        code = ("import sys, etl\n"
+                "try:\n"
+                "    etl.cli(['--help'])\n"
+                "except SystemExit:\n"
+                "    pass\n"
+                "print(sorted(m for m in ('pandas', 'numpy', 'regex', 'sqlalchemy') if m in sys.modules))")
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip().splitlines()[-1], '[]')
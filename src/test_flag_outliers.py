@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+from cleaning import outlier_scores, flag_outliers, drop_outliers
+
+class TestFlagOutliers(unittest.TestCase):
+
+    def setUp(self):
+        # 85048 sold by the dozen with a six figure entry error and one very
+        # low price, 22041 with too few lines to be scored
+        self.df = pd.DataFrame({'StockCode': ['85048'] * 12 + ['22041'] * 3,
+                                'Quantity': [12, 12, 24, 12, 6, 12, 12, 24, 12, 1, 12, 120000, 1, 500000, 2],
+                                'Price': [6.95] * 10 + [0.01, 6.95, 2.1, 2.1, 2.1]},
+                               index=np.arange(100, 115))
+
+    def test_flag_outliers(self):
+        is_outlier = flag_outliers(self.df)
+
+        self.assertTrue(is_outlier.index.equals(self.df.index))
+        # the large quantity and the low price, not the single unit
+        self.assertEqual(is_outlier[is_outlier].index.tolist(), [110, 111])
+
+    def test_scores(self):
+        scores = outlier_scores(self.df)
+
+        self.assertEqual(list(scores.columns), ['QuantityScore', 'PriceScore'])
+        self.assertGreater(scores.loc[111, 'QuantityScore'], 3.5)
+        self.assertLess(scores.loc[110, 'PriceScore'], -3.5)
+        self.assertTrue((scores.loc[112:, :] == 0).all().all())
+
+    def test_constant_groups(self):
+        # a constant price with a few higher ones and a usual pack size of 12
+        df = pd.DataFrame({'StockCode': ['22041'] * 100,
+                           'Quantity': [12] * 90 + [24] * 5 + [6] * 4 + [120000],
+                           'Price': [2.10] * 90 + [2.55] * 10})
+        scores = outlier_scores(df)
+
+        self.assertLess(scores['PriceScore'].abs().max(), 3.5)
+        self.assertLess(scores.loc[90, 'QuantityScore'], 3.5)
+        self.assertEqual(flag_outliers(df)[flag_outliers(df)].index.tolist(), [99])
+
+    def test_drop_outliers(self):
+        drop_outliers(self.df)
+
+        self.assertEqual(len(self.df), 13)
+        self.assertEqual(self.df['Quantity'].max(), 500000)
+
+    def test_invalid_argument_type(self):
+        self.assertRaises(TypeError, flag_outliers, 3)
+
+    def test_missing_required_columns(self):
+        self.assertRaises(KeyError, flag_outliers, pd.DataFrame({'StockCode': ['85048']}))
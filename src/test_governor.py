@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import governor
+from governor import MemoryGovernor
+from extract import read_data_chunks
+from etl import parse_size
+
+HEADER = 'Invoice,StockCode,Description,Quantity,InvoiceDate,Price,Customer ID,Country\n'
+ROW = '489434,85048,15CM CHRISTMAS GLASS BALL 20 LIGHTS,12,2009-12-01 07:45:00,6.95,13085.0,United Kingdom\n'
+
+class TestMemoryGovernor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp_dir.name, 'invoices.csv')
+        with open(self.source, 'w') as f:
+            f.write(HEADER + ROW * 5_000)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def plan(self, max_bytes, rss):
+        with mock.patch.object(governor, 'current_rss', return_value=rss):
+            memory_governor = MemoryGovernor(max_bytes, min_rows=10)
+            memory_governor.plan(self.source)
+        return memory_governor
+
+    def test_estimate_rows(self):
+        self.assertAlmostEqual(MemoryGovernor(2**30).estimate_rows(self.source), 5_001, delta=5)
+
+    def test_large_budget_stays_in_memory(self):
+        memory_governor = self.plan(2**40, 0)
+        self.assertFalse(memory_governor.out_of_core)
+        self.assertGreater(memory_governor.chunk_rows, 5_000)
+
+    def test_small_budget_goes_out_of_core(self):
+        memory_governor = self.plan(2**20, 0)
+        self.assertTrue(memory_governor.out_of_core)
+        self.assertLess(memory_governor.chunk_rows, 5_000)
+        self.assertGreaterEqual(memory_governor.load_batch_rows, 10)
+
+    def test_shrinks_near_the_limit(self):
+        memory_governor = self.plan(2**30, 0)
+        chunk_rows, load_batch_rows = memory_governor.chunk_rows, memory_governor.load_batch_rows
+
+        with mock.patch.object(governor, 'current_rss', return_value=2**29):
+            self.assertEqual(memory_governor.next_chunk_rows(), chunk_rows)
+        with mock.patch.object(governor, 'current_rss', return_value=2**30):
+            self.assertEqual(memory_governor.next_chunk_rows(), chunk_rows // 2)
+            self.assertEqual(memory_governor.next_load_batch_rows(), load_batch_rows // 4)
+
+        report = memory_governor.report()
+        self.assertEqual(report['shrinks'], 2)
+        self.assertGreaterEqual(report['peak_rss'], 2**30)
+
+    def test_chunks_follow_the_governor(self):
+        sizes = iter([1_000, 3_000, 500])
+        chunks = list(read_data_chunks(self.source, lambda: next(sizes, 500)))
+        self.assertEqual([len(chunk) for chunk in chunks], [1_000, 3_000, 500, 500])
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('512M'), 512 * 2**20)
+        self.assertEqual(parse_size('2g'), 2 * 2**30)
+        self.assertEqual(parse_size('1500'), 1500)
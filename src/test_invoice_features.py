@@ -0,0 +1,68 @@
+import unittest
+import pandas as pd
+
+from cleaning import invoice_features, drop_invalid_invoice, drop_positive_cancelations
+
+class TestInvoiceFeatures(unittest.TestCase):
+
+    def test_features(self):
+        df = pd.DataFrame({'Invoice': ['489434', 'C489435', 'A506401', 'C']})
+        features = invoice_features(df)
+
+        self.assertEqual(features['IsCancellation'].tolist(), [False, True, False, True])
+        self.assertEqual(features['InvoiceNo'].tolist(), [489434, 489435, pd.NA, pd.NA])
+        self.assertEqual(features['IsValid'].tolist(), [True, True, False, False])
+
+    def test_features_are_cached(self):
+        df = pd.DataFrame({'Invoice': ['489434', 'C489435']})
+        self.assertIs(invoice_features(df), invoice_features(df))
+
+    def test_cache_follows_dropped_rows(self):
+        df = pd.DataFrame({'Invoice': ['489434', 'A506401', 'C489435'],
+                           'Quantity': [1, 1, -1]})
+        invoice_features(df)
+        drop_invalid_invoice(df)
+
+        features = invoice_features(df)
+        self.assertEqual(features.index.tolist(), [0, 2])
+        self.assertEqual(features['InvoiceNo'].tolist(), [489434, 489435])
+
+    def test_cache_of_returned_dataframe(self):
+        df = pd.DataFrame({'Invoice': ['C489434', 'C489435'],
+                           'Quantity': [1, -1]})
+        df = drop_positive_cancelations(df)
+
+        features = invoice_features(df)
+        self.assertEqual(features.index.tolist(), [1])
+        self.assertEqual(features['InvoiceNo'].tolist(), [489435])
+
+    def test_only_digits_are_invoice_numbers(self):
+        df = pd.DataFrame({'Invoice': ['1.5', '1e3', '-5', ' 12', 'C12', '12']})
+        features = invoice_features(df)
+
+        self.assertEqual(features['InvoiceNo'].tolist(), [pd.NA, pd.NA, pd.NA, pd.NA, 12, 12])
+        self.assertEqual(features['IsValid'].tolist(), [False, False, False, False, True, True])
+
+    def test_cache_after_relabelled_index(self):
+        df = pd.DataFrame({'Invoice': ['C1', '2', '3']})
+        invoice_features(df)
+        df.drop(0, inplace=True)
+        df.reset_index(drop=True, inplace=True)
+
+        features = invoice_features(df)
+        self.assertEqual(features['IsCancellation'].tolist(), [False, False])
+        self.assertEqual(features['InvoiceNo'].tolist(), [2, 3])
+
+    def test_cache_after_replaced_invoices(self):
+        df = pd.DataFrame({'Invoice': ['C1', '2']})
+        invoice_features(df)
+        df['Invoice'] = ['3', 'C4']
+
+        self.assertEqual(invoice_features(df)['IsCancellation'].tolist(), [False, True])
+
+    def test_invalid_dataframe_type(self):
+        self.assertRaises(TypeError, invoice_features, 3)
+
+    def test_no_invoice_column(self):
+        df = pd.DataFrame({'ID': [1, 2, 3]})
+        self.assertRaises(KeyError, invoice_features, df)
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+
+from load import create_tables, create_indexes, load_fact_partitions, replace_fact_partition, connect_fact_partitions
+
+class TestLoadFactPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'invoicedb')
+        create_tables(self.db_path, partitioned=True)
+
+        # two rows in December 2009 and one in January 2010
+        self.df = pd.DataFrame({'Invoice': [489434, 489435, 489436],
+                                'IsCancellation': [0, 0, 1],
+                                'StockCode': ['85048', '79323P', '22041'],
+                                'DateID': [912010745, 912011012, 1001040830],
+                                'CustomerID': ['13085', '13085', 'G0001'],
+                                'Quantity': [12, 6, -2],
+                                'Price': [6.95, 1.25, 2.1]})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_one_table_per_month(self):
+        months = load_fact_partitions(self.df, self.db_path)
+        self.assertEqual(months, [(2009, 12), (2010, 1)])
+
+        conn = connect_fact_partitions(db_path=self.db_path)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM InvoiceFact').fetchone()[0], 3)
+        conn.close()
+
+    def test_empty_load_creates_the_view(self):
+        months = load_fact_partitions(self.df.iloc[0:0], self.db_path)
+        self.assertEqual(months, [])
+        create_indexes(self.db_path)
+
+        conn = connect_fact_partitions(db_path=self.db_path)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM InvoiceFact').fetchone()[0], 0)
+        conn.close()
+
+        # the first month replaces the empty view
+        load_fact_partitions(self.df, self.db_path)
+        conn = connect_fact_partitions(db_path=self.db_path)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM InvoiceFact').fetchone()[0], 3)
+        conn.close()
+
+    def test_partition_pruning(self):
+        load_fact_partitions(self.df, self.db_path)
+
+        conn = connect_fact_partitions((2010, 1), (2010, 12), db_path=self.db_path)
+        self.assertEqual(conn.execute('SELECT Invoice, IsCancellation FROM InvoiceFact').fetchall(), [(489436, 1)])
+        conn.close()
+
+        # no partitions in range gives an empty InvoiceFact
+        conn = connect_fact_partitions((2011, 1), db_path=self.db_path)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM InvoiceFact').fetchone()[0], 0)
+        conn.close()
+
+    def test_replace_single_month(self):
+        load_fact_partitions(self.df, self.db_path)
+        replace_fact_partition(self.df.iloc[:1], 2009, 12, self.db_path)
+
+        conn = connect_fact_partitions(db_path=self.db_path)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM InvoiceFact').fetchone()[0], 2)
+        conn.close()
+
+    def test_replace_with_rows_of_other_month(self):
+        load_fact_partitions(self.df, self.db_path)
+        self.assertRaises(ValueError, replace_fact_partition, self.df, 2009, 12, self.db_path)
+
+    def test_recreate_tables_drops_partitions(self):
+        load_fact_partitions(self.df, self.db_path)
+        create_tables(self.db_path)
+
+        conn = connect_fact_partitions(db_path=self.db_path)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM InvoiceFact').fetchone()[0], 0)
+        conn.close()
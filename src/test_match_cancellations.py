@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import pandas as pd
+
+from cancellations import match_cancellations
+from load import create_tables, create_cancellation_match, load_db
+
+class TestMatchCancellations(unittest.TestCase):
+
+    def setUp(self):
+        # two purchases of 85048 by 13085, cancelled after the second one,
+        # a cancellation without an earlier purchase and one of another customer
+        self.fact = pd.DataFrame({'Invoice': [489434, 489500, 489501, 489502, 489503, 489504],
+                                  'IsCancellation': [0, 0, 1, 1, 1, 0],
+                                  'StockCode': ['85048', '85048', '85048', '22041', '85048', '85048'],
+                                  'DateID': [912010745, 912051200, 912061000, 912061000, 912061100, 912070900],
+                                  'CustomerID': ['13085', '13085', '13085', '13085', '12000', '13085'],
+                                  'Quantity': [12, 24, -6, -2, -1, 3],
+                                  'Price': [6.95, 6.95, 6.95, 2.1, 6.95, 6.95]})
+
+    def test_most_recent_earlier_purchase(self):
+        matches = match_cancellations(self.fact)
+
+        self.assertEqual(list(matches.columns), ['CancelInvoice', 'PurchaseInvoice', 'StockCode', 'CustomerID',
+                                                 'CancelDateID', 'PurchaseDateID', 'Quantity'])
+        self.assertEqual(matches['CancelInvoice'].tolist(), [489501])
+        self.assertEqual(matches['PurchaseInvoice'].tolist(), [489500])
+        self.assertEqual(matches['PurchaseDateID'].tolist(), [912051200])
+        self.assertEqual(matches['Quantity'].tolist(), [-6])
+
+    def test_purchase_of_the_same_minute(self):
+        self.fact.loc[1, 'DateID'] = 912061000
+        self.fact.loc[0, 'DateID'] = 912061000
+
+        # the later invoice of the minute
+        self.assertEqual(match_cancellations(self.fact)['PurchaseInvoice'].tolist(), [489500])
+
+    def test_net_view(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'invoicedb')
+            create_tables(db_path)
+            create_cancellation_match(db_path)
+            load_db('InvoiceFact', self.fact, db_path)
+            load_db('CancellationMatch', match_cancellations(self.fact), db_path)
+
+            conn = sqlite3.connect(db_path)
+            net = pd.read_sql_query('SELECT * FROM InvoiceFactNet ORDER BY Invoice', conn)
+            conn.close()
+
+        self.assertEqual(net['Invoice'].tolist(), [489434, 489500, 489504])
+        self.assertEqual(net['CancelledQuantity'].tolist(), [0, 6, 0])
+        self.assertEqual(net['NetQuantity'].tolist(), [12, 18, 3])
+
+    def test_cancellations_above_the_purchase(self):
+        # a second cancellation of the 24 units bought in 489500
+        fact = pd.concat([self.fact, pd.DataFrame({'Invoice': [489505], 'IsCancellation': [1],
+                                                   'StockCode': ['85048'], 'DateID': [912061010],
+                                                   'CustomerID': ['13085'], 'Quantity': [-20],
+                                                   'Price': [6.95]})], ignore_index=True)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'invoicedb')
+            create_tables(db_path)
+            conn = sqlite3.connect(db_path)
+            created = conn.execute("SELECT name FROM sqlite_master WHERE name LIKE '%Net%' "
+                                   "OR name = 'CancellationMatch'").fetchall()
+            conn.close()
+
+            create_cancellation_match(db_path)
+            load_db('InvoiceFact', fact, db_path)
+            load_db('CancellationMatch', match_cancellations(fact), db_path)
+
+            conn = sqlite3.connect(db_path)
+            net = pd.read_sql_query('SELECT * FROM InvoiceFactNet WHERE Invoice = 489500', conn)
+            conn.close()
+
+        self.assertEqual(created, [])
+        self.assertEqual(net['CancelledQuantity'].tolist(), [24])
+        self.assertEqual(net['NetQuantity'].tolist(), [0])
+
+    def test_invalid_dataframe_type(self):
+        self.assertRaises(TypeError, match_cancellations, 3)
+
+    def test_missing_columns(self):
+        self.assertRaises(KeyError, match_cancellations, pd.DataFrame({'Invoice': [489434]}))
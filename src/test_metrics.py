@@ -0,0 +1,44 @@
+import os
+import json
+import tempfile
+import unittest
+
+from metrics import Metrics
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counters_and_gauges(self):
+        m = Metrics()
+        m.inc('etl_rows_dropped_total', 3, rule='drop_zero_quants')
+        m.inc('etl_rows_dropped_total', 2, rule='drop_zero_quants')
+        m.set_gauge('etl_memory_rss_bytes', 1024)
+
+        text = m.to_prometheus()
+        self.assertIn('# TYPE etl_rows_dropped_total counter', text)
+        self.assertIn('etl_rows_dropped_total{rule="drop_zero_quants"} 5', text)
+        self.assertIn('etl_memory_rss_bytes 1024', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        m = Metrics(buckets=(0.1, 1))
+        m.observe('etl_stage_duration_seconds', 0.05, stage='extract')
+        m.observe('etl_stage_duration_seconds', 0.5, stage='extract')
+        m.observe('etl_stage_duration_seconds', 5, stage='extract')
+
+        text = m.to_prometheus()
+        self.assertIn('etl_stage_duration_seconds_bucket{stage="extract",le="0.1"} 1', text)
+        self.assertIn('etl_stage_duration_seconds_bucket{stage="extract",le="1"} 2', text)
+        self.assertIn('etl_stage_duration_seconds_bucket{stage="extract",le="+Inf"} 3', text)
+        self.assertIn('etl_stage_duration_seconds_count{stage="extract"} 3', text)
+
+    def test_write_files(self):
+        m = Metrics()
+        m.inc('etl_rows_read_total', 10)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            m.write_prometheus(os.path.join(tmp_dir, 'etl.prom'))
+            m.write_json(os.path.join(tmp_dir, 'etl.json'))
+
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['etl.json', 'etl.prom'])
+            with open(os.path.join(tmp_dir, 'etl.json')) as f:
+                snapshot = json.load(f)
+            self.assertEqual(snapshot['counters'], [{'name': 'etl_rows_read_total', 'labels': {}, 'value': 10}])
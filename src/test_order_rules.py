@@ -0,0 +1,27 @@
+import unittest
+import pandas as pd
+
+from benchmarks import generate_invoices
+from transform import order_rules, transform_data, RULES_BEFORE_GUESTS
+from cleaning import drop_zero_quants, drop_dups
+
+class TestOrderRules(unittest.TestCase):
+
+    def test_same_tables(self):
+        source = generate_invoices(30_000)
+        reordered = transform_data(source.copy(), reorder_rules=True)
+        fixed = transform_data(source.copy(), reorder_rules=False)
+
+        for reordered_df, fixed_df in zip(reordered, fixed):
+            pd.testing.assert_frame_equal(reordered_df, fixed_df)
+
+    def test_selective_rule_first(self):
+        # half of the rows have zero quantities, there are no duplicates
+        data = pd.DataFrame({'Quantity': [0, 1] * 10_000, 'Price': range(20_000)})
+        ordered = order_rules(data, [drop_dups, drop_zero_quants], sample_rows=2_000)
+
+        self.assertEqual(ordered, [drop_zero_quants, drop_dups])
+
+    def test_small_frame_keeps_the_order(self):
+        data = generate_invoices(1_000)
+        self.assertEqual(order_rules(data, RULES_BEFORE_GUESTS), RULES_BEFORE_GUESTS)
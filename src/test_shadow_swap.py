@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+import pandas as pd
+
+from main import load_stage
+from load import write_lock
+from readers import ReadPool
+
+class TestShadowSwap(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'invoicedb')
+
+        self.fact = pd.DataFrame({'Invoice': [489434, 489435],
+                                  'IsCancellation': [0, 0],
+                                  'StockCode': ['85048', '79323P'],
+                                  'DateID': [912010745, 912011012],
+                                  'CustomerID': ['13085', '13085'],
+                                  'Quantity': [12, 6],
+                                  'Price': [6.95, 1.25]})
+        self.date_dim = pd.DataFrame({'DateID': [912010745, 912011012], 'Year': [2009, 2009],
+                                      'Month': [12, 12], 'Weekday': ['Tuesday', 'Tuesday'], 'Hour': [7, 10]})
+        self.stock_dim = pd.DataFrame({'StockCode': ['85048', '79323P'],
+                                       'Description': ['glass ball', 'pink cherry lights']})
+        self.customer_dim = pd.DataFrame({'CustomerID': ['13085'], 'Country': ['United Kingdom']})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def tables(self, rows):
+        return self.fact.iloc[:rows], self.date_dim, self.stock_dim, self.customer_dim
+
+    def count(self, conn):
+        return conn.execute('SELECT COUNT(*) FROM InvoiceFact').fetchone()[0]
+
+    def test_readers_see_whole_runs(self):
+        load_stage(self.tables(1), self.db_path)
+        pool = ReadPool(self.db_path, size=1)
+
+        with pool.connection() as conn:
+            self.assertEqual(self.count(conn), 1)
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertRaises(sqlite3.OperationalError, conn.execute, 'DELETE FROM InvoiceFact')
+
+        # an open connection keeps its snapshot while the next run loads and swaps
+        with pool.connection() as conn:
+            conn.execute('BEGIN')
+            self.assertEqual(self.count(conn), 1)
+            load_stage(self.tables(2), self.db_path)
+            self.assertEqual(self.count(conn), 1)
+            conn.execute('COMMIT')
+
+        with pool.connection() as conn:
+            self.assertEqual(self.count(conn), 2)
+        pool.close()
+
+        self.assertFalse(os.path.exists(f'{self.db_path}.shadow'))
+
+    def test_failed_load_keeps_the_live_database(self):
+        load_stage(self.tables(2), self.db_path)
+
+        broken = (self.fact, self.date_dim, None, self.customer_dim)
+        self.assertRaises(Exception, load_stage, broken, self.db_path)
+
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(self.count(conn), 2)
+        conn.close()
+
+        # the next run starts a fresh shadow
+        load_stage(self.tables(1), self.db_path)
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(self.count(conn), 1)
+        conn.close()
+
+    def test_consecutive_scd2_runs(self):
+        # the shadow of a type 2 run is a copy of the live WAL database
+        for rows in [2, 1, 2]:
+            load_stage(self.tables(rows), self.db_path, scd2=('StockDim', 'CustomerDim'))
+
+            conn = sqlite3.connect(self.db_path)
+            self.assertEqual(self.count(conn), rows)
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            conn.close()
+
+        for suffix in ['', '-wal', '-shm']:
+            self.assertFalse(os.path.exists(f'{self.db_path}.shadow{suffix}'))
+
+    def test_swap_waits_for_writers(self):
+        load_stage(self.tables(2), self.db_path)
+
+        with write_lock(self.db_path):
+            conn = sqlite3.connect(self.db_path)
+            run = threading.Thread(target=load_stage, args=(self.tables(1), self.db_path))
+            run.start()
+            run.join(0.5)
+
+            # the writer still has the database it opened
+            self.assertTrue(run.is_alive())
+            conn.execute('DELETE FROM InvoiceFact WHERE Invoice = 489435')
+            conn.commit()
+            conn.close()
+        run.join()
+
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute('SELECT Invoice FROM InvoiceFact').fetchall(), [(489434,)])
+        self.assertEqual(conn.execute('PRAGMA integrity_check').fetchone()[0], 'ok')
+        conn.close()
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+
+from sinks import Sink, PartitionedCSVSink
+
+class TestPartitionedCSVSink(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.sink = PartitionedCSVSink(self.tmp_dir.name, chunk_rows=2, rows_per_file=2)
+        self.sink.create_tables()
+
+        self.fact = pd.DataFrame({'Invoice': [489434, 489435, 489436, 489437],
+                                  'IsCancellation': [0, 0, 1, 0],
+                                  'StockCode': ['85048', '79323P', '22041', '22041'],
+                                  'DateID': [912010745, 912011012, 912021012, 1001040830],
+                                  'CustomerID': ['13085', '13085', 'G0001', 'G0002'],
+                                  'Quantity': [12, 6, -2, 1],
+                                  'Price': [6.95, 1.25, 2.1, 2.1]})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_fact_partitioned_by_month(self):
+        self.sink.load('InvoiceFact', self.fact)
+
+        december = os.path.join(self.tmp_dir.name, 'InvoiceFact', 'Year=2009', 'Month=12')
+        january = os.path.join(self.tmp_dir.name, 'InvoiceFact', 'Year=2010', 'Month=01')
+        self.assertEqual(sorted(os.listdir(december)), ['part-00000.csv.gz', 'part-00001.csv.gz'])
+        self.assertEqual(os.listdir(january), ['part-00000.csv.gz'])
+
+        parts = [pd.read_csv(os.path.join(december, name), dtype={'StockCode': str, 'CustomerID': str})
+                 for name in sorted(os.listdir(december))]
+        pd.testing.assert_frame_equal(pd.concat(parts, ignore_index=True), self.fact.iloc[:3])
+
+    def test_dimension_in_one_partition(self):
+        date_dim = pd.DataFrame({'DateID': [912010745], 'Year': [2009], 'Month': [12],
+                                 'Weekday': ['Tuesday'], 'Hour': [7]})
+        self.sink.load('DateDim', date_dim)
+
+        path = os.path.join(self.tmp_dir.name, 'DateDim', 'part-00000.csv.gz')
+        pd.testing.assert_frame_equal(pd.read_csv(path), date_dim)
+
+    def test_create_tables_removes_old_files(self):
+        self.sink.load('InvoiceFact', self.fact)
+        self.sink.create_tables()
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir.name, 'InvoiceFact')), [])
+
+    def test_sink_needs_create_tables_and_load(self):
+        class NoLoadSink(Sink):
+            def create_tables(self):
+                pass
+
+        self.assertRaises(TypeError, NoLoadSink)
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+from sketches import HyperLogLog, CountMinTopK, StreamSketches, sketch_tables, sketch_database
+from load import create_tables, load_db
+
+class TestStreamSketches(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n = 20_000
+        self.fact = pd.DataFrame({'Invoice': np.arange(n) // 4,
+                                  'IsCancellation': (rng.random(n) < 0.05).astype('int8'),
+                                  'StockCode': (rng.zipf(1.3, n) % 3000).astype(str),
+                                  'Quantity': rng.integers(1, 24, n),
+                                  'Price': rng.random(n) * 10,
+                                  'CustomerID': rng.integers(12000, 17000, n).astype(str),
+                                  'DateID': rng.choice([912010745, 1001041200, 1002151030], n)})
+        self.fact.loc[self.fact['IsCancellation'] == 1, 'Quantity'] *= -1
+        self.customer_dim = pd.DataFrame({'CustomerID': np.arange(12000, 17000).astype(str),
+                                          'Country': np.where(np.arange(5000) % 3, 'United Kingdom', 'France')})
+
+    def test_distinct_counts(self):
+        sketches = sketch_tables(self.fact, self.customer_dim, batch_rows=3000)
+        report = sketches.report()
+
+        exact = self.fact.groupby(self.fact['DateID'] // 10**6)['CustomerID'].nunique()
+        self.assertEqual(list(report['customers_per_month']), ['2009-12', '2010-01', '2010-02'])
+        for estimate, count in zip(report['customers_per_month'].values(), exact):
+            self.assertLess(abs(estimate - count) / count, 0.03)
+
+        countries = self.fact['CustomerID'].map(self.customer_dim.set_index('CustomerID')['Country'])
+        exact = self.fact.groupby(countries)['StockCode'].nunique()
+        for country, estimate in report['products_per_country'].items():
+            self.assertLess(abs(estimate - exact[country]) / exact[country], 0.03)
+
+    def test_merge_is_the_sketch_of_the_union(self):
+        whole = sketch_tables(self.fact, self.customer_dim)
+        first = sketch_tables(self.fact.iloc[:7000], self.customer_dim)
+        second = sketch_tables(self.fact.iloc[7000:], self.customer_dim)
+        merged = first.merge(second)
+
+        self.assertEqual(merged.report(), whole.report())
+        np.testing.assert_array_equal(merged.top_products.table, whole.top_products.table)
+
+    def test_top_products(self):
+        top = sketch_tables(self.fact, self.customer_dim).top_products.most_common()
+
+        purchases = self.fact[self.fact['IsCancellation'] == 0]
+        exact = purchases.groupby('StockCode')['Quantity'].sum()
+        # the estimates never undercount and the heaviest product is found
+        self.assertEqual(top[0][0], exact.idxmax())
+        for stock_code, quantity in top:
+            self.assertGreaterEqual(quantity, exact[stock_code])
+            self.assertLessEqual(quantity - exact[stock_code], np.e / 2**14 * exact.sum())
+
+    def test_save_and_load(self):
+        sketches = sketch_tables(self.fact, self.customer_dim)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'invoicedb.sketches.npz')
+            sketches.save(path)
+            loaded = StreamSketches.load(path)
+
+        self.assertEqual(loaded.report(), sketches.report())
+
+    def test_database_sketches(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'invoicedb')
+            create_tables(db_path)
+            load_db('InvoiceFact', self.fact, db_path)
+            load_db('CustomerDim', self.customer_dim, db_path)
+            sketches = sketch_database(db_path, batch_rows=5000)
+
+        self.assertEqual(sketches.report(), sketch_tables(self.fact, self.customer_dim).report())
+
+    def test_invalid_arguments(self):
+        self.assertRaises(KeyError, StreamSketches().update, self.fact)
+        self.assertRaises(ValueError, HyperLogLog, 20)
+        self.assertRaises(ValueError, HyperLogLog(12).merge, HyperLogLog(14))
+        self.assertRaises(ValueError, CountMinTopK().update, ['85048'], [-1])
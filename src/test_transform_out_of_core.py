@@ -0,0 +1,112 @@
+import os
+import io
+import sqlite3
+import tempfile
+import unittest
+import contextlib
+import warnings
+import pandas as pd
+
+from load import create_tables
+from main import load_stage, main
+from sinks import SQLiteSink, PartitionedCSVSink
+from sketches import StreamSketches, sketch_tables, sketches_path
+from extract import read_data_to_pd
+from transform import transform_data
+from out_of_core import transform_out_of_core
+
+SOURCE = '''Invoice,StockCode,Description,Quantity,InvoiceDate,Price,Customer ID,Country
+489434,85048,"15CM CHRISTMAS GLASS BALL 20 LIGHTS",12,2009-12-01 07:45:00,6.95,13085.0,United Kingdom
+489434,79323P,PINK CHERRY LIGHTS,12,2009-12-01 07:45:00,6.75,13085.0,United Kingdom
+489434,79323P,PINK CHERRY LIGHTS,12,2009-12-01 07:45:00,6.75,13085.0,United Kingdom
+489435,22350,"CAT BOWL ,  ",12,2009-12-01 07:46:00,2.55,,
+489435,22349,DOG BOWL CHASING BALL DESIGN,0,2009-12-01 07:46:00,3.75,,
+489436,22350,Cat bowl!,-3,2009-12-01 09:06:00,2.55,13078.0,France
+C489437,22349,DOG BOWL CHASING BALL DESIGN,-2,2009-12-01 09:08:00,3.75,,Germany
+C489438,22349,DOG BOWL CHASING BALL DESIGN,2,2009-12-01 09:08:00,3.75,13078.0,France
+A506401,B,Adjust bad debt,1,2010-04-29 13:36:00,-53594.36,,United Kingdom
+489439,POST,POSTAGE,1,2009-12-01 09:28:00,18.0,12682.0,France
+489440,21523,,4,2009-12-01 09:43:00,5.95,12682.0,France
+489441,21232,STRAWBERRY CERAMIC TRINKET BOX,24,2009-12-01 10:04:00,,X1234,United Kingdom
+489442,21232,STRAWBERRY CERAMIC TRINKET BOX,24,2009-12-01 10:04:00,1.25,X1234,United Kingdom
+489443,21232,STRAWBERRY  CERAMIC TRINKET BOX,6,2009-12-06 16:12:00,-1.0,,United Kingdom
+489444,21232,Strawberry ceramic trinket box.,6,2010-01-03 16:12:00,1.25,,United Kingdom
+489444,85048,"15CM CHRISTMAS GLASS BALL 20 LIGHTS",1,2010-01-03 16:12:00,6.95,,United Kingdom
+489445,22350,CAT BOWL,2,2010-01-04 08:00:00,2.55,13078.0,
+'''
+
+class TestTransformOutOfCore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp_dir.name, 'invoices.csv')
+        with open(self.source, 'w') as f:
+            f.write(SOURCE)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_tables(self, db_path):
+        conn = sqlite3.connect(db_path)
+        tables = {table: pd.read_sql(f'SELECT * FROM {table} ORDER BY rowid', conn)
+                  for table in ['InvoiceFact', 'DateDim', 'StockDim', 'CustomerDim']}
+        conn.close()
+        return tables
+
+    def test_same_result_as_pandas(self):
+        pandas_db = os.path.join(self.tmp_dir.name, 'pandas.db')
+        with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+            warnings.simplefilter('ignore')
+            load_stage(transform_data(read_data_to_pd(self.source)), pandas_db)
+
+        staging_db = os.path.join(self.tmp_dir.name, 'staging.db')
+        create_tables(staging_db)
+        transform_out_of_core(self.source, staging_db, chunksize=4)
+
+        expected = self.read_tables(pandas_db)
+        result = self.read_tables(staging_db)
+        for table in expected:
+            self.assertGreater(len(expected[table]), 0)
+            pd.testing.assert_frame_equal(result[table], expected[table], check_dtype=False)
+
+    def test_staging_file_is_removed(self):
+        db_path = os.path.join(self.tmp_dir.name, 'invoicedb')
+        create_tables(db_path)
+        transform_out_of_core(self.source, db_path, chunksize=4)
+        self.assertFalse(os.path.exists(f'{db_path}.staging'))
+
+    def test_sketches_of_the_staged_lines(self):
+        db_path = os.path.join(self.tmp_dir.name, 'invoicedb')
+        create_tables(db_path)
+        sketches = StreamSketches()
+        transform_out_of_core(self.source, db_path, chunksize=4, sketches=sketches)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            tables = transform_data(read_data_to_pd(self.source))
+        self.assertEqual(sketches.report(), sketch_tables(tables[0], tables[3]).report())
+
+    def test_sketches_are_saved_after_the_load(self):
+        class FailingSink(SQLiteSink):
+            def create_indexes(self):
+                raise OSError('disk full')
+
+        db_path = os.path.join(self.tmp_dir.name, 'invoicedb')
+        with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+            warnings.simplefilter('ignore')
+            self.assertRaises(OSError, main, self.source, db_path, self.tmp_dir.name,
+                              sink=FailingSink(db_path), sketches=True)
+            self.assertFalse(os.path.exists(sketches_path(db_path)))
+
+            main(self.source, db_path, self.tmp_dir.name, out_of_core=True, chunksize=4, sketches=True)
+        self.assertTrue(os.path.exists(sketches_path(db_path)))
+
+    def test_sketches_next_to_the_sink(self):
+        db_path = os.path.join(self.tmp_dir.name, 'invoicedb')
+        output_dir = os.path.join(self.tmp_dir.name, 'export')
+        with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+            warnings.simplefilter('ignore')
+            main(self.source, db_path, self.tmp_dir.name, sink=PartitionedCSVSink(output_dir), sketches=True)
+
+        self.assertTrue(os.path.exists(sketches_path(output_dir)))
+        self.assertFalse(os.path.exists(sketches_path(db_path)))
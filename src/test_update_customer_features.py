@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import pandas as pd
+
+from cleaning import create_customer_features_df, create_customer_product_df
+from features import update_customer_features
+from load import create_tables
+from main import load_stage, features_stage
+
+class TestUpdateCustomerFeatures(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'invoicedb')
+
+        self.fact = pd.DataFrame({'Invoice': [489434, 489434, 489500, 489501, 489600, 489700, 489701],
+                                  'IsCancellation': [0, 0, 0, 1, 0, 0, 0],
+                                  'StockCode': ['85048', '22041', '85048', '85048', '22041', '85048', '10002'],
+                                  'DateID': [912010745, 912010745, 912111200, 912121000, 912110900,
+                                             1001050800, 1001060800],
+                                  'CustomerID': ['13085', '13085', '13085', '13085', '12000', '13085', '14000'],
+                                  'Quantity': [12, 10, 24, -6, 3, 5, 1],
+                                  'Price': [2.0, 1.0, 2.0, 2.0, 1.0, 2.0, 0.5]})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def stored(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return pd.read_sql('SELECT * FROM CustomerFeatures ORDER BY CustomerID', conn)
+        finally:
+            conn.close()
+
+    def update(self, fact):
+        return update_customer_features(create_customer_features_df(fact), create_customer_product_df(fact),
+                                        self.db_path)
+
+    def test_merge_equals_recompute(self):
+        create_tables(self.db_path)
+        history, delta = self.fact.iloc[:5], self.fact.iloc[5:]
+
+        self.assertEqual(self.update(history), {'new': 2, 'updated': 0, 'products': 3})
+        self.assertEqual(self.update(delta), {'new': 1, 'updated': 1, 'products': 1})
+
+        expected = create_customer_features_df(self.fact)
+        pd.testing.assert_frame_equal(self.stored()[list(expected.columns)], expected,
+                                      check_dtype=False)
+
+    def test_tables_are_created(self):
+        self.update(self.fact)
+        self.assertEqual(self.stored()['CustomerID'].tolist(), ['12000', '13085', '14000'])
+
+    def test_incremental_runs_append(self):
+        # every run numbers its guests from G0001
+        runs = [self.fact.iloc[:5].assign(CustomerID=['13085', '13085', 'G0001', 'G0001', '12000']),
+                self.fact.iloc[5:].assign(CustomerID=['G0001', '14000'])]
+        for fact in runs:
+            tables = (fact, fact[['DateID']].drop_duplicates().assign(Year=2009, Month=12, Weekday='Monday', Hour=8),
+                      fact[['StockCode']].drop_duplicates().assign(Description='glass ball'),
+                      fact[['CustomerID']].drop_duplicates().assign(Country='United Kingdom'))
+            load_stage(tables, self.db_path, features=features_stage(fact), incremental_features=True)
+
+        conn = sqlite3.connect(self.db_path)
+        facts = conn.execute('SELECT COUNT(*) FROM InvoiceFact').fetchone()[0]
+        guests = conn.execute("SELECT CustomerID FROM CustomerDim WHERE CustomerID LIKE 'G%' "
+                              "ORDER BY CustomerID").fetchall()
+        conn.close()
+        stored = self.stored().set_index('CustomerID')
+
+        self.assertEqual(facts, 7)
+        self.assertEqual(guests, [('G0001',), ('G0002',)])
+        self.assertEqual(stored.loc[['G0001', 'G0002'], 'Frequency'].tolist(), [1, 1])
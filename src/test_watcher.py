@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+import pandas as pd
+
+from ingest import Watcher
+from load import create_shadow, create_tables, swap_shadow
+from scd import apply_scd2
+from sketches import StreamSketches, sketches_path
+
+class TestWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.watch_dir = os.path.join(self.tmp_dir.name, 'incoming')
+        self.db_path = os.path.join(self.tmp_dir.name, 'invoicedb')
+        os.makedirs(self.watch_dir)
+
+        self.source = pd.DataFrame({'Invoice': ['489434', '489434', 'C489435'],
+                                    'StockCode': ['85048', '79323P', '85048'],
+                                    'Description': ['glass ball', 'pink cherry lights', 'glass ball'],
+                                    'Quantity': [12, 6, -2],
+                                    'InvoiceDate': ['2009-12-01 07:45:00', '2009-12-01 07:45:00',
+                                                    '2009-12-01 10:12:00'],
+                                    'Price': [6.95, 1.25, 6.95],
+                                    'Customer ID': ['13085.0', '13085.0', '13085.0'],
+                                    'Country': ['United Kingdom'] * 3})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, df):
+        df.to_csv(os.path.join(self.watch_dir, name), index=False)
+
+    def run_watcher(self, files, sketches=False):
+        ''' Runs a watcher until files files are loaded or failed '''
+
+        stop = threading.Event()
+        done = []
+
+        def on_loaded():
+            done.append(1)
+            if len(done) == files:
+                stop.set()
+
+        watcher = Watcher(self.watch_dir, self.db_path, workers=1, interval=0.05, sketches=sketches)
+        thread = threading.Thread(target=watcher.run, args=(stop, on_loaded))
+        thread.start()
+        thread.join(60)
+        stop.set()
+        thread.join()
+        return watcher
+
+    def query(self, sql):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def test_files_are_appended_once(self):
+        self.write('a.csv', self.source)
+        self.run_watcher(1)
+        self.assertEqual(self.query('SELECT COUNT(*) FROM InvoiceFact'), [(3,)])
+
+        # a restart finds the file in the ledger, a copy has the same digest
+        later = self.source.assign(Invoice=['489500', '489500', 'C489501'])
+        self.write('copy.csv', self.source)
+        self.write('b.csv', later)
+        self.run_watcher(1)
+
+        self.assertEqual(self.query('SELECT COUNT(*) FROM InvoiceFact'), [(6,)])
+        self.assertEqual(self.query('SELECT COUNT(*) FROM StockDim'), [(2,)])
+        self.assertEqual(self.query('SELECT Path, Status, Rows FROM IngestionLedger ORDER BY Path'),
+                         [(os.path.join(self.watch_dir, 'a.csv'), 'loaded', 3),
+                          (os.path.join(self.watch_dir, 'b.csv'), 'loaded', 3)])
+
+    def test_guests_of_different_files(self):
+        self.write('a.csv', self.source.assign(**{'Customer ID': [None, None, '13085.0']}))
+        self.run_watcher(1, sketches=True)
+        self.write('b.csv', self.source.assign(Invoice=['489500', '489500', 'C489501'],
+                                               **{'Customer ID': [None, None, '13085.0']}))
+        self.run_watcher(1, sketches=True)
+
+        self.assertEqual(self.query("SELECT Invoice, CustomerID FROM InvoiceFact "
+                                    "WHERE CustomerID LIKE 'G%' ORDER BY Invoice"),
+                         [(489434, 'G0001'), (489434, 'G0001'), (489500, 'G0002'), (489500, 'G0002')])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM CustomerDim WHERE CustomerID LIKE 'G%'"), [(2,)])
+        # the two guests and 13085
+        report = StreamSketches.load(sketches_path(self.db_path)).report()
+        self.assertEqual(report['customers_per_month'], {'2009-12': 3})
+
+    def test_failed_file_is_recorded(self):
+        self.write('bad.csv', pd.DataFrame({'Invoice': ['489434']}))
+        self.run_watcher(1)
+
+        self.assertEqual(self.query('SELECT Status FROM IngestionLedger'), [('failed',)])
+        self.assertEqual(self.query('SELECT COUNT(*) FROM InvoiceFact'), [(0,)])
+
+    def test_growing_file_waits(self):
+        watcher = Watcher(self.watch_dir, self.db_path)
+        self.write('a.csv', self.source)
+
+        # taken on the second poll which sees the same size
+        self.assertEqual(watcher.new_files(), [])
+        self.assertEqual([os.path.basename(path) for _, path in watcher.new_files()], ['a.csv'])
+
+    def test_view_is_rejected(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('CREATE VIEW InvoiceFact AS SELECT 1')
+        conn.close()
+
+        self.assertRaises(ValueError, Watcher, self.watch_dir, self.db_path)
+
+    def test_ledger_survives_a_full_run(self):
+        self.write('a.csv', self.source)
+        self.run_watcher(1)
+
+        # a full run publishes a new database between two polls
+        watcher = Watcher(self.watch_dir, self.db_path)
+        shadow = create_shadow(self.db_path)
+        create_tables(shadow)
+        swap_shadow(self.db_path)
+
+        self.assertEqual(watcher.new_files(), [])
+        self.assertEqual(watcher.new_files(), [])
+        self.assertEqual(self.query('SELECT Status FROM IngestionLedger'), [('loaded',)])
+
+    def test_type_2_dimension_is_rejected(self):
+        create_tables(self.db_path, keep_tables=('StockDim',))
+        apply_scd2('StockDim', pd.DataFrame({'StockCode': ['85048'], 'Description': ['glass ball']}), self.db_path)
+
+        self.assertRaises(ValueError, Watcher, self.watch_dir, self.db_path)
@@ -1,12 +1,96 @@
+import time
 import pandas as pd
 from cleaning import *
-
-
-def transform_data(data:pd.DataFrame):
+from descriptions import canonical_descriptions
+from metrics import metrics
+
+# The rules of each group keep or drop a row by its own values (drop_dups
+# drops identical rows, which every such rule keeps or drops together), so
+# the rules of a group commute and run in the order of order_rules with the
+# same result. replace_null_customer_id numbers the guest customers in the
+# order of the remaining rows, no rule crosses it.
+RULES_BEFORE_GUESTS = [drop_dups, drop_zero_quants, drop_neg_price, drop_null_prices]
+RULES_AFTER_GUESTS = [drop_invalid_customers_ids, drop_invalid_stock_cd, drop_null_descr]
+
+RULE_MESSAGES = {'drop_dups': "Dropping duplicate rows",
+                 'drop_zero_quants': "Dropping rows with zero quantities",
+                 'drop_neg_price': "Dropping rows with negative prices",
+                 'drop_null_prices': "Dropping rows with null prices",
+                 'drop_invalid_customers_ids': "Dropping invalid customer codes",
+                 'drop_invalid_stock_cd': "Dropping Invalid stock codes",
+                 'drop_null_descr': "Dropping the stock codes that have only null descriptions"}
+
+
+def _count_dropped(rule:str, rows_before:int, data:pd.DataFrame) -> None:
+    metrics.inc('etl_rows_dropped_total', rows_before - len(data), rule=rule)
+
+
+def order_rules(data:pd.DataFrame, rules:list, sample_rows:int = 10_000, seed:int = 0) -> list:
+    '''
+    Orders commuting cleaning rules for the least total cost. Every rule
+    runs on a copy of the same sample of the rows, which gives its cost
+    per row c and the share of the rows it keeps s. A rule only runs on
+    the rows the earlier rules kept, so sorting by c / (1 - s) is the
+    cheapest order: cheap rules which drop many rows first, expensive
+    ones on the survivors. A frame of at most sample_rows rows keeps the
+    given order, measuring would cost as much as running the rules.
+
+    Parameters
+    ----------
+    data: pd.DataFrame
+        The rows the rules will run on
+    rules: list
+        Cleaning rules which drop rows in place and commute
+    sample_rows: int
+        Rows of the sample
+    seed: int
+        Seed of the sample
+
+    Returns
+    -------
+    list: the rules in the order to run them
+    '''
+
+    if len(data) <= sample_rows:
+        return list(rules)
+
+    sample = data.sample(sample_rows, random_state=seed)
+    ranks = {}
+    for rule in rules:
+        rows = sample.copy()
+        start = time.perf_counter()
+        rule(rows)
+        cost = (time.perf_counter() - start) / sample_rows
+        dropped = 1 - len(rows) / sample_rows
+        ranks[rule] = cost / dropped if dropped > 0 else float('inf')
+
+    ordered = sorted(rules, key=ranks.get)
+    logger.info(f"Rule order: {', '.join(rule.__name__ for rule in ordered)}")
+    return ordered
+
+
+def _run_rules(data:pd.DataFrame, rules:list) -> None:
+    for rule in rules:
+        logger.info(RULE_MESSAGES[rule.__name__])
+        rows = len(data)
+        rule(data)
+        _count_dropped(rule.__name__, rows, data)
+
+
+def transform_data(data:pd.DataFrame, cluster_descriptions:bool = False, remove_outliers:bool = False,
+                   reorder_rules:bool = True):
+    '''
+    Cleans the source rows and splits them into the star schema tables.
+    With reorder_rules the commuting rules run in the cheapest order
+    measured on a sample, see order_rules, the tables are the same. The
+    rows dropped by more than one rule are counted for the first of them.
+    '''
 
     # Drop invalid Invoices
     logger.info("Dropping Invoices that does not starts with C and are not digits")
+    rows = len(data)
     drop_invalid_invoice(data)
+    _count_dropped('drop_invalid_invoice', rows, data)
 
     # check if all cancelation invoices contain negative values
     logger.info("Checking if all cancelation invoices contain negative quantity values")
@@ -16,7 +100,9 @@ def transform_data(data:pd.DataFrame):
     if is_all_cancel_neg == False:
         logger.info("There are cancelation invoices with non negative quantity values.")
         logger.info("Dropping non negative cancelation invoices")
+        rows = len(data)
         data = drop_positive_cancelations(data)
+        _count_dropped('drop_positive_cancelations', rows, data)
     else:
         logger.info("All cancelations invoices contains positive quantities")   
 
@@ -30,56 +116,45 @@ def transform_data(data:pd.DataFrame):
     if is_all_neg_cancel == False:
         logger.info("There are negative quantity values that are not associated with cancelation invoices")
         logger.info("Dropping invoices with negative quantities that are not cancelations")
+        rows = len(data)
         drop_negative_no_cancelations(data)
+        _count_dropped('drop_negative_no_cancelations', rows, data)
     else:
         logger.info("There are no negative quantity values in no cancelation invoices")
 
-    # drop duplicate values if exist
-    drop_dups(data)
-
-    # drop rows which contain zero quantities 
-    logger.info("Dropping rows with zero quantities")
-    drop_zero_quants(data)
-
-    # drop rows which contain negative prices
-    logger.info("Dropping rows with negative prices")
-    drop_neg_price(data)
-
-    # drop rows which contain negative prices
-    logger.info("Dropping rows with null prices")
-    drop_null_prices(data)
+    # drop duplicate values if exist and the rows with zero quantities,
+    # negative prices or null prices
+    rules = RULES_BEFORE_GUESTS
+    _run_rules(data, order_rules(data, rules) if reorder_rules else rules)
 
     # replace null customer id with a code that starts with 'G'
     logger.info("Replacing null customer id with a unique code: Gxxxx")
     data = replace_null_customer_id(data)
 
-    # drop the invalid customer code
-    logger.info("Dropping invalid customer codes")
-    drop_invalid_customers_ids(data)
-
-    # drop the invalid stock code
-    logger.info("Dropping Invalid stock codes")
-    drop_invalid_stock_cd(data)
+    # drop the invalid customer codes, the invalid stock codes and the
+    # stock codes with only null descriptions
+    rules = RULES_AFTER_GUESTS
+    _run_rules(data, order_rules(data, rules) if reorder_rules else rules)
 
-    # drop stockcodes with only null descriptions
-    logger.info("Dropping the stock codes that have only null descriptions")
-    drop_null_descr(data)
+    # drop the lines with an extreme quantity or price for their stock code
+    if remove_outliers:
+        logger.info("Dropping the outlier quantities and prices of every stock code")
+        rows = len(data)
+        drop_outliers(data)
+        _count_dropped('drop_outliers', rows, data)
 
     logger.info("Creating the date dim dataframe")
     # create new columns (Year, Month, Day) in the df
     create_date_cols(data)
 
-    # create date dim DataFrame
-    date_dim_df = create_date_dim_df(data)
-
-    # drop duplicate date ids in date dim df
-    date_dim_df.drop_duplicates(subset=["DateID"], keep="first", inplace=True)
+    # create date dim DataFrame, keeping the first row of every date id
+    date_dim_df = create_date_dim_df(data, val_to_keep="first")
 
     logger.info("Date dim dataframe was created")
 
     logger.info("Creating the stock dim dataframe")
-    # create stock dim DataFrame
-    stock_dim_df = create_stock_dim_df(data)
+    # create stock dim DataFrame, keeping the last description of every stock code
+    stock_dim_df = create_stock_dim_df(data, val_to_keep="last")
 
     # create a stock dim df with all descriptions converted to lower case
     stock_dim_df = to_lowercase(stock_dim_df, 'Description')
@@ -89,24 +164,25 @@ def transform_data(data:pd.DataFrame):
     stock_dim_df = remove_unessecary_spaces(stock_dim_df, 'Description')
 
     # drop stock codes with null descriptions
-    print(type(stock_dim_df))
     stock_dim_df.dropna(subset=["Description"], inplace=True)
 
-    # drop duplicate stock codes in stock dim df
-    stock_dim_df.drop_duplicates(subset=["StockCode"], keep="last",inplace=True)
+    # map the near duplicate descriptions to the most sold one
+    if cluster_descriptions:
+        logger.info("Clustering the near duplicate descriptions")
+        sold_lines = stock_dim_df['StockCode'].map(data['StockCode'].value_counts())
+        mapping = canonical_descriptions(stock_dim_df['Description'], sold_lines)
+        stock_dim_df['Description'] = stock_dim_df['Description'].map(mapping).fillna(stock_dim_df['Description'])
+        logger.info(f"{len(mapping)} descriptions were mapped to a canonical description")
 
     logger.info("Stock dim dataframe was created")
 
     logger.info("Creating customer dim dataframe")
-    # create customer dim DataFrame
-    customer_dim_df = create_customer_dim_df(data)
+    # create customer dim DataFrame, keeping the last country of every customer
+    customer_dim_df = create_customer_dim_df(data, val_to_keep="last")
 
     # fill na with Unspecified
     logger.info("Replace null Countries with unspecified")
-    customer_dim_df['Country'].fillna("Unspecified", inplace=True)
-
-    # drop duplicates in customer dim DataFrame
-    customer_dim_df.drop_duplicates(subset=["CustomerID"], keep="last",inplace=True)
+    customer_dim_df['Country'] = customer_dim_df['Country'].fillna("Unspecified")
 
     logger.info("Customer dim dataframe was created")
 